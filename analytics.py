@@ -0,0 +1,188 @@
+#必考重點分析：匯入時先統計每個年份、每位老師的題目裡出現了哪些關鍵詞
+import re
+import sqlite3
+import unicodedata
+from collections import Counter
+
+import pandas as pd
+
+import db_utils
+import instrument
+import search_engine
+
+# 中文的專有名詞沒辦法靠空白切，所以用一份生化常見名詞清單來比對 (想加名詞直接加在這裡)
+BIOCHEM_VOCAB = [
+    "糖解作用", "檸檬酸循環", "電子傳遞鏈", "氧化磷酸化", "糖質新生", "肝醣", "五碳糖磷酸路徑",
+    "脂肪酸", "β氧化", "酮體", "膽固醇", "脂蛋白", "磷脂", "三酸甘油酯",
+    "胺基酸", "尿素循環", "蛋白質", "酵素", "輔酶", "抑制劑", "維生素",
+    "核苷酸", "嘌呤", "嘧啶", "DNA複製", "轉錄", "轉譯", "端粒", "突變", "修復",
+    "荷爾蒙", "胰島素", "升糖素", "血紅素", "固氮",
+]
+
+# 英文題目裡到處都有、沒有意義的字
+STOPWORDS = {
+    "the", "and", "for", "are", "was", "were", "with", "from", "that", "this", "these", "those", "which",
+    "what", "when", "where", "who", "how", "why", "following", "about", "regarding", "statement",
+    "statements", "description", "descriptions", "correct", "incorrect", "wrong", "true", "false",
+    "right", "not", "none", "all", "one", "two", "most", "least", "likely", "best", "can", "may",
+    "will", "would", "should", "could", "does", "did", "has", "have", "had", "its", "their", "than",
+    "then", "into", "during", "between", "both", "each", "other", "some", "such", "also", "only",
+    "except", "because", "used", "use", "using", "associated", "related", "above", "below",
+    "respectively", "is", "be", "by", "an", "of", "in", "on", "to", "as", "or", "at", "it",
+}
+
+# 英文字 (至少 3 個字母，可以有數字或連字號，例如 NADH、5-FU、acetyl-CoA)
+WORD = re.compile(r"[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z][A-Za-z0-9\-]*")
+
+def extract_terms(text):
+    """
+    抓出一題裡的關鍵詞 (同一題重複出現只算一次)：
+    - 中文：比對 BIOCHEM_VOCAB
+    - 英文：每個字轉小寫、去掉常見字；全大寫的縮寫 (LDL、NADH) 保留原樣
+    """
+    if not text:
+        return set()
+    text = unicodedata.normalize("NFKC", text)
+    terms = {term for term in BIOCHEM_VOCAB if term in text}
+    for word in WORD.findall(text):
+        word = word.strip("-")
+        if len(word) < 3:
+            continue
+        if not (word.isupper() and len(word) <= 6):
+            word = word.lower()
+        if word.lower() in STOPWORDS:
+            continue
+        terms.add(word)
+    return terms
+
+@instrument.timed()
+def rebuild_term_stats(db_path=db_utils.DB_NAME):
+    """
+    重新統計關鍵詞 (匯入新題目之後呼叫)：
+    term_stats  = 每個 (年份, 老師, 關鍵詞) 有幾題提到
+    term_totals = 每個 (年份, 老師) 總共有幾題 (算比例用)
+    之後的查詢都只讀這兩張小表，不用再掃過所有題目的文字。
+    回傳統計了幾個 (年份, 老師, 關鍵詞) 組合。
+    """
+    conn = db_utils._connect_for_write(db_path)
+    try:
+        counts = Counter()
+        totals = Counter()
+        for year, teacher, content, options in conn.execute(
+                "SELECT year, teacher, content, options FROM questions"):
+            totals[(year, teacher)] += 1
+            for term in extract_terms(f"{content or ''}\n{options or ''}"):
+                counts[(year, teacher, term)] += 1
+
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM term_stats")
+        conn.execute("DELETE FROM term_totals")
+        conn.executemany("INSERT INTO term_stats (year, teacher, term, question_count) VALUES (?, ?, ?, ?)",
+                         [(*key, n) for key, n in counts.items()])
+        conn.executemany("INSERT INTO term_totals (year, teacher, questions) VALUES (?, ?, ?)",
+                         [(*key, n) for key, n in totals.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(counts)
+
+def has_term_stats(db_path):
+    """ 資料庫有沒有統計過 (舊的資料庫要先跑一次 rebuild_term_stats) """
+    with search_engine.connection(db_path) as conn:
+        try:
+            return conn.execute("SELECT 1 FROM term_totals LIMIT 1").fetchone() is not None
+        except sqlite3.OperationalError:
+            return False
+
+def year_key(year):
+    """ 年份排序用：B9 要排在 B10 前面 (直接比字串的話 B9 會比 B10 大) """
+    match = re.search(r"\d+", year or "")
+    return (int(match.group()) if match else -1, year or "")
+
+def list_years(db_path):
+    """ 有統計資料的年份 (由舊到新) """
+    with search_engine.connection(db_path) as conn:
+        years = [row[0] for row in conn.execute("SELECT DISTINCT year FROM term_totals")]
+    return sorted(years, key=year_key)
+
+def _filters(db_path, teacher=None, year_from=None, year_to=None):
+    where = " WHERE 1=1"
+    params = []
+    if teacher:
+        # 跟搜尋一樣，只要名字有包含就算
+        where += " AND teacher LIKE ? ESCAPE '\\'"
+        params.append(search_engine.contains_pattern(teacher))
+    if year_from or year_to:
+        # 年份範圍要照數字比，所以先在 Python 挑出範圍內的年份
+        years = [y for y in list_years(db_path)
+                 if (not year_from or year_key(y) >= year_key(year_from))
+                 and (not year_to or year_key(y) <= year_key(year_to))]
+        where += f" AND year IN ({','.join('?' * len(years))})" if years else " AND 0"
+        params += years
+    return where, params
+
+@instrument.timed()
+def top_terms(db_path, teacher=None, year_from=None, year_to=None, limit=20):
+    """
+    最常考的關鍵詞 (例如「顏老師 B10~B13 最常考什麼」)。
+    回傳 DataFrame：關鍵詞、題數、占比 (在這個範圍的所有題目裡)、出現在幾個年份
+    """
+    where, params = _filters(db_path, teacher, year_from, year_to)
+    with search_engine.connection(db_path) as conn:
+        total = conn.execute("SELECT COALESCE(SUM(questions), 0) FROM term_totals" + where, params).fetchone()[0]
+        df = pd.read_sql_query(f"""
+        SELECT term AS 關鍵詞, SUM(question_count) AS 題數, COUNT(DISTINCT year) AS 出現年份數
+        FROM term_stats {where}
+        GROUP BY term
+        ORDER BY 題數 DESC, 出現年份數 DESC, term
+        LIMIT ?
+        """, conn, params=params + [limit])
+    df.insert(2, "占比", (df["題數"] / total).round(3) if total else 0.0)
+    return df
+
+@instrument.timed()
+def trending_terms(db_path, year=None, teacher=None, min_count=2, limit=20):
+    """
+    今年變熱門的關鍵詞：比較 year 這一年 (預設最新的一年) 跟之前所有年份「提到這個詞的題目比例」。
+    成長倍數 = (今年比例) / (以前比例)，兩邊都加 1 平滑，避免以前沒出現過就變成無限大。
+    """
+    years = list_years(db_path)
+    if not years:
+        return pd.DataFrame()
+    year = year or years[-1]
+    earlier = [y for y in years if year_key(y) < year_key(year)]
+    where, params = _filters(db_path, teacher)
+    where += f" AND year IN ({','.join('?' * (len(earlier) + 1))})"
+    params += earlier + [year]
+
+    with search_engine.connection(db_path) as conn:
+        totals = dict(conn.execute(f"""
+        SELECT year = ?, SUM(questions) FROM term_totals {where} GROUP BY year = ?
+        """, [year] + params + [year]).fetchall())
+        df = pd.read_sql_query(f"""
+        SELECT term AS 關鍵詞,
+               SUM(CASE WHEN year = ? THEN question_count ELSE 0 END) AS 今年題數,
+               SUM(CASE WHEN year != ? THEN question_count ELSE 0 END) AS 以前題數
+        FROM term_stats {where}
+        GROUP BY term
+        HAVING 今年題數 >= ?
+        """, conn, params=[year, year] + params + [min_count])
+
+    now_total = totals.get(1, 0)
+    before_total = totals.get(0, 0)
+    df["成長倍數"] = (((df["今年題數"] + 1) / (now_total + 1)) /
+                    ((df["以前題數"] + 1) / (before_total + 1))).round(2)
+    df = df.sort_values(["成長倍數", "今年題數"], ascending=False).head(limit)
+    return df.reset_index(drop=True)
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else db_utils.DB_NAME
+    db_utils.init_db(path)
+    print(f"統計了 {rebuild_term_stats(path)} 個組合")
+    print(top_terms(path, limit=10))
+    print(trending_terms(path, limit=10))
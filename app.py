@@ -1,8 +1,20 @@
 import streamlit as st
 import os
+import cProfile
+import io
+import pstats
 import pandas as pd
 import search_engine
 import pdf_generator
+import db_pool
+import federated
+import clusters
+import instrument
+import semantic
+import analytics
+import db_utils
+import jobs
+import facets
 
 # --- 設定網頁基本資訊 ---
 st.set_page_config(
@@ -11,6 +23,153 @@ st.set_page_config(
     layout="wide"
 )
 
+# --- 資料庫連線與查詢快取 ---
+@st.cache_resource
+def get_connection_pool():
+    """ 整台伺服器共用一個唯讀連線池 (所有使用者、每次重新整理都共用) """
+    return db_pool.ConnectionPool()
+
+search_engine.use_connection_pool(get_connection_pool())
+# 沒有關鍵字的搜尋、老師名單、抓重複題改讀題庫快照 (第一次用到時自動建立，資料庫有變動會自動重建)
+search_engine.use_snapshots(True)
+
+# --- 效能紀錄 ---
+# 設定環境變數 MED_EXAM_METRICS_PORT 就會開一個 Prometheus 端點；
+# MED_EXAM_METRICS_FILE 則是每次重新整理後把統計寫到那個檔案
+@st.cache_resource
+def start_metrics_server(port):
+    return instrument.serve_prometheus(int(port))
+
+if os.environ.get("MED_EXAM_METRICS_PORT"):
+    start_metrics_server(os.environ["MED_EXAM_METRICS_PORT"])
+
+# 這次重新整理呼叫到的功能都會記在這裡 (給側邊欄的除錯面板用)
+perf_records = instrument.start_collecting()
+
+# cProfile 要從頭錄，所以直接看上一次勾選的狀態 (勾選框在側邊欄，要等一下才會畫出來)
+profiler = None
+if st.session_state.get("debug_perf") and st.session_state.get("debug_profile"):
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+@st.cache_resource
+def get_pdf_cache():
+    """ 整台伺服器共用的 PDF 快取 (熱門查詢例如「B12 全部題目」只需要排版一次) """
+    return pdf_generator.PDFCache(max_bytes=128 * 1024 * 1024)
+
+# 下面這些查詢結果會被記住；db_version 是資料庫檔案的修改時間，
+# 只要有匯入新題目，version 就會變，快取自然就失效重查
+@st.cache_data(show_spinner=False)
+def load_search_page(db_path, version, year, teacher, keyword, after, page_size):
+    return search_engine.search_questions_page(db_path, year=year, teacher=teacher, keyword=keyword,
+                                               after=after, page_size=page_size)
+
+@st.cache_data(show_spinner=False)
+def load_search_count(db_path, version, year, teacher, keyword):
+    return search_engine.count_questions(db_path, year=year, teacher=teacher, keyword=keyword)
+
+# 跨資料庫的查詢：versions 是每個資料庫各自的版本，任何一個有變動就重查
+@st.cache_data(show_spinner=False)
+def load_federated_search(db_paths, versions, year, teacher, keyword):
+    return federated.federated_search(list(db_paths), year=year, teacher=teacher, keyword=keyword)
+
+# 語意索引：向量檔用 mmap 開，整台伺服器共用；索引檔重建過 (修改時間變了) 就重新開
+@st.cache_resource
+def load_semantic_index(db_path, index_mtime):
+    return semantic.SemanticIndex(db_path)
+
+def get_semantic_index(db_path):
+    if not semantic.has_index(db_path):
+        return None
+    return load_semantic_index(db_path, os.path.getmtime(semantic.vectors_path(db_path)))
+
+@st.cache_data(show_spinner=False)
+def load_semantic_stale(db_path, version, index_mtime):
+    return semantic.is_stale(db_path, get_semantic_index(db_path))
+
+@st.cache_data(show_spinner=False)
+def load_top_terms(db_path, version, teacher, year_from, year_to, limit):
+    return analytics.top_terms(db_path, teacher, year_from, year_to, limit)
+
+@st.cache_data(show_spinner=False)
+def load_trending_terms(db_path, version, year, teacher, limit):
+    return analytics.trending_terms(db_path, year, teacher, limit=limit)
+
+@st.cache_data(show_spinner=False)
+def load_facets(db_path, version):
+    # 每個 (年份, 老師, 題型) 有幾題：下拉選單、題數、空搜尋判斷都用它 (一張幾十列的小表)
+    return facets.load_facets(db_path)
+
+@st.cache_data(show_spinner=False)
+def load_duplicates(db_path, version, min_count):
+    return search_engine.find_duplicate_questions(db_path, min_count)
+
+@st.cache_data(show_spinner=False)
+def load_fuzzy_clusters(db_path, version, threshold):
+    # 匯入時已經算好的分群 (毫秒等級)；門檻太低或舊資料庫沒有分群會回傳 None，要丟到背景現場算
+    return clusters.load_clusters(db_path, threshold)
+
+# --- 背景工作 (模糊抓題、跨資料庫比對、大份 PDF) ---
+# 工作在另外的行程跑，網頁不會卡住；同樣的工作大家共用同一次計算
+@st.cache_resource
+def get_job_runner():
+    return jobs.JobRunner(snapshots=True)
+
+# 搜尋結果超過這麼多題，PDF 就丟到背景排版
+BACKGROUND_PDF_ROWS = 300
+
+@st.cache_data(show_spinner=False, max_entries=20)
+def load_job_result(job_id):
+    # job id 包含資料庫版本，同一個 id 的結果不會變，可以放心快取
+    return get_job_runner().result(job_id)
+
+def start_job(state_key, request, kind, **params):
+    """ 按下按鈕時呼叫：送出背景工作，記住是哪一個 (request = 目前的設定，設定改了就不顯示舊結果) """
+    st.session_state[state_key] = (request, get_job_runner().submit(kind, **params))
+
+@st.fragment(run_every=1)
+def job_progress(job_id):
+    """ 工作還沒跑完時顯示進度條，每秒只重畫這一小塊；跑完就整頁重新整理來顯示結果 """
+    job = get_job_runner().status(job_id)
+    if job is None or job["status"] not in jobs.ACTIVE:
+        st.rerun()
+    label = "排隊中..." if job["status"] == "queued" else f"分析中... {job['progress']:.0%}"
+    st.progress(job["progress"], text=label)
+    if st.button("取消", key=f"cancel_{job_id}"):
+        get_job_runner().cancel(job_id)
+        st.rerun()
+
+def pdf_download_button(pdf, file_name, label="📥 下載 PDF"):
+    """ pdf 可以是 bytes，或背景工作匯出好的 PDF 檔案路徑 (按下去才讀檔，不用先放進記憶體) """
+    if pdf is None:
+        st.error("無法生成 PDF，請檢查字型檔是否遺失。")
+        return
+    if isinstance(pdf, str):
+        path = pdf
+
+        def read_pdf():
+            with open(path, "rb") as f:
+                return f.read()
+        pdf = read_pdf
+    st.download_button(label=label, data=pdf, file_name=file_name, mime="application/pdf")
+
+def show_job(state_key, request, render):
+    """ 顯示 start_job 送出的工作：還在跑就顯示進度，跑完就呼叫 render(結果) """
+    saved = st.session_state.get(state_key)
+    if not saved or saved[0] != request:
+        return
+    job = get_job_runner().status(saved[1])
+    if job is None:
+        st.session_state.pop(state_key)
+    elif job["status"] in jobs.ACTIVE:
+        job_progress(saved[1])
+    elif job["status"] == "done":
+        render(load_job_result(saved[1]))
+    elif job["status"] == "cancelled":
+        st.info("工作已取消。")
+    else:
+        st.error(f"分析失敗：{job['error']}")
+
 # --- 側邊欄：設定與資料庫 ---
 with st.sidebar:
     st.header("⚙️ 設定面板")
@@ -33,15 +192,20 @@ with st.sidebar:
     # --- 修改點 2-1: 這裡加入動態老師名單 ---
     teacher_options = ["所有老師"] # 預設選項
     if db_path:
-        # 去資料庫撈老師名單
-        teachers_in_db = search_engine.get_all_teachers(db_path)
-        teacher_options += teachers_in_db
+        # 老師名單從統計表讀 (匯入時就算好了，不用掃過所有題目)
+        db_facets = load_facets(db_path, db_pool.db_version(db_path))
+        teacher_options += [name for name, _ in facets.teacher_counts(db_facets) if name is not None]
 
 
     st.divider() # 分隔線
     
     # 3. 功能模式選擇
-    mode = st.radio("功能選擇", ["🔍 搜尋題目", "⚡ 抓重複考題","✨模糊抓題（進階）"])
+    mode = st.radio("功能選擇", ["🔍 搜尋題目", "⚡ 抓重複考題","✨模糊抓題（進階）", "🧠 語意相似題", "📊 必考重點分析", "🌐 跨資料庫搜尋"])
+
+    # 4. 效能除錯面板 (預設關閉)
+    with st.expander("🛠️ 除錯工具"):
+        show_perf = st.checkbox("顯示效能面板", key="debug_perf")
+        st.checkbox("錄製 cProfile (會變慢)", key="debug_profile", disabled=not show_perf)
 
 # --- 主畫面 ---
 st.title("💊 醫學系考古題整理神器")
@@ -63,43 +227,95 @@ if mode == "🔍 搜尋題目":
     # 建立三欄排版
     col1, col2, col3 = st.columns(3)
     with col1:
-        year_input = st.text_input("年份 (例如 B12)", "")
+        # 年份改成下拉選單 (只列出真的有題目的年份)，打錯字就不會白白搜尋一次
+        year_counts = dict(facets.year_counts(db_facets))
+        year_input = st.selectbox("年份", [None] + list(year_counts),
+                                  format_func=lambda y: "所有年份" if y is None else f"{y} ({year_counts[y]} 題)")
     with col2:
         # --- 修改點 2-1: 改用 selectbox ---
-        selected_teacher = st.selectbox("出題老師", teacher_options)
+        # 旁邊的題數跟著選好的年份變
+        teacher_counts = dict(facets.teacher_counts(db_facets, year_input))
+        selected_teacher = st.selectbox("出題老師", teacher_options,
+                                        format_func=lambda t: f"{t} ({facets.count(db_facets, year_input)} 題)"
+                                        if t == "所有老師" else f"{t} ({teacher_counts.get(t, 0)} 題)")
+        # 沒標老師的題目只有選「所有老師」時找得到，另外註明，題數才加得起來
+        if teacher_counts.get(None):
+            st.caption(f"其中 {teacher_counts[None]} 題沒有標出題老師")
         # 如果選「所有老師」，搜尋時就傳入 None
         teacher_query = None if selected_teacher == "所有老師" else selected_teacher
     with col3:
         keyword_input = st.text_input("題目關鍵字", "")
 
     # 搜尋按鈕
+    # 搜尋條件記在 session_state 裡，之後按其他按鈕 (換頁、產生 PDF) 重新執行時結果才不會消失
     if st.button("開始搜尋", type="primary"):
-        # 呼叫搜尋引擎
-        df = search_engine.search_questions(
-            db_path, 
-            year=year_input if year_input else None,
-            teacher=selected_teacher if selected_teacher else None,
-            keyword=keyword_input if keyword_input else None
-        )
+        st.session_state["search_params"] = {
+            "db_path": db_path,
+            "year": year_input if year_input else None,
+            "teacher": teacher_query,
+            "keyword": keyword_input if keyword_input else None,
+        }
+        # 每一頁開頭的游標 (第一頁是 None)，換頁時就往這裡加或減
+        st.session_state["search_cursors"] = [None]
+
+    params = st.session_state.get("search_params")
+    if params and params["db_path"] == db_path:
+        version = db_pool.db_version(db_path)
+        query = (params["year"], params["teacher"], params["keyword"])
+        # 沒有關鍵字時總數直接從統計表加總；有關鍵字才跑 COUNT。結果只撈目前這一頁 (都有快取，重新整理不會重查)
+        if params["keyword"]:
+            total = load_search_count(db_path, version, *query)
+        else:
+            total = facets.count(load_facets(db_path, version), params["year"], params["teacher"])
         
-        if df.empty:
+        if total == 0:
             st.info("找不到符合條件的題目，換個關鍵字試試看？")
         else:
-            st.success(f"找到 {len(df)} 題！")
-            st.dataframe(df) # 顯示表格
-            
-            # 生成 PDF Bytes
-            pdf_bytes = pdf_generator.get_pdf_bytes(df)
+            # 換每頁筆數時回到第一頁，頁碼才會對
+            page_size = st.selectbox("每頁顯示", [20, 50, 100, 200], index=1,
+                                     on_change=lambda: st.session_state.update(search_cursors=[None]))
+            cursors = st.session_state["search_cursors"]
+            df, next_cursor = load_search_page(db_path, version, *query, cursors[-1], page_size)
+
+            page_no = len(cursors)
+            page_count = -(-total // page_size)
+            st.success(f"找到 {total} 題！(第 {page_no} / {page_count} 頁)")
+            st.dataframe(df) # 顯示表格 (只有這一頁)
+
+            prev_col, next_col = st.columns(2)
+            with prev_col:
+                if st.button("⬅️ 上一頁", disabled=page_no == 1):
+                    cursors.pop()
+                    st.rerun()
+            with next_col:
+                if st.button("下一頁 ➡️", disabled=next_cursor is None):
+                    cursors.append(next_cursor)
+                    st.rerun()
             
+            # PDF 等使用者真的要下載時才產生 (包含全部結果，不只這一頁)；
+            # 同樣的查詢條件產生過一次就會被記住
+            pdf_cache = get_pdf_cache()
+            pdf_key = (db_path, version) + query
+
+            def show_pdf_download(pdf):
+                pdf_download_button(pdf, "search_result.pdf", "📥 下載搜尋結果 PDF")
+
+            # 題目很多的話排版要很久，丟到背景一批一批排版，直接寫到檔案
+            if total > BACKGROUND_PDF_ROWS:
+                if st.button("📄 產生 PDF"):
+                    start_job("search_pdf_job", pdf_key, "search_pdf", db_path=db_path, year=query[0],
+                              teacher=query[1], keyword=query[2])
+                show_job("search_pdf_job", pdf_key, show_pdf_download)
+            elif pdf_key not in pdf_cache and st.button("📄 產生 PDF"):
+                with st.spinner("正在排版 PDF..."):
+                    pdf_cache.get_or_create(pdf_key, lambda: pdf_generator.get_pdf_bytes(
+                        search_engine.search_questions(db_path, *query)))
+                if pdf_key not in pdf_cache:
+                    st.error("無法生成 PDF，請檢查字型檔是否遺失。")
+
+            pdf_bytes = pdf_cache.get(pdf_key)
             if pdf_bytes:
-                st.download_button(
-                    label="📥 下載搜尋結果 PDF",
-                    data=pdf_bytes,
-                    file_name="search_result.pdf",
-                    mime="application/pdf"
-                )
-            else:
-                st.error("無法生成 PDF，請檢查字型檔是否遺失。")
+                show_pdf_download(pdf_bytes)
 
 # --- 模式 B: 抓重複題 ---
 elif mode == "⚡ 抓重複考題":
@@ -108,17 +324,19 @@ elif mode == "⚡ 抓重複考題":
     min_count = st.slider("至少重複幾次才顯示？", 2, 6, 2)
     
     if st.button("開始分析"):
-        df = search_engine.find_duplicate_questions(db_path, min_count)
+        df = load_duplicates(db_path, db_pool.db_version(db_path), min_count)
         
         if df.empty:
             st.info("目前沒有發現重複的題目。")
         else:
             st.success(f"發現 {len(df)} 組重複題目！這些是必考重點！")
             st.dataframe(df)
-            
-            # 這裡要注意：find_duplicate_questions 回傳的欄位跟 PDF 生成器需要的欄位不一樣
-            # 為了方便，我們暫時不提供重複題的 PDF 下載，或者你可以試著自己修改 pdf_generator 來支援這種格式
-            st.caption("目前重複題模式僅提供線上瀏覽，若需下載請至搜尋模式搜尋特定題目。")
+
+    # 重複題用「重複題報告」的樣式排版 (欄位跟搜尋結果不一樣)，在背景匯出
+    request = (db_path, min_count)
+    if st.button("📄 匯出重複題 PDF"):
+        start_job("dup_pdf_job", request, "duplicates_pdf", db_path=db_path, min_count=min_count)
+    show_job("dup_pdf_job", request, lambda pdf: pdf_download_button(pdf, "duplicates.pdf"))
 
 
 elif mode == "✨模糊抓題（進階）":
@@ -128,14 +346,7 @@ elif mode == "✨模糊抓題（進階）":
     # 設定門檻值的滑桿
     threshold = st.slider("相似度門檻 (越低抓越寬，建議 70~85)", 50, 100, 85)
     
-    if st.button("開始分析 (可能會跑一下下)"):
-        with st.spinner('正在逐題比對中...'): # 顯示轉圈圈特效
-            # ★★★ 關鍵修改在這裡！ ★★★
-            # 確保呼叫的是 search_engine 裡的 find_fuzzy_duplicates
-            # 並且傳入 db_path 和 threshold
-            df = search_engine.find_fuzzy_duplicates(db_path, threshold)
-        
-        # 顯示結果
+    def show_fuzzy_result(df):
         if df.empty:
             st.info("沒有發現相似的題目。")
         else:
@@ -143,7 +354,207 @@ elif mode == "✨模糊抓題（進階）":
             st.dataframe(df) # 顯示表格
             st.caption("註：這是透過 Python 文字比對算出來的結果。")
 
-            
+    request = (db_path, threshold)
+    if st.button("開始分析 (可能會跑一下下)"):
+        df = load_fuzzy_clusters(db_path, db_pool.db_version(db_path), threshold)
+        if df is not None:
+            st.session_state.pop("fuzzy_job", None)
+            show_fuzzy_result(df)
+            if not df.empty:
+                st.caption(clusters.APPROXIMATE_NOTE)
+        else:
+            # 沒有算好的分群：丟到背景逐題比對 (find_fuzzy_duplicates)，可以看進度、中途取消
+            start_job("fuzzy_job", request, "fuzzy_duplicates", db_path=db_path, threshold=threshold)
+    show_job("fuzzy_job", request, show_fuzzy_result)
+
+    if st.button("📄 匯出相似題 PDF"):
+        start_job("fuzzy_pdf_job", request, "duplicates_pdf", db_path=db_path, threshold=threshold)
+    show_job("fuzzy_pdf_job", request, lambda pdf: pdf_download_button(pdf, "similar_questions.pdf"))
+
+
+# --- 模式 D: 語意相似題 (換句話說也抓得到) ---
+elif mode == "🧠 語意相似題":
+    st.subheader("🧠 語意相似題")
+    st.info("把每一題轉成向量來比較「意思」，題目換句話說、順序不一樣也能找到。")
+
+    index = get_semantic_index(db_path)
+    # 索引過期時題目編號可能已經對不上 (重新匯入、刪除過)，先不讓人查，重建之後才能用
+    stale = index is not None and load_semantic_stale(db_path, db_pool.db_version(db_path),
+                                                      os.path.getmtime(semantic.vectors_path(db_path)))
+    if index is None:
+        st.warning("這個資料庫還沒有建立語意索引。")
+    elif stale:
+        st.warning("資料庫的題目有變動，語意索引已經過期，請先重新建立才能查詢。")
+
+    # 建索引、分群都要跑很久 (大題庫好幾分鐘)，丟到背景工作跑；索引檔的修改時間也算在工作裡，
+    # 重建過索引就是新的工作
+    index_mtime = os.path.getmtime(semantic.vectors_path(db_path)) if index is not None else None
+    index_request = (db_path, index_mtime)
+    if st.button("建立 / 更新語意索引 (大題庫要跑一下下)"):
+        start_job("semantic_index_job", index_request, "semantic_index", db_path=db_path, index_mtime=index_mtime)
+    show_job("semantic_index_job", index_request, lambda n: st.success(f"語意索引建立完成：{n} 題。"))
+
+    if index is not None:
+        similar_tab, cluster_tab = st.tabs(["找相似題", "語意分群"])
+
+        with similar_tab:
+            query_text = st.text_area("貼上一題題目 (或任何一段描述)", "")
+            query_id = st.number_input("或輸入題目編號 (id)", min_value=0, value=0, step=1)
+            top_k = st.slider("顯示幾題", 5, 50, 10)
+            if st.button("開始找", type="primary", disabled=stale):
+                if query_text.strip():
+                    df = semantic.find_similar(db_path, text=query_text, top_k=top_k, index=index)
+                else:
+                    df = semantic.find_similar(db_path, question_id=int(query_id), top_k=top_k, index=index)
+                if df.empty:
+                    st.info("找不到這一題，請確認題目編號。")
+                else:
+                    st.dataframe(df)
+
+        with cluster_tab:
+            sem_threshold = st.slider("語意相似度門檻 (cosine，越高越嚴格)", 0.70, 0.99, 0.90, 0.01)
+
+            def show_semantic_clusters(df):
+                if df.empty:
+                    st.info("沒有發現語意相似的題目。")
+                else:
+                    st.success(f"發現 {len(df)} 組語意相似的題目！")
+                    st.dataframe(df)
+
+            cluster_request = (db_path, sem_threshold, index_mtime)
+            if st.button("開始分群", disabled=stale):
+                start_job("semantic_cluster_job", cluster_request, "semantic_clusters", db_path=db_path,
+                          threshold=sem_threshold, index_mtime=index_mtime)
+            show_job("semantic_cluster_job", cluster_request, show_semantic_clusters)
+
+# --- 模式 E: 必考重點分析 (關鍵詞統計) ---
+elif mode == "📊 必考重點分析":
+    st.subheader("📊 必考重點分析")
+    version = db_pool.db_version(db_path)
+
+    # 用 if/else 而不是 st.stop()：頁面最後的效能面板、Prometheus 統計才會照常執行
+    if not analytics.has_term_stats(db_path):
+        st.warning("這個資料庫還沒有關鍵詞統計 (新匯入的資料庫會自動產生)。")
+        if st.button("現在統計"):
+            with st.spinner("正在統計關鍵詞..."):
+                db_utils.init_db(db_path)   # 舊的資料庫要先補上統計用的資料表
+                analytics.rebuild_term_stats(db_path)
+            st.rerun()
+    else:
+        years = analytics.list_years(db_path)
+        top_tab, trend_tab = st.tabs(["最常考的關鍵詞", "今年變熱門的關鍵詞"])
+
+        with top_tab:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                stats_teacher = st.selectbox("出題老師", teacher_options, key="stats_teacher")
+            with col2:
+                year_from = st.selectbox("從", years, index=0)
+            with col3:
+                year_to = st.selectbox("到", years, index=len(years) - 1)
+            limit = st.slider("顯示前幾名", 10, 100, 20)
+            df = load_top_terms(db_path, version, None if stats_teacher == "所有老師" else stats_teacher,
+                                year_from, year_to, limit)
+            if df.empty:
+                st.info("這個範圍沒有題目。")
+            else:
+                st.bar_chart(df.set_index("關鍵詞")["題數"])
+                st.dataframe(df)
+
+        with trend_tab:
+            col1, col2 = st.columns(2)
+            with col1:
+                trend_year = st.selectbox("哪一年", years, index=len(years) - 1)
+            with col2:
+                trend_teacher = st.selectbox("出題老師", teacher_options, key="trend_teacher")
+            st.caption("成長倍數 = 今年提到這個詞的題目比例 ÷ 以前年份的比例")
+            df = load_trending_terms(db_path, version, trend_year,
+                                     None if trend_teacher == "所有老師" else trend_teacher, 20)
+            if df.empty:
+                st.info("這一年沒有出現兩次以上的關鍵詞。")
+            else:
+                st.dataframe(df)
+
+# --- 模式 F: 跨資料庫 (一次查所有科目) ---
+elif mode == "🌐 跨資料庫搜尋":
+    st.subheader("🌐 跨資料庫搜尋")
+    all_paths = [os.path.join(db_folder, f) for f in sorted(db_files)]
+    selected_sources = st.multiselect("要一起查的資料庫", sorted(db_files), default=sorted(db_files))
+    db_paths = tuple(p for p in all_paths if os.path.basename(p) in selected_sources)
+    versions = tuple(db_pool.db_version(p) for p in db_paths)
+
+    search_tab, exact_tab, fuzzy_tab = st.tabs(["搜尋題目", "跨科目重複題", "跨科目相似題"])
+
+    with search_tab:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            fed_year = st.text_input("年份 (例如 B12)", "", key="fed_year")
+        with col2:
+            fed_teacher = st.text_input("出題老師 (可只打部分名字)", "", key="fed_teacher")
+        with col3:
+            fed_keyword = st.text_input("題目關鍵字", "", key="fed_keyword")
+
+        if st.button("搜尋所有資料庫", type="primary"):
+            df = load_federated_search(db_paths, versions, fed_year or None, fed_teacher or None, fed_keyword or None)
+            if df.empty:
+                st.info("所有資料庫都找不到符合條件的題目。")
+            else:
+                st.success(f"在 {df['source'].nunique()} 個資料庫中找到 {len(df)} 題！")
+                st.dataframe(df)
+
+    with exact_tab:
+        fed_min_count = st.slider("至少重複幾次才顯示？", 2, 10, 2, key="fed_min_count")
+        only_cross = st.checkbox("只顯示出現在不同資料庫的題目", value=True, key="fed_only_cross")
+        def show_cross_duplicates(df):
+            if df.empty:
+                st.info("沒有發現跨資料庫重複的題目。")
+            else:
+                st.success(f"發現 {len(df)} 組重複題目！")
+                st.dataframe(df)
+
+        request = (db_paths, fed_min_count, only_cross)
+        if st.button("開始分析", key="fed_exact"):
+            start_job("fed_exact_job", request, "cross_duplicates", db_paths=list(db_paths),
+                      min_count=fed_min_count, min_databases=2 if only_cross else 1)
+        show_job("fed_exact_job", request, show_cross_duplicates)
+
+    with fuzzy_tab:
+        fed_threshold = st.slider("相似度門檻 (越低抓越寬，建議 70~85)", 50, 100, 85, key="fed_threshold")
+        only_cross_fuzzy = st.checkbox("只顯示出現在不同資料庫的題目", value=True, key="fed_only_cross_fuzzy")
+        def show_cross_fuzzy(df):
+            if df.empty:
+                st.info("沒有發現相似的題目。")
+            else:
+                st.success(f"發現 {len(df)} 組相似題目！")
+                st.dataframe(df)
+
+        request = (db_paths, fed_threshold, only_cross_fuzzy)
+        if st.button("開始分析 (可能會跑一下下)", key="fed_fuzzy"):
+            start_job("fed_fuzzy_job", request, "cross_fuzzy_duplicates", db_paths=list(db_paths),
+                      threshold=fed_threshold, min_databases=2 if only_cross_fuzzy else 1)
+        show_job("fed_fuzzy_job", request, show_cross_fuzzy)
+
 # --- 頁尾簽名 ---
 st.divider()
 st.caption("Designed by 李昀臻 | 製作於某個涼爽的午後 🍃")
+
+# --- 效能面板 (放在最後，才收得到這次重新整理的所有紀錄) ---
+if profiler is not None:
+    profiler.disable()
+
+if show_perf:
+    with st.sidebar:
+        st.subheader("⏱️ 這次執行的效能")
+        if perf_records:
+            st.dataframe(pd.DataFrame(perf_records))
+        else:
+            st.caption("這次沒有呼叫到查詢功能 (或結果直接來自快取)。")
+        if profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(25)
+            st.code(stream.getvalue())
+        with st.expander("累計統計 (Prometheus 格式)"):
+            st.code(instrument.prometheus_text())
+
+if os.environ.get("MED_EXAM_METRICS_FILE"):
+    instrument.write_prometheus(os.environ["MED_EXAM_METRICS_FILE"])
@@ -0,0 +1,164 @@
+#一次匯入很多份考古題 PDF：每份 PDF 依檔名分到對應的資料庫，不同資料庫的 PDF 同時解析
+import argparse
+import fnmatch
+import glob
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import exam_parser
+
+def find_pdfs(inputs):
+    """ 把資料夾 / glob / 檔名展開成 PDF 清單 (依檔名排序，重複的只留一個) """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths += glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)
+        else:
+            paths += glob.glob(item, recursive=True) or [item]
+    return sorted(dict.fromkeys(os.path.abspath(p) for p in paths if p.lower().endswith(".pdf")))
+
+def parse_mapping(items):
+    """ 把 ["*生化*=databases/生化.db", ...] 轉成 [(檔名規則, 資料庫), ...] (照順序比對，先符合的優先) """
+    mapping = []
+    for item in items:
+        pattern, sep, db_path = item.partition("=")
+        if not sep or not pattern or not db_path:
+            raise ValueError(f"對應規則要寫成 檔名規則=資料庫，例如 '*生化*=databases/生化.db'：{item}")
+        mapping.append((pattern, db_path))
+    return mapping
+
+def plan_imports(pdf_paths, mapping, default_db=None):
+    """
+    決定每份 PDF 要匯入哪個資料庫，回傳 {資料庫: [PDF, ...]}。
+    沒有符合任何規則、也沒有預設資料庫的 PDF 會直接報錯 (不要匯入到一半才發現)。
+    """
+    plan = {}
+    unmatched = []
+    for path in pdf_paths:
+        name = os.path.basename(path)
+        db_path = next((db for pattern, db in mapping if fnmatch.fnmatch(name, pattern)), default_db)
+        if db_path is None:
+            unmatched.append(name)
+            continue
+        plan.setdefault(db_path, []).append(path)
+    if unmatched:
+        raise ValueError(f"這些 PDF 不知道要匯入哪個資料庫 (加上 --map 或 --db)：{', '.join(unmatched)}")
+
+    # 匯入紀錄是用檔名 (不含資料夾) 認 PDF 的，同一個資料庫裡不能有兩份同名的 PDF
+    for db_path, paths in plan.items():
+        names = [os.path.basename(p) for p in paths]
+        duplicated = sorted({n for n in names if names.count(n) > 1})
+        if duplicated:
+            raise ValueError(f"{db_path} 裡有同名的 PDF：{', '.join(duplicated)}")
+    return plan
+
+def _init_worker():
+    # 工作行程的輸出接到管線時是整塊整塊送的，改成一行一行送，才不會切在一行的中間
+    sys.stdout.reconfigure(line_buffering=True)
+
+def _import_one(pdf_path, db_path, course, page_workers, batch_size):
+    """ 在工作行程裡匯入一份 PDF (一律用增量模式：沒變的跳過、中斷後重跑不會重複寫入) """
+    start = time.perf_counter()
+    result = exam_parser.import_pdf(pdf_path, db_path, batch_size=batch_size, workers=page_workers,
+                                    incremental=True, course=course)
+    elapsed = time.perf_counter() - start
+    if result is None:
+        return {"pdf": pdf_path, "db": db_path, "skipped": True, "questions": 0, "pages": 0, "seconds": elapsed}
+    questions, pages = result
+    return {"pdf": pdf_path, "db": db_path, "skipped": False,
+            "questions": questions, "pages": pages, "seconds": elapsed}
+
+def _report(result):
+    # 工作行程也會印東西到同一個終端機，這邊也每行馬上送出
+    name = os.path.basename(result["pdf"])
+    if result["skipped"]:
+        print(f"⏭️  {name} → {result['db']}：沒有變動，跳過", flush=True)
+        return
+    seconds = max(result["seconds"], 1e-9)
+    print(f"✅ {name} → {result['db']}：{result['pages']} 頁、{result['questions']} 題，"
+          f"{result['seconds']:.1f} 秒 ({result['pages'] / seconds:.1f} 頁/秒、{result['questions'] / seconds:.1f} 題/秒)", flush=True)
+
+def run_batch(plan, course=exam_parser.DEFAULT_COURSE, workers=None, page_workers=1, batch_size=500):
+    """
+    依 plan ({資料庫: [PDF, ...]}) 匯入，回傳每份 PDF 的結果 (list of dict)。
+    SQLite 同一時間只能有一個人寫入，所以同一個資料庫的 PDF 一份接一份匯入；
+    不同資料庫的 PDF 分給不同行程同時跑 (workers = 最多同時幾份，預設 CPU 核心數)。
+    每份 PDF 在一個交易裡寫完，中途中斷不會留下一半的題目；重跑時已經匯入好的 PDF 會直接跳過。
+    全部匯入完，每個資料庫再一次更新相似題分群和關鍵詞統計。
+    """
+    workers = min(workers or os.cpu_count() or 1, len(plan)) or 1
+    for db_path in plan:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    queues = {db_path: list(paths) for db_path, paths in plan.items()}
+    results = []
+    failed = []
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+        running = {}
+
+        def submit_next(db_path):
+            if queues[db_path]:
+                pdf_path = queues[db_path].pop(0)
+                future = executor.submit(_import_one, pdf_path, db_path, course, page_workers, batch_size)
+                running[future] = (db_path, pdf_path)
+
+        for db_path in queues:
+            submit_next(db_path)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                db_path, pdf_path = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 這份的交易已經取消了，不影響其他 PDF；下次重跑會再匯入一次
+                    print(f"❌ {os.path.basename(pdf_path)} → {db_path}：匯入失敗 ({type(e).__name__}: {e})", flush=True)
+                    failed.append(pdf_path)
+                else:
+                    _report(result)
+                    results.append(result)
+                submit_next(db_path)
+
+    for db_path in plan:
+        # 就算這次每份都跳過也更新一次：上次可能題目寫完了、還沒更新就被中斷
+        print(f"更新 {db_path} 的相似題分群與關鍵詞統計...")
+        exam_parser.refresh_derived(db_path)
+
+    _summary(results, failed)
+    return results
+
+def _summary(results, failed):
+    imported = [r for r in results if not r["skipped"]]
+    pages = sum(r["pages"] for r in imported)
+    questions = sum(r["questions"] for r in imported)
+    seconds = sum(r["seconds"] for r in imported)
+    print(f"\n=== 匯入完成：{len(imported)} 份匯入、{len(results) - len(imported)} 份跳過、{len(failed)} 份失敗 ===")
+    if seconds > 0:
+        print(f"共 {pages} 頁、{questions} 題 (平均每份 {pages / seconds:.1f} 頁/秒、{questions / seconds:.1f} 題/秒)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="一次匯入很多份考古題 PDF")
+    parser.add_argument("inputs", nargs="+", help="PDF 檔、資料夾 (會找底下所有 PDF) 或 glob，例如 'pdfs/*.pdf'")
+    parser.add_argument("--map", action="append", default=[], metavar="規則=資料庫",
+                        help="檔名符合規則的 PDF 匯入到這個資料庫，例如 '*生化*=databases/生化.db' (可以給很多個)")
+    parser.add_argument("--db", help="沒有符合任何 --map 規則的 PDF 要匯入到哪個資料庫")
+    parser.add_argument("--course", default=exam_parser.DEFAULT_COURSE,
+                        choices=sorted(exam_parser.COURSE_PATTERNS), help="用哪個科目的解析規則")
+    parser.add_argument("--workers", type=int, help="最多同時匯入幾份 PDF (預設 CPU 核心數)")
+    parser.add_argument("--page-workers", type=int, default=1, help="每份 PDF 用幾個行程抽取文字")
+    parser.add_argument("--batch-size", type=int, default=500, help="批次寫入時每批幾題")
+    args = parser.parse_args()
+
+    pdfs = find_pdfs(args.inputs)
+    if not pdfs:
+        raise SystemExit("找不到任何 PDF。")
+    try:
+        plan = plan_imports(pdfs, parse_mapping(args.map), args.db)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for db_path, paths in plan.items():
+        print(f"{db_path}：{len(paths)} 份 PDF")
+    run_batch(plan, args.course, args.workers, args.page_workers, args.batch_size)
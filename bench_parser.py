@@ -0,0 +1,107 @@
+import random
+import re
+import time
+
+import exam_parser
+
+# 解析器效能測試：用假的 1000 頁考古題文字，比較「舊版一條一條 re.search + 字串 +=」
+# 跟「預先編譯的單次分類 + list 收集」的速度，並確認兩邊解析出來的題目一模一樣。
+# 用法: python bench_parser.py [頁數]
+
+TERMS = ["糖解作用", "檸檬酸循環", "電子傳遞鏈", "ATP 合成酶", "NADH", "FADH2", "丙酮酸",
+         "乙醯輔酶A", "脂肪酸β氧化", "尿素循環", "胺基酸代謝", "糖質新生", "肝醣分解",
+         "酵素動力學", "Km 值", "Vmax", "競爭性抑制", "膽固醇合成", "酮體", "輔酶"]
+STEMS = ["下列關於{}的敘述，何者正確？", "有關{}的調控，下列何者錯誤？",
+         "{}缺乏時，最可能出現下列哪一種情形？", "下列哪一個酵素參與{}？"]
+
+def make_corpus(pages=1000, seed=0):
+    """ 產生假的考古題本文字 (每頁一個字串)，格式跟 pdfplumber 抽出來的差不多 """
+    rng = random.Random(seed)
+    corpus = []
+    qid = 0
+    for page in range(pages):
+        lines = []
+        if page % 25 == 0:
+            lines.append(f"生化 B{10 + page // 25 % 5}")
+            qid = 0
+        if page % 8 == 0:
+            lines.append(f"➢ {rng.choice(['顏伯勳', '王', '林', '陳'])}老師")
+        for _ in range(rng.randint(3, 6)):
+            qid += 1
+            lines.append(f"{qid}. " + rng.choice(STEMS).format(rng.choice(TERMS)))
+            if rng.random() < 0.4:
+                lines.append(f"（提示：與{rng.choice(TERMS)}有關）")
+            if rng.random() < 0.8:
+                opts = rng.sample(TERMS, 4)
+                lines.append(f"(A) {opts[0]} (B) {opts[1]}")
+                lines.append(f"(C) {opts[2]} (D) {opts[3]}")
+        corpus.append("\n".join(lines))
+    return corpus
+
+def legacy_parse_lines(lines):
+    """ 舊版的解析迴圈 (每行最多三次 re.search/re.match、用 += 接字串)，當作比較基準 """
+    current_year = "Unknown"
+    current_teacher = "Unknown"
+    current_question = None
+
+    for line in lines:
+        year_match = re.search(r"生*化*\s*(B\d+)", line)
+        if year_match:
+            current_year = year_match.group(1)
+            continue
+
+        if line.startswith('➢'):
+            current_teacher = line.replace('➢', '').replace('老師', '').strip()
+            continue
+
+        question_match = re.match(r'^(\d+)\.\s+(.*)', line)
+        if question_match:
+            if current_question:
+                yield current_question
+            current_question = {
+                "year": current_year,
+                "teacher": current_teacher,
+                "question_id": question_match.group(1),
+                "question_text": question_match.group(2),
+                "options_text": "",
+                "full_text": question_match.group(2)
+            }
+        elif current_question:
+            current_question["full_text"] += "\n" + line
+            if re.search(r'\([A-E]\)', line):
+                current_question["options_text"] += line + "\n"
+            else:
+                current_question["question_text"] += " " + line
+
+    if current_question:
+        yield current_question
+
+def best_of(func, repeat=5):
+    """ 跑好幾次取最快的一次 (秒)，順便回傳結果 """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def run(pages=1000):
+    corpus = make_corpus(pages)
+    lines = list(exam_parser.iter_lines(corpus))
+    print(f"語料: {pages} 頁、{len(lines)} 行")
+
+    legacy_time, legacy = best_of(lambda: list(legacy_parse_lines(lines)))
+    new_time, new = best_of(lambda: list(exam_parser.parse_lines(lines)))
+
+    keys = ["year", "teacher", "question_id", "question_text", "options_text", "full_text"]
+    assert [[q[k] for k in keys] for q in legacy] == [[q[k] for k in keys] for q in new], "解析結果不一致！"
+
+    print(f"舊版解析器: {legacy_time * 1000:8.1f} ms  ({len(lines) / legacy_time:,.0f} 行/秒)")
+    print(f"新版解析器: {new_time * 1000:8.1f} ms  ({len(lines) / new_time:,.0f} 行/秒)")
+    print(f"加速 {legacy_time / new_time:.2f} 倍，共 {len(new)} 題，結果一致 ✅")
+    return {"lines": len(lines), "legacy_s": legacy_time, "new_s": new_time}
+
+if __name__ == "__main__":
+    import sys
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,232 @@
+#效能測試：用假的題庫量搜尋、抓重複題、匯入、解析、PDF 各要多久
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import bench_parser
+import db_utils
+import exam_parser
+import pdf_generator
+import search_engine
+
+# 用法:
+#   python benchmark.py                              (1k / 10k / 100k 三種大小都跑)
+#   python benchmark.py --sizes 1000,10000 --save baseline.json
+#   python benchmark.py --compare baseline.json       (跟之前存的結果比，變慢超過 20% 會標出來)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# 模糊抓題在很大的題庫上要跑很久，超過這個題數就跳過 (可以用 --fuzzy-max 調整)
+FUZZY_MAX_ROWS = 10000
+TEACHERS = ["顏伯勳", "王志明", "林美華", "陳建宏", "張雅婷", "李國華"]
+YEARS = [f"B{n:02d}" for n in range(5, 14)]
+
+def _near_duplicate(rng, text):
+    """ 做出一題「幾乎一樣」的題目：多一個空白、全形半形標點互換、少一個字 """
+    change = rng.choice(["space", "punct", "drop"])
+    if change == "space":
+        pos = rng.randrange(len(text) + 1)
+        return text[:pos] + " " + text[pos:]
+    if change == "punct":
+        swapped = text.replace("，", ",").replace("？", "?")
+        return swapped if swapped != text else text + "。"
+    pos = rng.randrange(len(text))
+    return text[:pos] + text[pos + 1:]
+
+def make_questions(rows, dup_rate=0.05, near_dup_rate=0.10, seed=0):
+    """
+    產生假的題目 (跟 exam_parser 產生的格式一樣)。
+    dup_rate: 有多少比例是前面某一題一字不差的重複
+    near_dup_rate: 有多少比例是前面某一題稍微改一點 (給模糊抓題、正規化用)
+    """
+    rng = random.Random(seed)
+    stems = []
+    for i in range(rows):
+        roll = rng.random()
+        if stems and roll < dup_rate:
+            stem = rng.choice(stems)
+        elif stems and roll < dup_rate + near_dup_rate:
+            stem = _near_duplicate(rng, rng.choice(stems))
+        else:
+            terms = rng.sample(bench_parser.TERMS, 2)
+            stem = rng.choice(bench_parser.STEMS).format(terms[0])
+            stem += f"（與{terms[1]}比較，第 {rng.randint(1, 99)} 型）"
+        stems.append(stem)
+        opts = rng.sample(bench_parser.TERMS, 4)
+        options = f"(A) {opts[0]} (B) {opts[1]}\n(C) {opts[2]} (D) {opts[3]}\n"
+        is_choice = rng.random() < 0.9
+        yield {
+            "year": rng.choice(YEARS),
+            "teacher": rng.choice(TEACHERS),
+            "q_type": "選擇題" if is_choice else "非選擇題",
+            "question_id": str(i % 80 + 1),
+            "question_text": stem,
+            "options_text": options if is_choice else "",
+            "full_text": stem + "\n" + options if is_choice else stem,
+        }
+
+def make_bank(db_path, rows, seed=0):
+    """ 建一個有 rows 題的假題庫，回傳匯入花的秒數 """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db_utils.init_db(db_path)
+    start = time.perf_counter()
+    db_utils.insert_questions(make_questions(rows, seed=seed), db_path)
+    return time.perf_counter() - start
+
+def measure(func, repeat=5):
+    """
+    跑 repeat 次量延遲 (p50 / p95，毫秒)，另外再用 tracemalloc 跑一次量尖峰記憶體 (KB)。
+    (tracemalloc 會讓程式變慢，所以不跟計時混在一起)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": round(float(np.percentile(times, 50)), 3),
+        "p95_ms": round(float(np.percentile(times, 95)), 3),
+        "peak_kb": round(peak / 1024, 1),
+        "runs": repeat,
+    }
+
+def bench_size(db_path, rows, repeat, fuzzy_max):
+    """ 對一個大小的題庫跑所有查詢，回傳 {項目名稱: 結果} """
+    results = {}
+    ingest_s = make_bank(db_path, rows)
+    results["ingest"] = {"seconds": round(ingest_s, 3), "rows_per_s": round(rows / ingest_s)}
+    print(f"  匯入 {rows} 題: {ingest_s:.2f} 秒")
+
+    cases = {
+        "search_year": lambda: search_engine.search_questions(db_path, year="B12"),
+        "search_teacher": lambda: search_engine.search_questions(db_path, teacher="王"),
+        "search_keyword": lambda: search_engine.search_questions(db_path, keyword="檸檬酸循環"),
+        "search_keyword_short": lambda: search_engine.search_questions(db_path, keyword="酮體"),
+        "search_all_filters": lambda: search_engine.search_questions(db_path, year="B12", teacher="王",
+                                                                     keyword="檸檬酸循環"),
+        "duplicates": lambda: search_engine.find_duplicate_questions(db_path),
+    }
+    if rows <= fuzzy_max:
+        # 模糊抓題本身就很慢，跑少一點次
+        cases["fuzzy_duplicates"] = (lambda: search_engine.find_fuzzy_duplicates(db_path, 85), 1)
+    else:
+        print(f"  模糊抓題: 題數超過 {fuzzy_max}，跳過")
+
+    for name, case in cases.items():
+        func, runs = case if isinstance(case, tuple) else (case, repeat)
+        results[name] = measure(func, runs)
+        print(f"  {name:22s} p50 {results[name]['p50_ms']:10.1f} ms  p95 {results[name]['p95_ms']:10.1f} ms"
+              f"  peak {results[name]['peak_kb']:10.1f} KB")
+    return results
+
+def bench_parser_throughput(pages=1000, repeat=3):
+    """ 解析器速度 (不含讀 PDF)：每秒幾行 """
+    lines = list(exam_parser.iter_lines(bench_parser.make_corpus(pages)))
+    result = measure(lambda: list(exam_parser.parse_lines(lines)), repeat)
+    result["lines"] = len(lines)
+    result["lines_per_s"] = round(len(lines) / (result["p50_ms"] / 1000))
+    print(f"  解析器: {result['lines_per_s']:,} 行/秒")
+    return result
+
+def bench_pdf(db_path, repeat=3):
+    """ 搜尋結果轉 PDF (要有中文字型檔才跑得了) """
+    if not os.path.exists(pdf_generator.FONT_PATH):
+        print(f"  PDF: 找不到字型檔 {pdf_generator.FONT_PATH}，跳過")
+        return None
+    df = search_engine.search_questions(db_path, year="B12").head(200)
+    result = measure(lambda: pdf_generator.get_pdf_bytes(df), repeat)
+    result["questions"] = len(df)
+    print(f"  PDF ({len(df)} 題): p50 {result['p50_ms']:.1f} ms")
+    return result
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes=DEFAULT_SIZES, repeat=5, fuzzy_max=FUZZY_MAX_ROWS, data_dir=None):
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = data_dir or tmp
+        os.makedirs(folder, exist_ok=True)
+        for rows in sizes:
+            print(f"=== {rows} 題 ===")
+            db_path = os.path.join(folder, f"bench_{rows}.db")
+            for name, result in bench_size(db_path, rows, repeat, fuzzy_max).items():
+                report["results"][f"{rows}/{name}"] = result
+            pdf_result = bench_pdf(db_path)
+            if pdf_result:
+                report["results"][f"{rows}/pdf"] = pdf_result
+
+    print("=== 解析器 ===")
+    report["results"]["parser"] = bench_parser_throughput()
+    return report
+
+def compare(old, new, tolerance=0.20):
+    """ 跟舊的結果比較 p50，變慢超過 tolerance (預設 20%) 的項目算退步，回傳退步的項目 """
+    regressions = []
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if not before or "p50_ms" not in result or "p50_ms" not in before:
+            continue
+        change = result["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0
+        flag = "⚠️ 變慢" if change > tolerance else ("🚀 變快" if change < -tolerance else "")
+        print(f"{name:32s} {before['p50_ms']:10.1f} → {result['p50_ms']:10.1f} ms  ({change:+.0%}) {flag}")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="考古題神器效能測試")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="題庫大小，用逗號分開")
+    parser.add_argument("--repeat", type=int, default=5, help="每個項目跑幾次")
+    parser.add_argument("--fuzzy-max", type=int, default=FUZZY_MAX_ROWS, help="超過這個題數就不跑模糊抓題")
+    parser.add_argument("--data-dir", help="假題庫要放哪裡 (不給就用暫存資料夾，跑完刪掉)")
+    parser.add_argument("--save", help="把結果存成 JSON (當作之後比較的基準)")
+    parser.add_argument("--compare", help="跟之前存的 JSON 比較")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="變慢超過多少比例算退步")
+    args = parser.parse_args()
+
+    report = run([int(s) for s in args.sizes.split(",")], args.repeat, args.fuzzy_max, args.data_dir)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果已存到 {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"=== 跟 {args.compare} (commit {old['meta'].get('commit')}) 比較 ===")
+        regressions = compare(old, report, args.tolerance)
+        if regressions:
+            print(f"有 {len(regressions)} 個項目變慢了！")
+            raise SystemExit(1)
+        print("沒有發現效能退步 ✅")
@@ -0,0 +1,99 @@
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import db_utils
+import search_engine
+
+# 檢查搜尋用的 SQL 有沒有走索引 (EXPLAIN QUERY PLAN)
+# 只要有任何一條路徑退化成「整個表格掃一遍」，就會 AssertionError 並回傳非 0 的結束碼
+# 用法: python check_query_plans.py [資料庫路徑]   (不給路徑就建一個暫存的測試資料庫)
+
+# "SCAN questions" 後面如果沒有接 "USING ... INDEX"，代表是全表掃描
+FULL_SCAN = re.compile(r"^SCAN questions(?=$| )(?! USING (COVERING )?INDEX)")
+# 有篩選條件的查詢連「SCAN questions USING INDEX」(從頭走過整個索引) 都不行，一定要 SEARCH 定位
+ANY_SCAN = re.compile(r"^SCAN questions(?=$| )")
+
+def assert_no_full_scan(conn, label, sql, params=(), filtered=True):
+    """ filtered=False 表示查詢本來就要讀全部題目 (沒有篩選條件)，只要有走索引就好 """
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    details = [row[3] for row in plan]
+    pattern = ANY_SCAN if filtered else FULL_SCAN
+    for detail in details:
+        assert not pattern.match(detail), f"{label} 退化成掃描整個表格或索引: {details}"
+    print(f"✅ {label}: {' / '.join(details)}")
+
+def report_known_scan(conn, label, sql, params=()):
+    """
+    已知一定會掃過整個表格的查詢 (例如 LIKE '%關鍵字%' 沒辦法用索引)：不算失敗，
+    但把查詢計畫印出來，回傳是否真的有掃描，之後改成走索引時就看得出來。
+    """
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    details = [row[3] for row in plan]
+    scans = any(ANY_SCAN.match(detail) for detail in details)
+    print(f"{'⚠️ ' if scans else '✅'} {label}{' (已知的全表掃描)' if scans else ''}: {' / '.join(details)}")
+    return scans
+
+def make_sample_db(db_path):
+    """ 建一個小小的測試資料庫 (結構跟正式資料庫一樣) """
+    db_utils.init_db(db_path)
+    for i in range(20):
+        db_utils.insert_question({
+            "year": f"B{10 + i % 4}",
+            "teacher": ["顏伯勳", "王老師"][i % 2],
+            "q_type": "選擇題",
+            "question_id": str(i + 1),
+            "question_text": f"下列關於糖解作用的敘述何者正確？({i})",
+            "options_text": "(A) 產生 ATP (B) 消耗 NADH\n",
+            "full_text": f"下列關於糖解作用的敘述何者正確？({i})\n(A) 產生 ATP (B) 消耗 NADH",
+        }, db_path)
+
+def check_all(db_path):
+    conn = sqlite3.connect(db_path)
+
+    search_cases = {
+        "依年份搜尋": dict(year="B12"),
+        "依老師搜尋": dict(teacher="顏"),
+        "年份 + 老師": dict(year="B12", teacher="顏"),
+        "關鍵字搜尋 (全文檢索)": dict(keyword="糖解作用"),
+        "全部條件": dict(year="B12", teacher="顏", keyword="糖解作用"),
+        # 不到 3 個字的關鍵字用 LIKE 比對，有年份條件時要先用年份索引縮小範圍
+        "短關鍵字 + 年份": dict(year="B12", keyword="糖解"),
+    }
+    for label, kwargs in search_cases.items():
+        sql, params = search_engine.build_search_query(conn, **kwargs)
+        assert_no_full_scan(conn, label, sql, params)
+
+    # 分頁查詢 (第一頁、翻到下一頁、走到 NULL 年份那一段)
+    for after in (None, ("B12", 10)):
+        label = "分頁" + ("第一頁" if after is None else "下一頁")
+        sql, params = search_engine.build_search_page_query(conn, after=after)
+        assert_no_full_scan(conn, label, sql, params)
+        sql, params = search_engine.build_search_page_query(conn, year="B12", after=after)
+        assert_no_full_scan(conn, label + " (依年份)", sql, params)
+        sql, params = search_engine.build_search_page_query(conn, teacher="顏", after=after)
+        assert_no_full_scan(conn, label + " (依老師)", sql, params)
+    sql, params = search_engine.build_search_page_query(conn, after=(None, 10), null_years=True)
+    assert_no_full_scan(conn, "分頁 (NULL 年份)", sql, params)
+
+    # 只有短關鍵字、沒有其他條件時，LIKE '%...%' 只能一題一題比
+    sql, params = search_engine.build_search_query(conn, keyword="糖解")
+    report_known_scan(conn, "短關鍵字 (LIKE)", sql, params)
+
+    assert_no_full_scan(conn, "老師名單", "SELECT DISTINCT teacher FROM questions ORDER BY teacher",
+                        filtered=False)
+    assert_no_full_scan(conn, "抓重複題", search_engine.build_duplicate_query(conn), (2,))
+    assert_no_full_scan(conn, "模糊抓題 (撈選擇題)", search_engine.FUZZY_SOURCE_SQL)
+    conn.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        check_all(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "plan_check.db")
+            make_sample_db(path)
+            check_all(path)
+    print("所有搜尋路徑都有使用索引！")
@@ -0,0 +1,188 @@
+#相似題分群：匯入時先算好存進資料庫，網頁直接讀，不用每次從頭比對
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+import db_utils
+import instrument
+import search_engine
+
+# 分群時用的相似度門檻；網頁上選的門檻 >= 這個值時就可以從分群結果算 (不用跟整個題庫比)
+CLUSTER_THRESHOLD = 70
+
+# 預先分群是「跟代表題比」的近似做法，分組可能跟 find_fuzzy_duplicates 逐題比對的結果不完全一樣，
+# 網頁和匯出的 PDF 都要標示出來
+APPROXIMATE_LABEL = "預先分群 (近似)"
+APPROXIMATE_NOTE = ("註：這是匯入時預先分好的群整理出來的近似結果：新題目只跟各群的代表題比對，"
+                    "少數相似題可能被分在不同組，跟逐題比對的結果會有些微差異。")
+
+CLUSTER_SOURCE_SQL = "SELECT id, content FROM questions WHERE q_type='選擇題' ORDER BY id"
+
+def get_build_threshold(conn):
+    """ 目前分群結果是用哪個門檻算的 (還沒分過群就回傳 None) """
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'cluster_threshold'").fetchone()
+    except Exception:
+        # 舊的資料庫沒有 db_meta 表格
+        return None
+    return float(row[0]) if row else None
+
+def _greedy_clusters(ids, contents, threshold):
+    """
+    從頭分群 (跟 find_fuzzy_duplicates 一樣的貪婪規則)：由前往後，還沒分到群的題目當代表，
+    把後面相似度達門檻的題目收進來。每題都會有一筆 (question_id, cluster_id, similarity)，
+    沒有相似題的題目自己一群。
+    """
+    candidates = search_engine.prefix_filter_candidates(contents, threshold)
+    rows = []
+    visited = set()
+    for i in range(len(ids)):
+        if i in visited:
+            continue
+        rows.append((ids[i], ids[i], 100.0))
+        for j in candidates(i, visited):
+            similarity = fuzz.ratio(contents[i], contents[j], score_cutoff=threshold)
+            if similarity >= threshold:
+                rows.append((ids[j], ids[i], similarity))
+                visited.add(j)
+    return rows
+
+def _assign_to_representatives(conn, new_rows, threshold):
+    """
+    增量分群：新題目只跟「現有的代表題」比，找最像的那一群加進去；
+    都不夠像就自己當新的代表題 (後面的新題目也會跟它比)。
+    """
+    representatives = {
+        rep_id: content
+        for rep_id, content in conn.execute(
+            "SELECT q.id, q.content FROM question_clusters c JOIN questions q ON q.id = c.question_id "
+            "WHERE c.cluster_id = c.question_id AND q.content IS NOT NULL"
+        )
+    }
+    rows = []
+    for question_id, content in new_rows:
+        best = None
+        if content is not None and representatives:
+            best = process.extractOne(content, representatives, scorer=fuzz.ratio, score_cutoff=threshold)
+        if best:
+            _, similarity, rep_id = best
+            rows.append((question_id, rep_id, similarity))
+        else:
+            rows.append((question_id, question_id, 100.0))
+            if content is not None:
+                representatives[question_id] = content
+    return rows
+
+def rebuild_clusters(db_path=db_utils.DB_NAME, threshold=CLUSTER_THRESHOLD):
+    """ 整個資料庫重新分群 (第一次建立、或是換了門檻時用) """
+    conn = db_utils._connect_for_write(db_path)
+    try:
+        rows = conn.execute(CLUSTER_SOURCE_SQL).fetchall()
+        ids = [row[0] for row in rows]
+        contents = [row[1] for row in rows]
+        cluster_rows = _greedy_clusters(ids, contents, threshold)
+
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM question_clusters")
+        conn.executemany("INSERT INTO question_clusters (question_id, cluster_id, similarity) VALUES (?, ?, ?)",
+                         cluster_rows)
+        conn.execute("INSERT OR REPLACE INTO db_meta (key, value) VALUES ('cluster_threshold', ?)", (str(threshold),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"分群完成：{len(ids)} 題，門檻 {threshold}。")
+    return len(cluster_rows)
+
+@instrument.timed()
+def update_clusters(db_path=db_utils.DB_NAME, threshold=CLUSTER_THRESHOLD):
+    """
+    匯入新題目之後呼叫：只處理有變動的題目。
+    1. 被刪掉的題目從分群裡拿掉；代表題被刪掉的群，剩下的成員重新分配
+    2. 還沒分群的新題目只跟現有的代表題比對
+    門檻跟上次不一樣 (或是還沒分過群) 就整個重新分群。
+    回傳這次分配的題數。
+    """
+    conn = db_utils._connect_for_write(db_path)
+    if get_build_threshold(conn) != float(threshold):
+        conn.close()
+        return rebuild_clusters(db_path, threshold)
+
+    try:
+        conn.execute("BEGIN")
+        # 1. 刪掉已經不在題庫裡的題目 (或不再是選擇題的)
+        conn.execute("""
+        DELETE FROM question_clusters WHERE question_id NOT IN (
+            SELECT id FROM questions WHERE q_type = '選擇題'
+        )
+        """)
+        # 代表題不見的群整群解散，成員等一下跟新題目一起重新分配
+        conn.execute("""
+        DELETE FROM question_clusters WHERE cluster_id NOT IN (
+            SELECT question_id FROM question_clusters WHERE question_id = cluster_id
+        )
+        """)
+
+        # 2. 還沒分群的題目 (新匯入的 + 剛剛解散的)
+        new_rows = conn.execute("""
+        SELECT id, content FROM questions
+        WHERE q_type = '選擇題' AND id NOT IN (SELECT question_id FROM question_clusters)
+        ORDER BY id
+        """).fetchall()
+        cluster_rows = _assign_to_representatives(conn, new_rows, threshold)
+        conn.executemany("INSERT INTO question_clusters (question_id, cluster_id, similarity) VALUES (?, ?, ?)",
+                         cluster_rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(cluster_rows)
+
+def load_clusters(db_path, threshold):
+    """
+    直接讀預先算好的分群 (格式跟 find_fuzzy_duplicates 一樣，相似度欄標成 APPROXIMATE_LABEL)。
+    門檻比分群時的門檻還低的話，分群結果不夠用，回傳 None (請改用 find_fuzzy_duplicates 現場算)。
+    門檻剛好等於分群門檻就直接用分群結果；門檻比較高時，在每一群裡面重新跑一次貪婪分組。
+    這是近似結果：增量分群時新題目只跟代表題比，兩題很像卻分在不同群的情況不會被合併，
+    群裡面重新分組也只看得到同一群的題目，所以組數、組成可能跟逐題比對不一樣。
+    """
+    with search_engine.connection(db_path) as conn:
+        build_threshold = get_build_threshold(conn)
+        if build_threshold is None or threshold < build_threshold:
+            return None
+        # 只有一題的群不可能有相似題，不用讀
+        df = pd.read_sql_query("""
+        SELECT c.cluster_id, c.question_id, q.content, q.year
+        FROM question_clusters c JOIN questions q ON q.id = c.question_id
+        WHERE c.cluster_id IN (SELECT cluster_id FROM question_clusters GROUP BY cluster_id HAVING COUNT(*) > 1)
+        ORDER BY c.cluster_id, c.question_id != c.cluster_id, c.question_id
+        """, conn)
+
+    if threshold > build_threshold:
+        rows = []
+        for _, members in df.groupby("cluster_id", sort=True):
+            # 群裡照 id 排，分組順序跟 find_fuzzy_duplicates 一樣
+            members = members.sort_values("question_id")
+            rows += search_engine.fuzzy_duplicate_groups(members.to_dict("records"), threshold)
+        groups = pd.DataFrame(rows, columns=["主要題目", "重複次數", "出現年份", "相似度"])
+        groups["相似度"] = APPROXIMATE_LABEL
+        return groups
+
+    groups = df.groupby("cluster_id", sort=True).agg(
+        主要題目=("content", "first"),
+        重複次數=("content", "size"),
+        出現年份=("year", ", ".join),
+    ).reset_index(drop=True)
+    groups["相似度"] = APPROXIMATE_LABEL
+    return groups
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else db_utils.DB_NAME
+    db_utils.init_db(path)
+    print(f"分配了 {update_clusters(path)} 題")
+    print(load_clusters(path, 85).head())
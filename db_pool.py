@@ -0,0 +1,87 @@
+#唯讀連線池：讓網頁每次重新整理都不用重開資料庫
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# 每條唯讀連線的效能設定
+MMAP_SIZE = 256 * 1024 * 1024   # 用 mmap 直接讀檔案 (256 MB 上限)
+CACHE_SIZE_KB = 64 * 1024       # 每條連線的頁面快取 (64 MB)
+
+def open_readonly_connection(db_path):
+    """
+    開一條唯讀連線 (mode=ro)：
+    check_same_thread=False 讓連線可以在 Streamlit 的不同執行緒之間重複使用
+    (同一時間只會借給一個人，所以不會互相干擾)
+    """
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    return conn
+
+def db_version(db_path):
+    """
+    資料庫目前的「版本」：主檔與 WAL 檔的修改時間和大小。
+    只要有人匯入新題目，這個值就會改變，可以拿來當快取的 key。
+    """
+    version = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+def _file_id(db_path):
+    """ 檔案本身的身分 (被整個換掉的話，舊連線就不能再用) """
+    stat = os.stat(db_path)
+    return (stat.st_dev, stat.st_ino)
+
+class ConnectionPool:
+    """
+    以 db_path 為單位的唯讀連線池 (執行緒安全)。
+    連線用完放回池子，下次直接拿來用；資料庫檔案被換掉時，舊的連線會自動丟掉。
+    """
+
+    def __init__(self, max_idle_per_db=4):
+        self.max_idle_per_db = max_idle_per_db
+        self._idle = {}  # db_path -> [(conn, file_id), ...]
+        self._lock = threading.Lock()
+
+    def _acquire(self, db_path):
+        file_id = _file_id(db_path)
+        with self._lock:
+            idle = self._idle.get(db_path, [])
+            while idle:
+                conn, conn_file_id = idle.pop()
+                if conn_file_id == file_id:
+                    return conn, file_id
+                conn.close()
+        return open_readonly_connection(db_path), file_id
+
+    def _release(self, db_path, conn, file_id):
+        with self._lock:
+            idle = self._idle.setdefault(db_path, [])
+            if len(idle) < self.max_idle_per_db:
+                idle.append((conn, file_id))
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self, db_path):
+        """ 借一條連線，用完自動歸還：with pool.connection(db_path) as conn: ... """
+        conn, file_id = self._acquire(db_path)
+        try:
+            yield conn
+        finally:
+            self._release(db_path, conn, file_id)
+
+    def close_all(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle.clear()
@@ -1,13 +1,17 @@
 #創建倉庫，並把貨物搬進去
 import sqlite3
+import hashlib
 import os
+from itertools import islice
+
+import text_norm
 
 # 資料庫檔案名稱
 DB_NAME = "med_exams.db"
 
-def init_db():
+def init_db(db_path=DB_NAME):
     """ 初始化資料庫：如果沒有，就建立一個新的，並設定好欄位 """
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # 建立一個名為 'questions' 的表格
@@ -34,38 +38,357 @@ def init_db():
     );
     """
     cursor.execute(create_table_sql)
+    upgrade_schema(cursor)
+    create_fts_index(cursor)
+    create_facet_index(cursor)
     conn.commit()
     conn.close()
-    print(f"資料庫 {DB_NAME} 已就緒！")
+    print(f"資料庫 {db_path} 已就緒！")
 
-def insert_question(data):
-    """ 把一題資料存入資料庫 """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    sql = """
-    INSERT INTO questions (year, teacher, q_type, question_id, content, options, full_text)
-    VALUES (?, ?, ?, ?, ?, ?, ?)
+def content_hash(text):
+    """ 題目內容的雜湊值 (SHA-1)，用來快速找出一模一樣的題目 """
+    if text is None:
+        return None
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def upgrade_schema(cursor):
     """
-    
-    cursor.execute(sql, (
+    資料庫升級 (舊的資料庫也能直接套用)：
+    1. 加上 content_hash 欄位並補算舊資料，讓抓重複題可以用短短的雜湊值分組
+    2. 建立常用篩選條件的索引，避免每次搜尋都掃過整個表格
+    3. 記錄每題來自哪個 PDF 的第幾頁 (source_*)，以及每個 PDF 的匯入紀錄，給增量匯入用
+    4. 相似題分群的表格 (question_clusters / db_meta)、關鍵詞統計的表格 (term_stats / term_totals)
+    5. 正規化後的題目 (content_norm) 與它的雜湊值 (norm_hash)，抓重複題改用它分組
+    """
+    cursor.execute("PRAGMA table_info(questions)")
+    columns = [row[1] for row in cursor.fetchall()]
+    new_columns = {
+        "content_hash": "TEXT",
+        "source_pdf": "TEXT",      # 來源 PDF 檔名
+        "source_page": "INTEGER",  # 題目從第幾頁開始 (從 0 算)
+        "source_seq": "INTEGER",   # 在這份 PDF 裡是第幾題 (依解析順序)
+        "content_norm": "TEXT",    # 正規化後的題目 (見 text_norm.py)
+        "norm_hash": "TEXT",       # content_norm 的雜湊值
+    }
+    for name, col_type in new_columns.items():
+        if name not in columns:
+            cursor.execute(f"ALTER TABLE questions ADD COLUMN {name} {col_type}")
+
+    cursor.connection.create_function("content_hash", 1, content_hash, deterministic=True)
+    cursor.execute("UPDATE questions SET content_hash = content_hash(content) WHERE content_hash IS NULL")
+
+    cursor.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_questions_type_content ON questions(q_type, content);
+    CREATE INDEX IF NOT EXISTS idx_questions_type_hash ON questions(q_type, content_hash);
+    CREATE INDEX IF NOT EXISTS idx_questions_year ON questions(year);
+    CREATE INDEX IF NOT EXISTS idx_questions_teacher ON questions(teacher);
+    CREATE INDEX IF NOT EXISTS idx_questions_source ON questions(source_pdf, source_seq);
+    CREATE INDEX IF NOT EXISTS idx_questions_type_norm ON questions(q_type, norm_hash);
+
+    -- 每個 PDF 的匯入紀錄：整份檔案的雜湊值，沒變就整份跳過
+    CREATE TABLE IF NOT EXISTS pdf_imports (
+        source_pdf TEXT PRIMARY KEY,
+        file_hash TEXT,
+        page_count INTEGER,
+        imported_at TEXT
+    );
+
+    -- 每一頁的指紋，以及解析到這一頁開頭時的狀態 (年份、老師、還沒結束的題目)
+    -- page_no = page_count 那一筆是「整份解析完」的狀態
+    CREATE TABLE IF NOT EXISTS pdf_pages (
+        source_pdf TEXT,
+        page_no INTEGER,
+        fingerprint TEXT,
+        state TEXT,
+        PRIMARY KEY (source_pdf, page_no)
+    );
+
+    -- 預先算好的相似題分群 (見 clusters.py)：每題一筆，cluster_id = 代表題的 id
+    -- similarity 是這題跟代表題的相似度 (代表題自己是 100)
+    CREATE TABLE IF NOT EXISTS question_clusters (
+        question_id INTEGER PRIMARY KEY,
+        cluster_id INTEGER,
+        similarity REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_question_clusters_cluster ON question_clusters(cluster_id);
+
+    -- 關鍵詞統計 (見 analytics.py)：每個 (年份, 老師, 關鍵詞) 有幾題提到，以及每個 (年份, 老師) 的總題數
+    CREATE TABLE IF NOT EXISTS term_stats (
+        year TEXT,
+        teacher TEXT,
+        term TEXT,
+        question_count INTEGER,
+        PRIMARY KEY (year, teacher, term)
+    );
+    CREATE INDEX IF NOT EXISTS idx_term_stats_term ON term_stats(term);
+    CREATE TABLE IF NOT EXISTS term_totals (
+        year TEXT,
+        teacher TEXT,
+        questions INTEGER,
+        PRIMARY KEY (year, teacher)
+    );
+
+    -- 其他零碎設定 (例如分群時用的門檻)
+    CREATE TABLE IF NOT EXISTS db_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """)
+
+    # 補算正規化欄位 (正規化規則改版時全部重算)
+    cursor.connection.create_function("normalize_text", 1, text_norm.normalize, deterministic=True)
+    cursor.execute("SELECT value FROM db_meta WHERE key = 'norm_version'")
+    row = cursor.fetchone()
+    if row is None or row[0] != str(text_norm.NORM_VERSION):
+        cursor.execute("UPDATE questions SET content_norm = NULL, norm_hash = NULL")
+        cursor.execute("INSERT OR REPLACE INTO db_meta (key, value) VALUES ('norm_version', ?)",
+                       (str(text_norm.NORM_VERSION),))
+    cursor.execute("UPDATE questions SET content_norm = normalize_text(content) "
+                   "WHERE norm_hash IS NULL AND content IS NOT NULL")
+    cursor.execute("UPDATE questions SET norm_hash = content_hash(content_norm) "
+                   "WHERE norm_hash IS NULL AND content_norm IS NOT NULL")
+
+def create_fts_index(cursor):
+    """
+    建立全文檢索索引 (FTS5)，涵蓋 content / options / full_text 三個欄位。
+    使用 trigram 分詞器：中文不用斷詞，任意 3 個字以上的片段都能直接查。
+    索引內容由 trigger 自動跟 questions 表格保持同步。
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='questions_fts'")
+    already_exists = cursor.fetchone() is not None
+
+    try:
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+            content, options, full_text,
+            content='questions', content_rowid='id',
+            tokenize='trigram'
+        );
+        """)
+    except sqlite3.OperationalError as e:
+        # 舊版 SQLite 沒有 FTS5 或 trigram，就退回用 LIKE 搜尋
+        print(f"無法建立全文檢索索引 ({e})，關鍵字搜尋將使用 LIKE。")
+        return
+
+    # 新增 / 刪除 / 修改題目時，同步更新索引
+    cursor.executescript("""
+    CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts(rowid, content, options, full_text)
+        VALUES (new.id, new.content, new.options, new.full_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, content, options, full_text)
+        VALUES ('delete', old.id, old.content, old.options, old.full_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF content, options, full_text ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, content, options, full_text)
+        VALUES ('delete', old.id, old.content, old.options, old.full_text);
+        INSERT INTO questions_fts(rowid, content, options, full_text)
+        VALUES (new.id, new.content, new.options, new.full_text);
+    END;
+    """)
+
+    # 舊資料庫第一次建立索引時，要把已經存在的題目補進去
+    if not already_exists:
+        cursor.execute("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')")
+
+def create_facet_index(cursor):
+    """
+    建立篩選條件的統計表 (question_facets)：每個 (年份, 老師, 題型) 組合有幾題。
+    下拉選單的年份、老師 (和旁邊的題數) 都從這張小表算，不用每次掃過所有題目 (見 facets.py)。
+    跟全文檢索索引一樣用 trigger 自動維護，匯入、刪除、修改題目時一起更新。
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='question_facets'")
+    already_exists = cursor.fetchone() is not None
+
+    # 年份、老師可能是 NULL，所以不用 PRIMARY KEY 比對 (NULL 彼此不相等)，trigger 裡一律用 IS 比
+    cursor.executescript("""
+    CREATE TABLE IF NOT EXISTS question_facets (
+        year TEXT,
+        teacher TEXT,
+        q_type TEXT,
+        questions INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_question_facets ON question_facets(year, teacher, q_type);
+
+    CREATE TRIGGER IF NOT EXISTS question_facets_insert AFTER INSERT ON questions BEGIN
+        INSERT INTO question_facets (year, teacher, q_type, questions)
+        SELECT new.year, new.teacher, new.q_type, 0
+        WHERE NOT EXISTS (SELECT 1 FROM question_facets
+                          WHERE year IS new.year AND teacher IS new.teacher AND q_type IS new.q_type);
+        UPDATE question_facets SET questions = questions + 1
+        WHERE year IS new.year AND teacher IS new.teacher AND q_type IS new.q_type;
+    END;
+    CREATE TRIGGER IF NOT EXISTS question_facets_delete AFTER DELETE ON questions BEGIN
+        UPDATE question_facets SET questions = questions - 1
+        WHERE year IS old.year AND teacher IS old.teacher AND q_type IS old.q_type;
+        DELETE FROM question_facets
+        WHERE year IS old.year AND teacher IS old.teacher AND q_type IS old.q_type AND questions <= 0;
+    END;
+    CREATE TRIGGER IF NOT EXISTS question_facets_update AFTER UPDATE OF year, teacher, q_type ON questions BEGIN
+        UPDATE question_facets SET questions = questions - 1
+        WHERE year IS old.year AND teacher IS old.teacher AND q_type IS old.q_type;
+        DELETE FROM question_facets
+        WHERE year IS old.year AND teacher IS old.teacher AND q_type IS old.q_type AND questions <= 0;
+        INSERT INTO question_facets (year, teacher, q_type, questions)
+        SELECT new.year, new.teacher, new.q_type, 0
+        WHERE NOT EXISTS (SELECT 1 FROM question_facets
+                          WHERE year IS new.year AND teacher IS new.teacher AND q_type IS new.q_type);
+        UPDATE question_facets SET questions = questions + 1
+        WHERE year IS new.year AND teacher IS new.teacher AND q_type IS new.q_type;
+    END;
+    """)
+
+    # 舊資料庫第一次建立時，要把已經存在的題目統計進去
+    if not already_exists:
+        cursor.execute("""
+        INSERT INTO question_facets (year, teacher, q_type, questions)
+        SELECT year, teacher, q_type, COUNT(*) FROM questions GROUP BY year, teacher, q_type
+        """)
+
+INSERT_SQL = """
+INSERT INTO questions (year, teacher, q_type, question_id, content, options, full_text, content_hash,
+                       source_pdf, source_page, source_seq, content_norm, norm_hash)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _question_row(data):
+    """ 把 parser 產生的題目 dict 轉成 INSERT 需要的欄位順序 (順便算好正規化欄位) """
+    content_norm = text_norm.normalize(data['question_text'])
+    return (
         data['year'],
         data['teacher'],
         data['q_type'],
         data['question_id'],
         data['question_text'],
         data['options_text'],
-        data['full_text']
-    ))
-    
+        data['full_text'],
+        content_hash(data['question_text']),
+        data.get('source_pdf'),
+        data.get('source_page'),
+        data.get('source_seq'),
+        content_norm,
+        content_hash(content_norm)
+    )
+
+def insert_question(data, db_path=DB_NAME):
+    """ 把一題資料存入資料庫 """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(INSERT_SQL, _question_row(data))
     conn.commit()
     conn.close()
 
-def clear_db():
+def _write_questions(cursor, questions, batch_size):
+    """ 用 executemany 分批寫入 (呼叫的人負責交易)，回傳寫入的題數 """
+    count = 0
+    rows = map(_question_row, questions)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        cursor.executemany(INSERT_SQL, batch)
+        count += len(batch)
+    return count
+
+def _connect_for_write(db_path):
+    conn = sqlite3.connect(db_path)
+    # WAL 模式：寫入時不會擋住正在查詢的人，而且寫入比較快
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def insert_questions(questions, db_path=DB_NAME, batch_size=500):
+    """
+    批次匯入：一次寫入很多題 (可以是 list 或 generator)。
+    整批在同一個交易 (transaction) 裡完成，只需要 commit 一次，
+    不用像 insert_question 那樣每題都開一次連線、寫一次硬碟。
+    batch_size: 每次 executemany 送幾題 (控制記憶體用量)
+    回傳寫入的題數。
+    """
+    conn = _connect_for_write(db_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        count = _write_questions(cursor, questions, batch_size)
+        conn.commit()
+    except Exception:
+        # 中途出錯就整批取消，不會留下只匯入一半的資料
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return count
+
+def get_pdf_import(db_path, source_pdf):
+    """ 查某個 PDF 上次匯入的紀錄，回傳 (file_hash, page_count)；沒匯入過就回傳 None """
+    conn = sqlite3.connect(db_path)
+    row = conn.execute(
+        "SELECT file_hash, page_count FROM pdf_imports WHERE source_pdf = ?", (source_pdf,)
+    ).fetchone()
+    conn.close()
+    return row
+
+def get_pdf_pages(db_path, source_pdf):
+    """ 查某個 PDF 每一頁的指紋與解析狀態，回傳 {page_no: (fingerprint, state)} """
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT page_no, fingerprint, state FROM pdf_pages WHERE source_pdf = ?", (source_pdf,)
+    ).fetchall()
+    conn.close()
+    return {page_no: (fingerprint, state) for page_no, fingerprint, state in rows}
+
+def replace_pdf_questions(db_path, source_pdf, from_seq, from_page, questions, pages,
+                          file_hash, page_count, batch_size=500):
+    """
+    增量匯入：把某個 PDF 從第 from_page 頁之後的題目換成新解析的結果 (同一個交易)。
+    1. 刪掉這個 PDF 第 from_seq 題以後的舊題目、第 from_page 頁以後的頁面紀錄
+    2. 寫入新題目 (questions 可以是 generator)
+    3. 寫入新的頁面紀錄 pages = [(page_no, fingerprint, state), ...]
+       (pages 可以在解析 questions 的過程中才陸續填進來，所以一定要等題目寫完才讀它)
+    4. 更新這個 PDF 的匯入紀錄
+    中途出錯整批取消，不會多出重複的題目。
+    回傳寫入的題數。
+    """
+    conn = _connect_for_write(db_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute("DELETE FROM questions WHERE source_pdf = ? AND source_seq >= ?",
+                       (source_pdf, from_seq))
+        cursor.execute("DELETE FROM pdf_pages WHERE source_pdf = ? AND page_no >= ?",
+                       (source_pdf, from_page))
+        count = _write_questions(cursor, questions, batch_size)
+        cursor.executemany(
+            "INSERT OR REPLACE INTO pdf_pages (source_pdf, page_no, fingerprint, state) VALUES (?, ?, ?, ?)",
+            [(source_pdf, page_no, fingerprint, state) for page_no, fingerprint, state in pages]
+        )
+        cursor.execute(
+            "INSERT OR REPLACE INTO pdf_imports (source_pdf, file_hash, page_count, imported_at) "
+            "VALUES (?, ?, ?, datetime('now'))",
+            (source_pdf, file_hash, page_count)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return count
+
+def clear_db(db_path=DB_NAME):
     """ (測試用) 清空資料庫，避免重複匯入一樣的資料 """
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM questions")
+    # 匯入紀錄、分群結果、關鍵詞統計也一起清掉，下次匯入才會從頭開始
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' "
+                   "AND name IN ('pdf_imports', 'pdf_pages', 'question_clusters', 'term_stats', 'term_totals')")
+    for (table,) in cursor.fetchall():
+        cursor.execute(f"DELETE FROM {table}")
+    # 分群門檻也要忘掉：下次匯入就會整個重新分群，不會一題一題跟代表題比
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='db_meta'")
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM db_meta WHERE key = 'cluster_threshold'")
     conn.commit()
     conn.close()
     print("資料庫已清空。")
\ No newline at end of file
@@ -1,93 +1,364 @@
 import pdfplumber
 import re
 import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pdfminer.pdftypes import resolve1
 # 引入我們剛剛寫的資料庫工具
 import db_utils 
+import analytics
+import clusters
+import instrument
 
 PDF_PATH = 'pdfs/B13生化二段考古題本_全.pdf' 
 
-def parse_and_save_exam(pdf_path):
+# 各科目的解析規則，新的科目在這裡加一組就好
+# year: 年份標題 (要有一個叫 year 的群組)；year_hint: 年份一定會有的片段，先用它快速排除大部分的行
+# teacher: 老師那一行 (teacher_name 群組是老師的名字，沒有這個群組就取開頭符號後面的整段)；question: 題目開頭 (qid = 題號、qtext = 題目文字)；option: 選項的樣子
+COURSE_PATTERNS = {
+    # 生化的年份標題長得像「生化 B12」
+    "生化": {
+        "year": r"生*化*\s*(?P<year>B\d+)",
+        "year_hint": r"B\d",
+        # 「➢ 顏伯勳老師」→ 顏伯勳
+        "teacher": r"➢\s*(?P<teacher_name>.*?)\s*(?:老師)?$",
+        "question": r"(?P<qid>\d+)\.\s+(?P<qtext>.*)",
+        "option": r"\([A-E]\)",
+    },
+    # 其他科目：只要有 B 開頭的年份就算
+    "通用": {
+        "year": r"(?P<year>B\d+)",
+        "year_hint": r"B\d",
+        "teacher": r"➢\s*(?P<teacher_name>.*?)\s*(?:老師)?$",
+        "question": r"(?P<qid>\d+)\.\s+(?P<qtext>.*)",
+        "option": r"\([A-E]\)",
+    },
+}
+DEFAULT_COURSE = "生化"
+
+# 每一行的種類
+LINE_YEAR, LINE_TEACHER, LINE_QUESTION, LINE_OPTION, LINE_TEXT = range(5)
+
+_classifiers = {}
+
+def get_line_classifier(course=DEFAULT_COURSE):
+    """
+    把某個科目的規則編譯成「一個」正規表示式，每一行只要 match 一次就知道是哪一種：
+    年份 > 老師 > 題目開頭 > 選項 > 其他 (接續上一題的文字)，優先順序跟一條一條判斷時一樣。
+    年份和選項可以出現在一行的任何地方，所以用 (?=.*?...) 往後找。
+    course: COURSE_PATTERNS 裡的科目名稱，或是自己給一組規則 (dict)
+    """
+    if isinstance(course, str):
+        if course not in _classifiers:
+            _classifiers[course] = get_line_classifier(COURSE_PATTERNS[course])
+        return _classifiers[course]
+
+    # 年份規則前面如果是「可有可無」的字 (例如 生*化*)，每個位置都要試一次會很慢，
+    # 所以先用 year_hint 確認這行真的有可能是年份
+    year_hint = f"(?=.*?{course['year_hint']})" if course.get("year_hint") else ""
+    teacher = course['teacher']
+    if "(?P<teacher_name>" not in teacher:
+        teacher += "(?P<teacher_name>.*)"
+    return re.compile(
+        "^(?:"
+        f"{year_hint}(?=.*?(?:{course['year']}))"
+        f"|(?P<teacher>{teacher})"
+        f"|{course['question']}"
+        f"|(?=.*?(?P<option>{course['option']}))"
+        ")"
+    )
+
+def classify_line(classifier, line):
+    """ 判斷一行是哪一種，回傳 (種類, match 結果) """
+    match = classifier.match(line)
+    if match is None:
+        return LINE_TEXT, None
+    if match.group("year") is not None:
+        return LINE_YEAR, match
+    if match.group("teacher") is not None:
+        return LINE_TEACHER, match
+    if match.group("qid") is not None:
+        return LINE_QUESTION, match
+    return LINE_OPTION, match
+
+@instrument.timed()
+def parse_and_save_exam(pdf_path, db_path=db_utils.DB_NAME, batch_size=500, workers=1, incremental=False,
+                        course=DEFAULT_COURSE):
+    """
+    解析考古題 PDF 並存進資料庫
+    db_path: 要寫入的資料庫 (預設是 db_utils.DB_NAME)
+    batch_size: 批次寫入時每批幾題
+    workers: 用幾個行程平行抽取 PDF 文字 (1 = 不平行，None = 用全部 CPU 核心)
+    incremental: True = 增量匯入，只重新解析有變動的頁面 (不會清空資料庫)
+    course: 用哪個科目的解析規則 (見 COURSE_PATTERNS)
+    回傳這次寫入的題數。
+
+    整個流程是一條串流管線，每一段都是 generator：
+    PDF 每頁文字 → 一行一行 → 題目 → 過濾亡佚/判斷題型 → 批次寫入資料庫
+    """
+    result = import_pdf(pdf_path, db_path, batch_size, workers, incremental, course)
+    if result is None:
+        return 0
+    count, _ = result
+    refresh_derived(db_path)
+    return count
+
+def refresh_derived(db_path):
+    """ 匯入新題目之後，更新從題目算出來的東西 (一次匯入很多份 PDF 時，最後再呼叫一次就好) """
+    # 7. 順便更新相似題分群 (只有新題目要比對，網頁的模糊抓題就不用現場算)
+    clusters.update_clusters(db_path)
+    # 8. 重新統計各年份、各老師的關鍵詞 (必考重點分析用)
+    analytics.rebuild_term_stats(db_path)
+
+def import_pdf(pdf_path, db_path=db_utils.DB_NAME, batch_size=500, workers=1, incremental=False,
+               course=DEFAULT_COURSE):
+    """
+    parse_and_save_exam 的前半段：只解析、寫入題目，不更新分群和關鍵詞統計 (見 refresh_derived)。
+    回傳 (寫入的題數, 重新解析的頁數)；整份 PDF 沒有變動、直接跳過時回傳 None。
+    """
     # 1. 先初始化資料庫 (確保表格存在)
-    db_utils.init_db()
+    db_utils.init_db(db_path)
     
-    # 2. 清空舊資料 (開發階段我們先這樣做，以免你跑兩次變兩倍資料)
-    db_utils.clear_db()
-
-    current_year = "Unknown"
-    current_teacher = "Unknown"
-    current_question = None 
-    count = 0
+    # 2. 非增量模式：清空舊資料 (開發階段我們先這樣做，以免你跑兩次變兩倍資料)
+    if not incremental:
+        db_utils.clear_db(db_path)
 
     print(f"開始處理: {pdf_path} 並存入資料庫...")
 
+    source = os.path.basename(pdf_path)
+    file_hash = file_fingerprint(pdf_path)
+
+    # 3. 整份檔案沒變就直接跳過，連頁面都不用讀
+    record = db_utils.get_pdf_import(db_path, source)
+    if record and record[0] == file_hash:
+        print(f"{source} 沒有變動，跳過。")
+        return None
+
+    # 4. 比對每一頁的指紋，找出第一個變動的頁面 (後面新加的頁面也算)
+    fingerprints = page_fingerprints(pdf_path)
+    old_pages = db_utils.get_pdf_pages(db_path, source)
+    start = first_changed_page(fingerprints, old_pages)
+
+    # 5. 從變動的那一頁開始重新解析，並還原解析到那一頁開頭時的狀態
+    if start > 0 and start in old_pages:
+        state = json.loads(old_pages[start][1])
+        print(f"前 {start} 頁沒有變動，從第 {start + 1} 頁開始重新解析。")
+    else:
+        start = 0
+        state = new_parser_state(source)
+
+    # 還沒結束的那一題也要重新解析，所以從它開始刪
+    from_seq = state["question"]["source_seq"] if state["question"] else state["seq"]
+
+    pages = []
+    def record_page(page_no, state):
+        fingerprint = fingerprints[page_no] if page_no < len(fingerprints) else None
+        pages.append((page_no, fingerprint, json.dumps(state, ensure_ascii=False)))
+
+    # 6. 邊解析邊批次寫入：整份 PDF 只開一次交易、commit 一次
+    page_texts = iter_page_texts(pdf_path, workers, start=start)
+    lines = iter_lines(page_texts, state, on_page=record_page, start=start)
+    questions = filter_questions(parse_lines(lines, state, course))
+    count = db_utils.replace_pdf_questions(
+        db_path, source, from_seq, start, questions, pages,
+        file_hash, len(fingerprints), batch_size=batch_size
+    )
+
+    print(f"\n成功！共將 {count} 題存入 SQLite 資料庫。")
+    return count, len(fingerprints) - start
+
+def file_fingerprint(pdf_path):
+    """ 整份 PDF 的雜湊值 (SHA-256) """
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def page_fingerprints(pdf_path):
+    """
+    每一頁的指紋：直接對頁面的內容串流 (content stream) 算雜湊，
+    不用做 extract_text 那種很慢的版面分析。
+    """
+    fingerprints = []
     with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            text = page.extract_text()
-            if not text: continue
-            
-            lines = text.split('\n')
-            
-            for line in lines:
+        for page in pdf.pages:
+            digest = hashlib.sha1()
+            for stream in page.page_obj.contents:
+                digest.update(resolve1(stream).get_data())
+            fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+def first_changed_page(fingerprints, old_pages):
+    """ 找出第一個跟上次匯入不一樣的頁面；全部一樣就回傳總頁數 """
+    for page_no, fingerprint in enumerate(fingerprints):
+        if page_no not in old_pages or old_pages[page_no][0] != fingerprint:
+            return page_no
+    return len(fingerprints)
+
+def extract_page_texts(pdf_path, start, end):
+    """ 抽出第 start ~ end-1 頁的文字 (給子行程用，所以每個行程自己開 PDF) """
+    with pdfplumber.open(pdf_path) as pdf:
+        return [page.extract_text() for page in pdf.pages[start:end]]
+
+def iter_page_texts(pdf_path, workers=1, pages_per_task=8, start=0):
+    """
+    依頁碼順序一頁一頁交出文字 (從第 start 頁開始)。
+    extract_text 是匯入時最慢的一步，所以 workers > 1 時把 PDF 切成好幾段頁碼範圍，
+    丟給 ProcessPoolExecutor 平行抽取；executor.map 會照原本順序回傳，結果跟單行程一模一樣。
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages[start:]:
+                yield page.extract_text()
+        return
+
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+    ranges = [(first, min(first + pages_per_task, page_count))
+              for first in range(start, page_count, pages_per_task)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(extract_page_texts,
+                              [pdf_path] * len(ranges),
+                              [r[0] for r in ranges],
+                              [r[1] for r in ranges])
+        for texts in chunks:
+            yield from texts
+
+def iter_lines(page_texts, state=None, on_page=None, start=0):
+    """
+    把每頁文字切成一行一行 (去掉前後空白、跳過空行)。
+    state: 解析狀態，會記下目前讀到第幾頁
+    on_page(page_no, state): 每一頁開始前 (以及全部讀完後) 呼叫一次，
+        這時候前一頁的每一行都已經被 parse_lines 處理完了，可以拿來記錄每頁開頭的狀態
+    """
+    page_no = start
+    for text in page_texts:
+        if state is not None:
+            state["page"] = page_no
+        if on_page:
+            on_page(page_no, state)
+
+        if text:
+            for line in text.split('\n'):
                 line = line.strip()
-                if not line: continue
-
-                # 規則 1: 抓年份
-                year_match = re.search(r"生*化*\s*(B\d+)", line)
-                if year_match:
-                    current_year = year_match.group(1)
-                    continue
-
-                # 規則 2: 抓老師
-                if line.startswith('➢'):
-                    current_teacher = line.replace('➢', '').replace('老師', '').strip()
-                    continue
-
-                # 規則 3: 抓題目開頭
-                question_match = re.match(r'^(\d+)\.\s+(.*)', line)
-                
-                if question_match:
-                    # 如果有上一題，先存上一題
-                    if current_question:
-                        save_single_question(current_question)
-                        count += 1
-                    
-                    # 開始新的一題
-                    current_question = {
-                        "year": current_year,
-                        "teacher": current_teacher,
-                        "question_id": question_match.group(1),
-                        "question_text": question_match.group(2),
-                        "options_text": "",
-                        "full_text": question_match.group(2)
-                    }
-                
-                # 規則 4: 處理選項或內容
-                else:
-                    if current_question:
-                        current_question["full_text"] += "\n" + line
-                        # 簡單判斷是否為選項格式
-                        if re.search(r'\([A-E]\)', line):
-                            current_question["options_text"] += line + "\n"
-                        else:
-                            # ★ 關鍵修正：如果不是選項，就代表它是題目的一部分（第二行）！
-                            # 我們把它加回 question_text，中間補個空白
-                            current_question["question_text"] += " " + line
-
-    # 迴圈結束，存最後一題
-    if current_question:
-        save_single_question(current_question)
-        count += 1
+                if line:
+                    yield line
+        page_no += 1
 
-    print(f"\n成功！共將 {count} 題存入 SQLite 資料庫。")
+    # 全部讀完：記錄結尾的狀態 (page_no = 總頁數)
+    if on_page:
+        on_page(page_no, state)
+
+def new_parser_state(source_pdf=None):
+    """ 解析狀態 (可以存成 JSON，增量匯入時從中間某一頁接著解析) """
+    return {
+        "source": source_pdf,   # 來源 PDF 檔名
+        "page": 0,              # 目前讀到第幾頁
+        "seq": 0,               # 下一題的流水號
+        "year": "Unknown",
+        "teacher": "Unknown",
+        "question": None,       # 還沒結束的題目
+    }
+
+def parse_lines(lines, state=None, course=DEFAULT_COURSE):
+    """
+    題目狀態機：依序讀每一行，記住目前的年份、老師和還沒結束的題目。
+    一定要在主行程照順序跑，題目才不會因為跨頁而被切斷。
+    state: 解析狀態 (new_parser_state)，會隨著解析一路更新；傳入之前存下來的狀態就能接著解析
+    course: 用哪個科目的解析規則 (見 COURSE_PATTERNS)
+
+    還沒結束的題目用 list 收集每一行 (parts)，等題目結束再一次 join，
+    不用每讀一行就把整段字串複製一次。
+    """
+    if state is None:
+        state = new_parser_state()
+    classifier = get_line_classifier(course)
+
+    for line in lines:
+        kind, match = classify_line(classifier, line)
 
-def save_single_question(q_data):
-    """ 輔助函數：判斷題型並呼叫資料庫寫入 """
+        # 規則 1: 抓年份
+        if kind == LINE_YEAR:
+            state["year"] = match.group("year")
+            continue
+
+        # 規則 2: 抓老師
+        if kind == LINE_TEACHER:
+            state["teacher"] = match.group("teacher_name").strip()
+            continue
+
+        # 規則 3: 抓題目開頭
+        current_question = state["question"]
+        
+        if kind == LINE_QUESTION:
+            # 如果有上一題，先交出上一題
+            if current_question:
+                yield finish_question(current_question)
+            
+            # 開始新的一題
+            state["question"] = {
+                "year": state["year"],
+                "teacher": state["teacher"],
+                "question_id": match.group("qid"),
+                "question_parts": [match.group("qtext")],
+                "option_parts": [],
+                "full_parts": [match.group("qtext")],
+                "source_pdf": state["source"],
+                "source_page": state["page"],
+                "source_seq": state["seq"]
+            }
+            state["seq"] += 1
+        
+        # 規則 4: 處理選項或內容
+        elif current_question:
+            current_question["full_parts"].append(line)
+            # 簡單判斷是否為選項格式
+            if kind == LINE_OPTION:
+                current_question["option_parts"].append(line)
+            else:
+                # ★ 關鍵修正：如果不是選項，就代表它是題目的一部分（第二行）！
+                # 我們把它加回 question_text，中間補個空白
+                current_question["question_parts"].append(line)
+
+    # 迴圈結束，交出最後一題
+    if state["question"]:
+        yield finish_question(state["question"])
+
+def finish_question(question):
+    """ 題目結束：把收集到的每一行接成完整的文字 """
+    return {
+        "year": question["year"],
+        "teacher": question["teacher"],
+        "question_id": question["question_id"],
+        "question_text": " ".join(question["question_parts"]),
+        "options_text": "".join(part + "\n" for part in question["option_parts"]),
+        "full_text": "\n".join(question["full_parts"]),
+        "source_pdf": question["source_pdf"],
+        "source_page": question["source_page"],
+        "source_seq": question["source_seq"],
+    }
+
+def filter_questions(questions):
+    """ 管線的過濾階段：跳過亡佚題目、判斷題型 """
+    for q_data in questions:
+        q_data = prepare_question(q_data)
+        if q_data:
+            yield q_data
+
+def prepare_question(q_data):
+    """ 輔助函數：過濾無效題目並判斷題型，回傳 None 代表這題要跳過 """
 
     # 修改 1-2: 過濾「亡佚」題目
     # strip() 會去掉前後空白，確保 " 亡佚 " 也能被抓到
     if q_data["question_text"].strip() == "亡佚":
         print(f"跳過無效題目: {q_data['question_id']} (亡佚)")
-        return
+        return None
     
     # 邏輯判斷：如果 options_text 是空的，或是太短，就當作非選擇題
     # 這裡設定 > 5 個字才算有選項，避免誤判
@@ -95,9 +366,15 @@ def save_single_question(q_data):
         q_data["q_type"] = "選擇題"
     else:
         q_data["q_type"] = "非選擇題"
-        
-    # 呼叫 db_utils 寫入
-    db_utils.insert_question(q_data)
+
+    return q_data
+
+def save_single_question(q_data, db_path=db_utils.DB_NAME):
+    """ 輔助函數：判斷題型並呼叫資料庫寫入 (一次一題) """
+    q_data = prepare_question(q_data)
+    if q_data:
+        # 呼叫 db_utils 寫入
+        db_utils.insert_question(q_data, db_path)
 
 if __name__ == "__main__":
     if os.path.exists(PDF_PATH):
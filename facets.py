@@ -0,0 +1,79 @@
+#篩選條件的統計：每個年份、每位老師有幾題 (給側邊欄的下拉選單用)
+import sqlite3
+
+import pandas as pd
+
+import analytics
+import instrument
+import search_engine
+
+FACET_COLUMNS = ["year", "teacher", "q_type", "questions"]
+
+@instrument.timed()
+def load_facets(db_path):
+    """
+    讀出每個 (年份, 老師, 題型) 組合的題數 (DataFrame)，通常只有幾十列。
+    新的資料庫匯入時就用 trigger 維護好了 (見 db_utils.create_facet_index)，這裡只讀一張小表；
+    還沒升級的舊資料庫 (網頁是唯讀的，不能幫它建表) 就現場 GROUP BY 算一次。
+    """
+    with search_engine.connection(db_path) as conn:
+        try:
+            rows = conn.execute("SELECT year, teacher, q_type, questions FROM question_facets "
+                                "WHERE questions > 0").fetchall()
+        except sqlite3.OperationalError:
+            rows = conn.execute("SELECT year, teacher, q_type, COUNT(*) FROM questions "
+                                "GROUP BY year, teacher, q_type").fetchall()
+    return pd.DataFrame(rows, columns=FACET_COLUMNS)
+
+def _match_teacher(facets, teacher):
+    # 跟搜尋的條件一樣：老師名字有包含就算 (英文不分大小寫，同 LIKE)
+    needle = teacher.lower()
+    # 沒標老師的格子 pandas 可能存成 None 或 NaN
+    return facets["teacher"].map(lambda name: isinstance(name, str) and needle in name.lower()).astype(bool)
+
+def _filter(facets, year=None, teacher=None):
+    if year:
+        facets = facets[facets["year"] == year]
+    if teacher:
+        facets = facets[_match_teacher(facets, teacher)]
+    return facets
+
+def count(facets, year=None, teacher=None):
+    """ 沒有關鍵字時，搜尋會找到幾題 (直接從統計表加總，不用查資料庫) """
+    return int(_filter(facets, year, teacher)["questions"].sum())
+
+def year_counts(facets, teacher=None):
+    """ 每個年份有幾題 (可以先篩老師)，回傳 [(年份, 題數), ...]，新的年份在前面 """
+    totals = _filter(facets, teacher=teacher).groupby("year")["questions"].sum()
+    return sorted(((year, int(n)) for year, n in totals.items()),
+                  key=lambda item: analytics.year_key(item[0]), reverse=True)
+
+def teacher_counts(facets, year=None):
+    """
+    每位老師有幾題 (可以先篩年份)，回傳 [(老師, 題數), ...]，照名字排；
+    沒有標老師的題目放在最後一筆 (老師是 None)，所以名字互不包含時加起來就是總題數。
+    題數跟選這位老師去搜尋時找到的一樣 (名字有包含就算，見 _match_teacher)，
+    所以名字互相包含時 (例如「王」和「王大明」)，短的那個名字會把長的也算進去。
+    """
+    facets = _filter(facets, year=year)
+    names = sorted(facets["teacher"].dropna().unique())
+    counts = [(name, count(facets, teacher=name)) for name in names]
+    unnamed = int(facets.loc[facets["teacher"].isna(), "questions"].sum())
+    if unnamed:
+        counts.append((None, unnamed))
+    return counts
+
+def cross_counts(facets):
+    """ 年份 × 老師 的題數表 (列是老師、欄是年份，沒有題目的格子是 0) """
+    table = facets.pivot_table(index="teacher", columns="year", values="questions", aggfunc="sum", fill_value=0)
+    return table[sorted(table.columns, key=analytics.year_key)]
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else "med_exams.db"
+    facets = load_facets(path)
+    print(f"共 {count(facets)} 題")
+    print("年份:", year_counts(facets))
+    print("老師:", teacher_counts(facets))
+    print(cross_counts(facets))
@@ -0,0 +1,159 @@
+#跨資料庫查詢：一次搜尋 databases 資料夾裡的所有科目
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import pandas as pd
+
+import search_engine
+import text_norm
+
+DB_FOLDER = "databases"
+
+def list_databases(db_folder=DB_FOLDER):
+    """ 列出資料夾裡所有的 .db 檔 (完整路徑，依檔名排序) """
+    if not os.path.isdir(db_folder):
+        return []
+    return [os.path.join(db_folder, f) for f in sorted(os.listdir(db_folder)) if f.endswith('.db')]
+
+def source_name(db_path):
+    """ 結果裡顯示的資料庫名稱 (檔名) """
+    return os.path.basename(db_path)
+
+def _fan_out(func, db_paths, max_workers=None):
+    """ 用執行緒池對每個資料庫各跑一次 func(db_path)，結果依 db_paths 的順序回傳 """
+    if not db_paths:
+        return []
+    # SQLite 查詢時會放掉 GIL，多個資料庫可以同時查
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, len(db_paths))) as executor:
+        return list(executor.map(func, db_paths))
+
+def federated_search(db_paths, year=None, teacher=None, keyword=None, max_workers=None):
+    """
+    跨資料庫搜尋：每個資料庫各自用 search_engine.search_questions 搜尋 (同時進行)，
+    再把結果合併成一張表，多一個 source 欄位標示題目來自哪個資料庫。
+    有關鍵字時，各資料庫的結果已經依相關度排好，合併時依「在自己資料庫裡的名次比例」交錯排列
+    (不同資料庫的 bm25 分數基準不一樣，不能直接比大小)；沒有關鍵字就依年份排序。
+    """
+    def search_one(db_path):
+        return search_engine.search_questions(db_path, year=year, teacher=teacher, keyword=keyword)
+
+    frames = []
+    for db_path, df in zip(db_paths, _fan_out(search_one, db_paths, max_workers)):
+        if df.empty:
+            continue
+        df = df.copy()
+        df.insert(0, "source", source_name(db_path))
+        df["_rank"] = [i / len(df) for i in range(len(df))]
+        frames.append(df)
+
+    if not frames:
+        return pd.DataFrame()
+
+    merged = pd.concat(frames, ignore_index=True)
+    if keyword:
+        merged = merged.sort_values("_rank", kind="stable")
+    else:
+        merged = merged.sort_values("year", ascending=False, kind="stable")
+    return merged.drop(columns="_rank").reset_index(drop=True)
+
+def _attach_limit(conn):
+    """ 一條連線最多可以 ATTACH 幾個資料庫 (SQLite 編譯時的設定，預設 10) """
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    except AttributeError:
+        # Python 3.11 以前沒有 getlimit，用 SQLite 的預設值
+        return 10
+
+def find_cross_duplicates(db_paths, min_count=2, min_databases=1):
+    """
+    跨資料庫抓「一模一樣」的重複題 (只比選擇題)。
+    把資料庫分批 ATTACH 到同一條記憶體連線上 (每批不超過 SQLite 的 attach 上限)，
+    每個資料庫先在自己裡面依正規化後的雜湊值分組，結果存在暫存表，最後再跨資料庫合併一次。
+    min_count: 總共至少出現幾次
+    min_databases: 至少出現在幾個資料庫 (設 2 就只看跨科目重複的題目)
+    """
+    conn = sqlite3.connect("file::memory:", uri=True)
+    # 舊的資料庫沒有 norm_hash 欄位，就當場算 (跟匯入時算的一樣)
+    conn.create_function("norm_hash", 1, text_norm.norm_hash, deterministic=True)
+    conn.execute("""
+    CREATE TEMP TABLE dup_parts (
+        hash TEXT, content TEXT, frequency INTEGER, years TEXT, teachers TEXT, source TEXT
+    )
+    """)
+
+    batch_size = _attach_limit(conn)
+    try:
+        for start in range(0, len(db_paths), batch_size):
+            batch = db_paths[start:start + batch_size]
+            aliases = []
+            for n, db_path in enumerate(batch):
+                alias = f"db{n}"
+                uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+                aliases.append(alias)
+
+            for alias, db_path in zip(aliases, batch):
+                columns = [row[1] for row in conn.execute(f"PRAGMA {alias}.table_info(questions)")]
+                key = "norm_hash" if "norm_hash" in columns else "norm_hash(content)"
+                conn.execute(f"""
+                INSERT INTO dup_parts
+                SELECT {key}, content, COUNT(*), GROUP_CONCAT(year), GROUP_CONCAT(teacher), ?
+                FROM {alias}.questions
+                WHERE q_type = '選擇題'
+                GROUP BY {key}
+                """, (source_name(db_path),))
+
+            # 要先結束交易才能 DETACH
+            conn.commit()
+            for alias in aliases:
+                conn.execute(f"DETACH DATABASE {alias}")
+
+        df = pd.read_sql_query("""
+        SELECT
+            content,
+            SUM(frequency) AS frequency,
+            COUNT(*) AS databases,
+            GROUP_CONCAT(years) AS years,
+            GROUP_CONCAT(teachers) AS teachers,
+            GROUP_CONCAT(source) AS sources
+        FROM dup_parts
+        GROUP BY hash
+        HAVING SUM(frequency) >= ? AND COUNT(*) >= ?  -- 不能寫 frequency，會被當成暫存表的欄位
+        ORDER BY SUM(frequency) DESC
+        """, conn, params=(min_count, min_databases))
+    finally:
+        conn.close()
+    return df
+
+def find_cross_fuzzy_duplicates(db_paths, threshold=85, min_databases=1, method="prefix", max_workers=None,
+                                progress=None):
+    """
+    跨資料庫模糊抓題：把每個資料庫的選擇題一起撈出來 (同時進行)，
+    合在一起用 search_engine 的模糊分組，多一欄「出現資料庫」。
+    min_databases: 至少出現在幾個資料庫
+    progress: 回報進度的函數 (見 search_engine._group_fuzzy_duplicates)
+    """
+    def load_one(db_path):
+        with search_engine.connection(db_path) as conn:
+            return pd.read_sql_query(search_engine.FUZZY_SOURCE_SQL, conn)
+
+    questions = []
+    for db_path, df in zip(db_paths, _fan_out(load_one, db_paths, max_workers)):
+        df["source"] = source_name(db_path)
+        questions += df.to_dict('records')
+
+    if not questions:
+        return pd.DataFrame()
+
+    groups = search_engine.fuzzy_duplicate_groups(questions, threshold, method, progress=progress)
+    groups = [g for g in groups if len(g["出現資料庫"].split(", ")) >= min_databases]
+    return pd.DataFrame(groups)
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    paths = list_databases()
+    print(f"找到 {len(paths)} 個資料庫: {[source_name(p) for p in paths]}")
+    print(federated_search(paths, keyword="糖解作用").head())
+    print(find_cross_duplicates(paths, min_databases=2).head())
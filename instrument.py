@@ -0,0 +1,164 @@
+#效能紀錄：記下每個主要功能花了多久、撈了幾筆、產生多少位元組
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+# 每一筆紀錄都會用 JSON 寫到這個 logger (要看的話把它的 level 設成 INFO)
+logger = logging.getLogger("med_exam.perf")
+
+# 累積的統計 (給 Prometheus 用)：stage -> {calls, errors, seconds, rows_scanned, rows_returned, bytes}
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+# 目前正在執行的 stage (巢狀呼叫時記錄 parent)，以及目前這次重新整理要收集紀錄的 list
+_current = contextvars.ContextVar("instrument_current", default=None)
+_collector = contextvars.ContextVar("instrument_collector", default=None)
+
+def _count_output(result, record):
+    """ 從回傳值猜「回傳幾筆、產生幾個位元組」：DataFrame / list 算筆數，bytes 算大小，int 當作筆數 """
+    if isinstance(result, tuple) and result:
+        # 例如 search_questions_page 回傳 (df, next_cursor)
+        result = result[0]
+    if isinstance(result, (pd.DataFrame, list)):
+        record["rows_returned"] = len(result)
+    elif isinstance(result, (bytes, bytearray)):
+        record["bytes"] = len(result)
+    elif isinstance(result, int) and not isinstance(result, bool):
+        record["rows_returned"] = result
+
+def note(**fields):
+    """
+    在目前的 stage 紀錄裡補上資料，例如 instrument.note(rows_scanned=len(questions))。
+    不在任何 stage 裡面時什麼都不做。
+    """
+    record = _current.get()
+    if record is not None:
+        record.update(fields)
+
+@contextmanager
+def stage(name, **fields):
+    """
+    量一段程式碼：with instrument.stage("search_questions") as record: ...
+    結束時會寫一行 JSON log、累積到 Prometheus 統計，並交給目前的收集器 (debug 面板)。
+    """
+    parent = _current.get()
+    record = {"stage": name, "parent": parent["stage"] if parent else None, **fields}
+    token = _current.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 6)
+        _current.reset(token)
+        _finish(record)
+
+def timed(name=None):
+    """ 裝飾器版的 stage：回傳值是 DataFrame / list / bytes 的話會自動記下筆數或大小 """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                _count_output(result, record)
+                return result
+        return wrapper
+    return decorator
+
+def _finish(record):
+    logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    with _metrics_lock:
+        m = _metrics.setdefault(record["stage"], {
+            "calls": 0, "errors": 0, "seconds": 0.0, "rows_scanned": 0, "rows_returned": 0, "bytes": 0,
+        })
+        m["calls"] += 1
+        m["errors"] += 1 if "error" in record else 0
+        m["seconds"] += record["seconds"]
+        for key in ("rows_scanned", "rows_returned", "bytes"):
+            m[key] += record.get(key) or 0
+
+    records = _collector.get()
+    if records is not None:
+        records.append(record)
+
+def start_collecting():
+    """
+    開始收集這次執行的紀錄 (Streamlit 每次重新整理呼叫一次)，回傳會陸續填入紀錄的 list。
+    注意：在別的執行緒 (例如 ThreadPoolExecutor) 裡跑的 stage 不會收進來，只會進 log 和統計。
+    """
+    records = []
+    _collector.set(records)
+    return records
+
+@contextmanager
+def collect():
+    """ with instrument.collect() as records: ... 區塊裡的紀錄都會放進 records """
+    records = []
+    token = _collector.set(records)
+    try:
+        yield records
+    finally:
+        _collector.reset(token)
+
+def snapshot():
+    """ 目前累積的統計 (複製一份) """
+    with _metrics_lock:
+        return {name: dict(m) for name, m in _metrics.items()}
+
+def prometheus_text():
+    """ 把累積的統計轉成 Prometheus 的文字格式 """
+    series = [
+        ("med_exam_stage_calls_total", "counter", "呼叫次數", "calls"),
+        ("med_exam_stage_errors_total", "counter", "發生錯誤的次數", "errors"),
+        ("med_exam_stage_seconds_total", "counter", "累計花費秒數", "seconds"),
+        ("med_exam_stage_rows_scanned_total", "counter", "累計掃過的筆數", "rows_scanned"),
+        ("med_exam_stage_rows_returned_total", "counter", "累計回傳的筆數", "rows_returned"),
+        ("med_exam_stage_bytes_total", "counter", "累計產生的位元組 (PDF)", "bytes"),
+    ]
+    metrics = snapshot()
+    lines = []
+    for metric, kind, help_text, key in series:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name in sorted(metrics):
+            lines.append(f'{metric}{{stage="{name}"}} {metrics[name][key]}')
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path):
+    """ 把 Prometheus 格式寫到檔案 (給 node_exporter 的 textfile collector 讀) """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    # 先寫暫存檔再改名，讀的人不會讀到寫一半的檔案
+    os.replace(tmp, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_prometheus(port=9108, host="127.0.0.1"):
+    """ 在背景開一個 HTTP 端點，任何路徑都回傳 Prometheus 格式的統計，回傳 server 物件 """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
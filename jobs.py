@@ -0,0 +1,375 @@
+#背景工作：很久的分析 (模糊抓題、跨資料庫比對、大份 PDF) 丟到另外的行程跑，網頁不會卡住
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import clusters
+import db_pool
+import federated
+import pdf_generator
+import search_engine
+import semantic
+
+# 工作狀態記在 JOBS_DB (不要放進 databases 資料夾，不然會被當成題庫)，結果存在 RESULT_DIR
+JOBS_DB = "jobs.db"
+RESULT_DIR = "job_results"
+# 進度最多每幾秒寫一次資料庫 (順便檢查有沒有人按取消)
+PROGRESS_INTERVAL = 0.5
+# 做完的工作保留多久 (秒)，超過就連結果檔一起刪掉
+KEEP_SECONDS = 24 * 60 * 60
+# 每個 JobRunner 每幾秒更新一次心跳；超過 RUNNER_TIMEOUT 秒沒有心跳的 JobRunner 當成已經停了，
+# 它送出、還沒跑完的工作會被其他 JobRunner (或下一個啟動的) 標成失敗
+HEARTBEAT_INTERVAL = 5
+RUNNER_TIMEOUT = 30
+
+ACTIVE = ("queued", "running")
+
+class JobCancelled(Exception):
+    """ 使用者按了取消 (由 JobContext.progress 丟出，讓工作提早結束) """
+
+# --- 可以丟到背景跑的工作 (第一個參數是 JobContext，用來回報進度、決定結果檔放哪裡) ---
+def _fuzzy_duplicates(job, db_path, threshold):
+    return search_engine.find_fuzzy_duplicates(db_path, threshold, progress=job.progress)
+
+def _cross_duplicates(job, db_paths, min_count, min_databases):
+    return federated.find_cross_duplicates(db_paths, min_count, min_databases)
+
+def _cross_fuzzy_duplicates(job, db_paths, threshold, min_databases):
+    return federated.find_cross_fuzzy_duplicates(db_paths, threshold, min_databases, progress=job.progress)
+
+def _semantic_index(job, db_path, index_mtime=None):
+    """ 建立語意索引；index_mtime (目前索引檔的修改時間) 只用來區分工作：索引重建過，再按一次就是新的工作 """
+    return semantic.build_index(db_path, progress=job.progress)
+
+def _semantic_clusters(job, db_path, threshold, index_mtime=None):
+    """ 語意分群；index_mtime 同上 (索引重建過，之前的分群結果就不能用了) """
+    return semantic.semantic_clusters(db_path, threshold, progress=job.progress)
+
+def _search_pdf(job, db_path, year=None, teacher=None, keyword=None):
+    """ 搜尋結果匯出成 PDF：從資料庫一批一批讀，直接寫到結果檔，回傳檔案路徑 """
+    total = search_engine.count_questions(db_path, year, teacher, keyword)
+    batches = search_engine.iter_search_batches(db_path, year, teacher, keyword,
+                                                batch_size=pdf_generator.EXPORT_CHUNK_ROWS)
+    return _export(job, batches, "questions", total)
+
+def _duplicates_pdf(job, db_path, min_count=2, threshold=None):
+    """ 重複題報告匯出成 PDF：有 threshold 就是模糊抓題的結果，沒有就是一模一樣的重複題 """
+    if threshold is None:
+        batches = search_engine.iter_duplicate_batches(db_path, min_count,
+                                                       batch_size=pdf_generator.EXPORT_CHUNK_ROWS)
+        return _export(job, batches, "duplicates")
+    df = clusters.load_clusters(db_path, threshold)
+    if df is not None:
+        return _export(job, [df], "clusters", len(df))
+    df = search_engine.find_fuzzy_duplicates(db_path, threshold)
+    return _export(job, [df], "duplicates", len(df))
+
+def _export(job, batches, layout, total=None):
+    path = job.path(".pdf")
+    if pdf_generator.export_pdf(batches, path, layout, total, progress=job.progress,
+                                workers=pdf_generator.EXPORT_WORKERS) is None:
+        raise RuntimeError(f"找不到字型檔 {pdf_generator.FONT_PATH}")
+    return path
+
+TASKS = {
+    "fuzzy_duplicates": _fuzzy_duplicates,
+    "cross_duplicates": _cross_duplicates,
+    "cross_fuzzy_duplicates": _cross_fuzzy_duplicates,
+    "semantic_index": _semantic_index,
+    "semantic_clusters": _semantic_clusters,
+    "search_pdf": _search_pdf,
+    "duplicates_pdf": _duplicates_pdf,
+}
+
+def _connect(jobs_db):
+    conn = sqlite3.connect(jobs_db, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def init_jobs_db(jobs_db=JOBS_DB):
+    conn = _connect(jobs_db)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,        -- 工作內容的雜湊值 (同樣的工作 = 同一個 id)
+        kind TEXT,
+        params TEXT,                -- JSON
+        status TEXT,                -- queued / running / done / failed / cancelled
+        progress REAL DEFAULT 0,    -- 0 ~ 1
+        cancel_requested INTEGER DEFAULT 0,
+        runner TEXT,                -- 哪一個 JobRunner 送出的
+        result_path TEXT,
+        error TEXT,
+        created_at REAL,
+        finished_at REAL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS runners (
+        id TEXT PRIMARY KEY,        -- JobRunner.runner_id
+        heartbeat REAL              -- 最後一次心跳的時間
+    )
+    """)
+    conn.commit()
+    conn.close()
+
+def job_key(kind, params):
+    """
+    工作的 id：工作種類 + 參數 + 用到的資料庫版本。
+    十個人對同一個資料庫按「開始分析」會拿到同一個 id，共用同一次計算；
+    資料庫匯入新題目之後版本變了，就會是新的工作。
+    """
+    paths = params.get("db_paths") or [params["db_path"]]
+    versions = [db_pool.db_version(path) for path in paths]
+    raw = json.dumps([kind, params, versions], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class JobContext:
+    """ 給工作用的小幫手：回報進度 (順便檢查取消)、決定結果檔的路徑 """
+
+    def __init__(self, job_id, conn, result_dir):
+        self.job_id = job_id
+        self.conn = conn
+        self.result_dir = result_dir
+        self._last_write = 0.0
+
+    def progress(self, fraction):
+        """ 回報進度 (0 ~ 1)；使用者按了取消的話會丟出 JobCancelled """
+        now = time.monotonic()
+        if now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        self.conn.execute("UPDATE jobs SET progress=? WHERE id=?", (round(fraction, 4), self.job_id))
+        self.conn.commit()
+        if self.conn.execute("SELECT cancel_requested FROM jobs WHERE id=?", (self.job_id,)).fetchone()[0]:
+            raise JobCancelled()
+
+    def path(self, suffix):
+        """ 工作自己要寫的結果檔 (例如 PDF) 放這裡，清理舊工作時會一起刪掉 """
+        return os.path.join(self.result_dir, self.job_id + suffix)
+
+def _run_job(job_id, kind, params, jobs_db, result_dir):
+    """ 在工作行程裡執行一個工作，狀態和結果都寫回 jobs_db / result_dir """
+    conn = _connect(jobs_db)
+    try:
+        # 排隊的時候就被取消的話不用跑
+        claimed = conn.execute("UPDATE jobs SET status='running' WHERE id=? AND status='queued'", (job_id,))
+        conn.commit()
+        if claimed.rowcount == 0:
+            return
+
+        job = JobContext(job_id, conn, result_dir)
+        try:
+            result = TASKS[kind](job, **params)
+        except JobCancelled:
+            conn.execute("UPDATE jobs SET status='cancelled', finished_at=? WHERE id=?", (time.time(), job_id))
+            conn.commit()
+            return
+        except Exception as e:
+            conn.execute("UPDATE jobs SET status='failed', error=?, finished_at=? WHERE id=?",
+                         (f"{type(e).__name__}: {e}", time.time(), job_id))
+            conn.commit()
+            return
+
+        # 先寫暫存檔再改名，讀結果的人不會讀到寫一半的檔案
+        result_path = job.path(".pkl")
+        with open(result_path + ".tmp", "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(result_path + ".tmp", result_path)
+        conn.execute("UPDATE jobs SET status='done', progress=1, result_path=?, finished_at=? WHERE id=?",
+                     (result_path, time.time(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _init_worker(snapshots, export_workers):
+    """ 工作行程啟動時的設定 (行程是全新的 Python，網頁那邊的設定不會帶過來) """
+    search_engine.use_snapshots(snapshots)
+    pdf_generator.EXPORT_WORKERS = export_workers
+
+class JobRunner:
+    """
+    背景工作管理員 (整台伺服器共用一個)：工作在行程池裡跑，狀態記在 jobs_db。
+    同一個工作還在排隊、正在跑、或已經跑完時再送一次，都直接回傳原本的 id。
+    """
+
+    def __init__(self, jobs_db=JOBS_DB, result_dir=RESULT_DIR, max_workers=None, snapshots=False):
+        self.jobs_db = jobs_db
+        # 工作行程是全新的 Python，要不要用題庫快照 (search_engine.use_snapshots) 得在這裡另外設定
+        self.snapshots = snapshots
+        self.result_dir = result_dir
+        self.runner_id = uuid.uuid4().hex
+        os.makedirs(result_dir, exist_ok=True)
+        init_jobs_db(jobs_db)
+        self._beat()
+        self._cleanup()
+        # 留一顆核心給網頁本身
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        # 每個工作匯出 PDF 時最多再開幾個排版行程：核心平均分給同時在跑的工作，
+        # 不然每個工作都開 cpu_count 個，最多會同時有 cpu x cpu 個行程
+        self.export_workers = min(pdf_generator.EXPORT_WORKERS,
+                                  max(1, (os.cpu_count() or 1) // self.max_workers))
+        self._executor = self._new_executor()
+        # 同一個 jobs_db 可能有好幾個 JobRunner (例如開了好幾個 Streamlit 行程)，用心跳判斷誰還活著
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _new_executor(self):
+        # 用 spawn 開新行程 (Streamlit 有很多執行緒，fork 不安全，Windows 也只能 spawn)
+        return ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(self.snapshots, self.export_workers))
+
+    def _beat(self):
+        """ 記下「這個 JobRunner 還活著」 """
+        conn = _connect(self.jobs_db)
+        try:
+            conn.execute("INSERT OR REPLACE INTO runners (id, heartbeat) VALUES (?, ?)",
+                         (self.runner_id, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                self._beat()
+                self._fail_orphaned_jobs()
+            except sqlite3.Error:
+                # jobs_db 暫時鎖住之類的，下一次心跳再試
+                pass
+
+    def _fail_orphaned_jobs(self):
+        """
+        送出它們的 JobRunner 已經停了 (太久沒有心跳) 的工作標成失敗：那邊的行程池跟著不見了，
+        這些工作永遠不會跑完。其他還活著的 JobRunner 的工作不會動到。
+        """
+        conn = _connect(self.jobs_db)
+        try:
+            conn.execute("DELETE FROM runners WHERE heartbeat < ?", (time.time() - RUNNER_TIMEOUT,))
+            conn.execute("""
+            UPDATE jobs SET status='failed', error='送出工作的伺服器已經停止，工作中斷', finished_at=?
+            WHERE status IN ('queued', 'running')
+              AND (runner IS NULL OR runner NOT IN (SELECT id FROM runners))
+            """, (time.time(),))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _cleanup(self):
+        """ 啟動時整理：已經停掉的 JobRunner 沒跑完的工作標成失敗，太舊的結果刪掉 """
+        self._fail_orphaned_jobs()
+        conn = _connect(self.jobs_db)
+        try:
+            old = conn.execute("SELECT id, result_path FROM jobs WHERE finished_at < ?",
+                               (time.time() - KEEP_SECONDS,)).fetchall()
+            for job_id, _ in old:
+                for path in glob.glob(os.path.join(self.result_dir, job_id + ".*")):
+                    os.remove(path)
+            conn.executemany("DELETE FROM jobs WHERE id=?", [(job_id,) for job_id, _ in old])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def submit(self, kind, **params):
+        """ 送出一個工作 (kind 是 TASKS 裡的名字)，回傳 job id """
+        if kind not in TASKS:
+            raise ValueError(f"未知的工作種類: {kind}")
+        job_id = job_key(kind, params)
+        conn = _connect(self.jobs_db)
+        try:
+            # IMMEDIATE：同時有兩個人送出同一個工作時，只有一個人會真的建立它
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT status, result_path FROM jobs WHERE id=?", (job_id,)).fetchone()
+            if row and (row[0] in ACTIVE or (row[0] == "done" and os.path.exists(row[1]))):
+                conn.rollback()
+                return job_id
+            # 沒有、失敗、取消、或結果檔不見了：重新排隊
+            conn.execute("""
+            INSERT OR REPLACE INTO jobs (id, kind, params, status, progress, runner, created_at)
+            VALUES (?, ?, ?, 'queued', 0, ?, ?)
+            """, (job_id, kind, json.dumps(params, ensure_ascii=False), self.runner_id, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+        args = (_run_job, job_id, kind, params, self.jobs_db, self.result_dir)
+        try:
+            future = self._executor.submit(*args)
+        except BrokenProcessPool:
+            # 有工作行程當掉 (例如記憶體不夠被砍)，整個池子就不能用了：換一個新的
+            self._executor = self._new_executor()
+            future = self._executor.submit(*args)
+        future.add_done_callback(lambda f: self._check_crashed(job_id, f))
+        return job_id
+
+    def _check_crashed(self, job_id, future):
+        """ 工作行程整個當掉時 _run_job 來不及寫狀態，在這裡補標成失敗 (不然會永遠停在「執行中」) """
+        if future.cancelled() or future.exception() is None:
+            return
+        conn = _connect(self.jobs_db)
+        try:
+            conn.execute("UPDATE jobs SET status='failed', error=?, finished_at=? WHERE id=? AND status IN ('queued', 'running')",
+                         (f"工作行程異常結束: {future.exception()!r}", time.time(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def status(self, job_id):
+        """ 工作目前的狀態 (dict)，找不到就回傳 None """
+        conn = _connect(self.jobs_db)
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def result(self, job_id):
+        """ 跑完的工作的結果 (還沒跑完就回傳 None) """
+        job = self.status(job_id)
+        if not job or job["status"] != "done":
+            return None
+        with open(job["result_path"], "rb") as f:
+            return pickle.load(f)
+
+    def cancel(self, job_id):
+        """
+        取消工作：還在排隊的直接取消；正在跑的會在下一次回報進度時停下來。
+        注意：大家共用同一個工作，所以任何一個人取消，等同一個結果的其他人也會被取消。
+        """
+        conn = _connect(self.jobs_db)
+        try:
+            conn.execute("UPDATE jobs SET cancel_requested=1 WHERE id=? AND status IN ('queued', 'running')",
+                         (job_id,))
+            conn.execute("UPDATE jobs SET status='cancelled', finished_at=? WHERE id=? AND status='queued'",
+                         (time.time(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def shutdown(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else "med_exams.db"
+    runner = JobRunner()
+    job_id = runner.submit("fuzzy_duplicates", db_path=path, threshold=85)
+    print(f"送出工作 {job_id}")
+    while runner.status(job_id)["status"] in ACTIVE:
+        print(f"進度 {runner.status(job_id)['progress']:.0%}")
+        time.sleep(1)
+    print(runner.status(job_id)["status"], runner.status(job_id)["error"] or "")
+    print(runner.result(job_id))
+    runner.shutdown()
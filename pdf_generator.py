@@ -1,85 +1,440 @@
+import fpdf
 from fpdf import FPDF
+from fpdf.fonts import SubsetMap, get_color_font_object
+from fontTools import ttLib
 import pandas as pd
+import pypdfium2 as pdfium
+import copy
+import gc
+import io
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+import instrument
 
 # --- 設定區 ---
 # 請確認這裡的檔名跟你剛剛複製進來的字型檔名一樣
-FONT_PATH = 'msjh.ttf'  
+FONT_PATH = 'msjh.ttf'
 FONT_NAME = 'MicrosoftJhengHei'
+# 排版時每幾題回報一次進度
+PROGRESS_EVERY = 50
+# 串流匯出時一份分段 PDF 最多排幾題 (記憶體裡同時只會有這麼多題的排版資料)；
+# 每一段都從新的一頁開始，所以設太小的話頁數會變多
+EXPORT_CHUNK_ROWS = 500
+# 平行排版最多用幾個行程 (背景匯出用；1 = 不平行)，可以用環境變數 MED_EXAM_EXPORT_WORKERS 設定。
+# 背景工作本身就在 JobRunner 的行程池裡跑，JobRunner 會再把它降成每個工作平均分到的核心數
+EXPORT_WORKERS = int(os.environ.get("MED_EXAM_EXPORT_WORKERS", 0)) or os.cpu_count() or 1
 
 class ExamPDF(FPDF):
+    def __init__(self, heading='醫學系考古題彙編', page_offset=0, **kwargs):
+        super().__init__(**kwargs)
+        self.heading = heading
+        # 分段排版時，這一段前面已經有幾頁 (頁碼要接著算)；
+        # None = 不知道 (平行排版)，先不印頁碼，接起來之後再用 stamp_page_numbers 蓋上
+        self.page_offset = page_offset
+
     def header(self):
         # 設定標題字型 (粗體)
         self.set_font(FONT_NAME, '', 16)
         # 標題文字
-        self.cell(0, 10, '醫學系考古題彙編', align='C', new_x="LMARGIN", new_y="NEXT")
+        self.cell(0, 10, self.heading, align='C', new_x="LMARGIN", new_y="NEXT")
         self.ln(5) # 空行
 
     def footer(self):
         # 設定頁尾位置 (距離底部 1.5cm)
+        if self.page_offset is None:
+            return
         self.set_y(-15)
         self.set_font(FONT_NAME, '', 8)
         # 頁碼
-        self.cell(0, 10, f'Page {self.page_no()}', align='C')
+        self.cell(0, 10, f'Page {self.page_no() + self.page_offset}', align='C')
 
-def generate_exam_pdf(questions_df, filename="output/exam_paper.pdf"):
+class PageNumberPDF(ExamPDF):
+    """ 只有頁碼的空白頁 (平行排版接好之後，疊到每一頁上) """
+
+    def header(self):
+        pass
+
+# --- 字型快取 ---
+# 中文字型檔很大 (好幾 MB)，每次 add_font 都要重新解析一次字元對照表。
+# 這裡每個行程只解析一次，之後每份 PDF 都拿解析好的結果來用。
+_font_cache = {}
+_font_lock = threading.Lock()
+
+def _load_font_template(font_path):
+    """ 解析字型檔一次，回傳 (解析好的字型, 字型檔內容)；字型檔更新過會自動重新解析 """
+    key = (os.path.abspath(font_path), os.path.getmtime(font_path))
+    with _font_lock:
+        if key not in _font_cache:
+            # 用一份丟棄式的 PDF 來解析，這份字型本身不會拿去輸出
+            scratch = FPDF()
+            scratch.add_font(FONT_NAME, '', font_path)
+            with open(font_path, 'rb') as f:
+                font_bytes = f.read()
+            _font_cache.clear()
+            _font_cache[key] = (scratch.fonts[FONT_NAME.lower()], font_bytes)
+        return _font_cache[key]
+
+# add_cached_font 複製字型時會換掉 / 重設的欄位 (fpdf2 的 TTFFont 內部欄位)
+_PER_DOCUMENT_FONT_FIELDS = ("i", "fontkey", "ttfont", "subset", "biggest_size_pt", "missing_glyphs",
+                             "_hbfont", "color_font", "palette_index")
+# 複製字型的做法只在這個 fpdf2 版本驗證過 (requirements.txt 也固定在這個版本)，
+# 其他版本的 TTFFont 內部結構可能不一樣，就改用一般的 add_font
+FONT_CACHE_FPDF_VERSION = "2.8."
+
+def add_cached_font(pdf, font_path=None):
     """
-    接收一個 Pandas DataFrame (搜尋結果)，生成 PDF。
+    把快取的中文字型加進這份 PDF (取代 pdf.add_font)。
+    字元寬度、對照表等唯讀資料大家共用；每份文件各自的東西 (用到哪些字的 subset、
+    輸出時會被裁切的 fontTools 物件) 則重新建立，文件之間互不影響。
     """
-    
-    # 檢查字型檔是否存在
-    if not os.path.exists(FONT_PATH):
-        print(f"錯誤：找不到字型檔 '{FONT_PATH}'！請將中文字型檔複製到專案資料夾中。")
+    font_path = font_path or FONT_PATH
+    template, font_bytes = _load_font_template(font_path)
+    # fpdf2 內部結構不一樣的版本：複製出來的字型輸出時會壞掉，所以先檢查，不符合就退回最保險的做法
+    if (not fpdf.__version__.startswith(FONT_CACHE_FPDF_VERSION)
+            or not all(hasattr(template, field) for field in _PER_DOCUMENT_FONT_FIELDS)):
+        pdf.add_font(FONT_NAME, '', font_path)
         return
 
+    font = copy.copy(template)
+    font.i = len(pdf.fonts) + 1
+    # 輸出時 fpdf2 會直接把 ttfont 裁成 subset，所以每份文件要有自己的一份 (lazy 載入很快)
+    font.ttfont = ttLib.TTFont(io.BytesIO(font_bytes), recalcTimestamp=False, lazy=True)
+    font.subset = SubsetMap(font)
+    font.biggest_size_pt = 0
+    font.missing_glyphs = []
+    font._hbfont = None
+    # 彩色字型的資料是從 ttfont 讀出來的，要跟著新的 ttfont 重建 (跟 TTFFont 建構時一樣)
+    font.color_font = (get_color_font_object(pdf, font, font.palette_index)
+                       if pdf.render_color_fonts else None)
+    pdf.fonts[template.fontkey] = font
+
+# --- 排版樣式 ---
+# 每一種樣式 = 標題 + 排一筆資料的函數 layout(pdf, 題號, row)
+def _layout_question(pdf, number, row):
+    """ 題目列表 (搜尋結果)：年份/老師/類型、題目、選項 """
+    # 1. 題目資訊 (年份/老師/類型)
+    # 設定灰色、小字
+    pdf.set_text_color(100, 100, 100)
+    pdf.set_font_size(9)
+    meta_info = f"[{row.year}] {row.teacher} ({row.q_type})"
+    pdf.cell(0, 6, meta_info, new_x="LMARGIN", new_y="NEXT")
+
+    # 2. 題目內容
+    # 恢復黑色、正常字
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font_size(12)
+
+    # 題目文字 (加上題號)
+    question_content = f"{number}. {row.content}"
+    # multi_cell 可以自動換行
+    pdf.multi_cell(0, 7, question_content)
+
+    # 3. 選項 (如果是選擇題)
+    if row.q_type == '選擇題' and row.options:
+        pdf.set_font_size(11)
+        # 稍微縮排
+        pdf.set_x(20)
+        # 處理選項換行
+        pdf.multi_cell(0, 6, row.options)
+
+    # 每一題之間空一行
+    pdf.ln(8)
+
+def _layout_duplicate(pdf, number, row):
+    """ 重複題報告：重複幾次、出現在哪些年份 (老師、資料庫)，再印出題目 """
+    pdf.set_text_color(100, 100, 100)
+    pdf.set_font_size(9)
+    meta_info = f"重複 {row.frequency} 次 | 年份：{row.years}"
+    if getattr(row, "teachers", None):
+        meta_info += f" | 老師：{row.teachers}"
+    if getattr(row, "sources", None):
+        meta_info += f" | 資料庫：{row.sources}"
+    pdf.multi_cell(0, 5, meta_info, new_x="LMARGIN", new_y="NEXT")
+
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font_size(12)
+    pdf.multi_cell(0, 7, f"{number}. {row.content}")
+    pdf.ln(8)
+
+# 重複題有好幾種來源，欄位名稱不一樣 (find_duplicate_questions / find_fuzzy_duplicates /
+# 跨資料庫)，排版前統一改成英文欄位名稱
+DUPLICATE_COLUMNS = {
+    "主要題目": "content",
+    "重複次數": "frequency",
+    "出現年份": "years",
+    "出現資料庫": "sources",
+}
+
+LAYOUTS = {
+    "questions": ("醫學系考古題彙編", _layout_question),
+    "duplicates": ("重複考題整理", _layout_duplicate),
+    # 從預先分群讀出來的相似題 (clusters.load_clusters)，是近似結果，標題要寫清楚
+    "clusters": ("相似題整理 (預先分群，近似結果)", _layout_duplicate),
+}
+
+def _render_part(rows_df, output, layout="questions", number_offset=0, page_offset=0, progress=None):
+    """
+    把一段資料排成 PDF 寫到 output，回傳頁數。
+    number_offset / page_offset：前面的分段已經排了幾題、幾頁 (題號和頁碼接著算)
+    """
+    heading, layout_row = LAYOUTS[layout]
+    if layout_row is _layout_duplicate:
+        rows_df = rows_df.rename(columns=DUPLICATE_COLUMNS)
+
     # 初始化 PDF
-    pdf = ExamPDF()
-    
-    # 註冊中文字型
-    pdf.add_font(FONT_NAME, '', FONT_PATH)
-    
+    pdf = ExamPDF(heading=heading, page_offset=page_offset)
+
+    # 註冊中文字型 (用快取，不會每次重新解析字型檔)
+    add_cached_font(pdf)
+
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.set_font(FONT_NAME, '', 11)
 
-    print(f"正在生成 PDF: {filename} ...")
-
     # 遍歷每一題
     # enumerate(..., 1) 讓我們可以重新編號 (1, 2, 3...)
-    for index, row in enumerate(questions_df.itertuples(), 1):
-        
-        # 1. 題目資訊 (年份/老師/類型)
-        # 設定灰色、小字
-        pdf.set_text_color(100, 100, 100)
-        pdf.set_font_size(9)
-        meta_info = f"[{row.year}] {row.teacher} ({row.q_type})"
-        pdf.cell(0, 6, meta_info, new_x="LMARGIN", new_y="NEXT")
-        
-        # 2. 題目內容
-        # 恢復黑色、正常字
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_font_size(12)
-        
-        # 題目文字 (加上題號)
-        question_content = f"{index}. {row.content}"
-        # multi_cell 可以自動換行
-        pdf.multi_cell(0, 7, question_content)
-        
-        # 3. 選項 (如果是選擇題)
-        if row.q_type == '選擇題' and row.options:
-            pdf.set_font_size(11)
-            # 稍微縮排
-            pdf.set_x(20) 
-            # 處理選項換行
-            pdf.multi_cell(0, 6, row.options)
-        
-        # 每一題之間空一行
-        pdf.ln(8)
-
-    # 輸出檔案
-    pdf.output(filename)
+    for index, row in enumerate(rows_df.itertuples(), 1):
+        if progress is not None and index % PROGRESS_EVERY == 1:
+            progress((index - 1) / len(rows_df))
+        layout_row(pdf, number_offset + index, row)
+
+    # 輸出 (檔名或 BytesIO 都可以)
+    pdf.output(output)
+    return pdf.page_no()
+
+def render_questions(questions_df, output, progress=None):
+    """
+    共用的排版核心：把題目 (DataFrame) 排成 PDF，寫到 output。
+    output 可以是檔名，也可以是 BytesIO 之類的 file-like 物件。
+    progress: 每排好 PROGRESS_EVERY 題呼叫一次 progress(完成比例) (背景工作用)
+    """
+    pages = _render_part(questions_df, output, progress=progress)
+    instrument.note(rows_scanned=len(questions_df), pages=pages)
+
+def stamp_page_numbers(doc):
+    """
+    在 pypdfium2 的文件每一頁蓋上連續的頁碼 (位置、字型跟 ExamPDF 的頁尾一樣)：
+    先用 fpdf2 排出同樣頁數、只有頁碼的空白頁，再把每一頁當成 XObject 疊上去。
+    """
+    stamps = PageNumberPDF()
+    add_cached_font(stamps)
+    for _ in range(len(doc)):
+        stamps.add_page()
+    stamp_doc = pdfium.PdfDocument(bytes(stamps.output()))
+    try:
+        for i in range(len(doc)):
+            page = doc[i]
+            xobject = stamp_doc.page_as_xobject(i, doc)
+            page.insert_obj(xobject.as_pageobject())
+            page.gen_content()
+            page.close()
+    finally:
+        stamp_doc.close()
+
+def merge_pdfs(parts, output, page_numbers=False):
+    """
+    把好幾份 PDF 依順序接成一份 (一次只開一份來源檔)。
+    page_numbers: 各段沒有印頁碼 (平行排版) 的話，接好之後統一蓋上連續的頁碼
+    """
+    if len(parts) == 1 and not page_numbers:
+        shutil.copyfile(parts[0], output)
+        return
+
+    merged = pdfium.PdfDocument.new()
+    try:
+        for part in parts:
+            src = pdfium.PdfDocument(part)
+            try:
+                merged.import_pages(src)
+            finally:
+                src.close()
+        if page_numbers:
+            stamp_page_numbers(merged)
+        merged.save(output)
+    finally:
+        merged.close()
+
+def _render_part_file(rows_df, output, layout, number_offset):
+    """ 平行排版的工作行程：排一段 (不印頁碼)，回傳 (題數, 頁數) """
+    return len(rows_df), _render_part(rows_df, output, layout, number_offset, page_offset=None)
+
+def _export_serial(batches, folder, layout, total, progress):
+    """ 一段一段依序排版，頁碼直接接著印；回傳 (分段檔案, 筆數, 頁數) """
+    count = 0
+    pages = 0
+    parts = []
+    for batch in batches:
+        if batch.empty:
+            continue
+        part = os.path.join(folder, f"part{len(parts):05d}.pdf")
+        pages += _render_part(batch, part, layout, number_offset=count, page_offset=pages)
+        count += len(batch)
+        parts.append(part)
+        # fpdf2 的文件物件有循環參照，不手動回收的話好幾段的排版資料會一直留在記憶體裡
+        gc.collect()
+        if progress is not None and total:
+            progress(min(count / total, 1.0))
+    return parts, count, pages
+
+def _export_parallel(batches, folder, layout, total, progress, workers):
+    """
+    用行程池同時排好幾段：題號在送出時就知道 (前面幾段的題數加起來)，
+    頁碼要等全部排完才知道，所以各段先不印，合併時再蓋上。
+    同時最多只有 workers * 2 段在排隊，記憶體用量一樣是固定的。
+    """
+    count = 0
+    done = 0
+    pages = 0
+    parts = []
+    pending = deque()
+
+    def finish_oldest():
+        nonlocal done, pages
+        rows, part_pages = pending.popleft().result()
+        done += rows
+        pages += part_pages
+        if progress is not None and total:
+            progress(min(done / total, 1.0))
+
+    # 用 spawn 開新行程 (跟 jobs.py 一樣，Streamlit 底下 fork 不安全)
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        for batch in batches:
+            if batch.empty:
+                continue
+            part = os.path.join(folder, f"part{len(parts):05d}.pdf")
+            pending.append(executor.submit(_render_part_file, batch, part, layout, count))
+            count += len(batch)
+            parts.append(part)
+            while len(pending) >= workers * 2:
+                finish_oldest()
+        while pending:
+            finish_oldest()
+    finally:
+        # 中途出錯或被取消時，還沒開始排的段落就不用排了
+        executor.shutdown(wait=True, cancel_futures=True)
+    return parts, count, pages
+
+@instrument.timed()
+def export_pdf(batches, output, layout="questions", total=None, progress=None, workers=1):
+    """
+    串流匯出：batches 是一批一批的 DataFrame (例如 search_engine.iter_search_batches)，
+    每一批排成一份分段 PDF 存在暫存資料夾，全部排完再接成一份寫到 output (檔名)。
+    記憶體裡同時只有一批的排版資料，匯出整個題庫也不會把整份文件留在記憶體裡。
+    代價是每一批都從新的一頁開始 (有標題)，上一批最後一頁沒排滿的空間不會接著用，
+    所以頁數會比一次排完多一點：每 EXPORT_CHUNK_ROWS 題最多多一頁 (題號、頁碼還是連續的)。
+    layout: "questions" (題目列表)、"duplicates" (重複題報告) 或 "clusters" (預先分群的相似題，近似結果)
+    total: 總筆數 (知道的話進度才算得出來)
+    workers: 大於 1 就用這麼多個行程平行排版 (題號、頁碼一樣是連續的)；
+             分段數比 workers 少的小份匯出直接在這個行程排 (開行程、載入字型比排版本身還久)
+    回傳 (筆數, 頁數)
+    """
+    if not os.path.exists(FONT_PATH):
+        return None
+
+    if workers > 1:
+        batches = iter(batches)
+        head = list(islice(batches, workers))
+        if len(head) < workers:
+            workers = 1
+        batches = chain(head, batches)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if workers > 1:
+            parts, count, pages = _export_parallel(batches, tmp, layout, total, progress, workers)
+        else:
+            parts, count, pages = _export_serial(batches, tmp, layout, total, progress)
+        if not parts:
+            # 沒有資料也產生一份只有標題的 PDF
+            part = os.path.join(tmp, "empty.pdf")
+            pages += _render_part(pd.DataFrame(), part, layout)
+            parts.append(part)
+            workers = 1
+        merge_pdfs(parts, output, page_numbers=workers > 1)
+
+    instrument.note(rows_scanned=count, pages=pages, bytes=os.path.getsize(output))
+    return count, pages
+
+@instrument.timed()
+def generate_exam_pdf(questions_df, filename="output/exam_paper.pdf"):
+    """
+    接收一個 Pandas DataFrame (搜尋結果)，生成 PDF。
+    """
+
+    # 檢查字型檔是否存在
+    if not os.path.exists(FONT_PATH):
+        print(f"錯誤：找不到字型檔 '{FONT_PATH}'！請將中文字型檔複製到專案資料夾中。")
+        return
+
+    print(f"正在生成 PDF: {filename} ...")
+    render_questions(questions_df, filename)
+    instrument.note(bytes=os.path.getsize(filename))
     print(f"PDF 產出完成！路徑：{filename}")
 
+@instrument.timed()
+def get_pdf_bytes(questions_df, progress=None):
+    """
+    生成 PDF 並回傳二進位資料 (bytes)，供 Streamlit 下載按鈕使用
+    """
+    if not os.path.exists(FONT_PATH):
+        return None
+
+    buffer = io.BytesIO()
+    render_questions(questions_df, buffer, progress)
+    return buffer.getvalue()
+
+class PDFCache:
+    """
+    產生好的 PDF 快取 (LRU)：同樣的查詢條件第二次下載就不用重新排版。
+    key 由呼叫的人決定 (例如 資料庫路徑 + 資料庫版本 + 查詢條件)，
+    總大小超過 max_bytes 時，最久沒用到的 PDF 會先被丟掉。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        # 單一檔案就超過上限的話，不放進快取
+        if data is None or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.total_bytes -= len(self._items.pop(key))
+            self._items[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, oldest = self._items.popitem(last=False)
+                self.total_bytes -= len(oldest)
+
+    def get_or_create(self, key, make_pdf):
+        """ 有快取就直接回傳，沒有才呼叫 make_pdf() 產生並存起來 """
+        data = self.get(key)
+        if data is None:
+            data = make_pdf()
+            self.put(key, data)
+        return data
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
 # --- 測試區 ---
 if __name__ == "__main__":
     # 假裝有一筆資料來測試
@@ -91,56 +446,5 @@ if __name__ == "__main__":
         'options': ['(A) 選項一\n(B) 選項二', '(A) A\n(B) B']
     }
     df = pd.DataFrame(data)
-    
-    generate_exam_pdf(df, "test_exam.pdf")
-
-def get_pdf_bytes(questions_df):
-    """
-    生成 PDF 並回傳二進位資料 (bytes)，供 Streamlit 下載按鈕使用
-    """
-    if not os.path.exists(FONT_PATH):
-        return None
-
-    pdf = ExamPDF()
-    pdf.add_font(FONT_NAME, '', FONT_PATH)
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font(FONT_NAME, '', 11)
-
-    # 遍歷每一題
-    # enumerate(..., 1) 讓我們可以重新編號 (1, 2, 3...)
-    for index, row in enumerate(questions_df.itertuples(), 1):
-        
-        # 1. 題目資訊 (年份/老師/類型)
-        # 設定灰色、小字
-        pdf.set_text_color(100, 100, 100)
-        pdf.set_font_size(9)
-        meta_info = f"[{row.year}] {row.teacher} ({row.q_type})"
-        pdf.cell(0, 6, meta_info, new_x="LMARGIN", new_y="NEXT")
-        
-        # 2. 題目內容
-        # 恢復黑色、正常字
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_font_size(12)
-        
-        # 題目文字 (加上題號)
-        question_content = f"{index}. {row.content}"
-        # multi_cell 可以自動換行
-        pdf.multi_cell(0, 7, question_content)
-        
-        # 3. 選項 (如果是選擇題)
-        if row.q_type == '選擇題' and row.options:
-            pdf.set_font_size(11)
-            # 稍微縮排
-            pdf.set_x(20) 
-            # 處理選項換行
-            pdf.multi_cell(0, 6, row.options)
-        
-        # 每一題之間空一行
-        pdf.ln(8)
-
-    # === 修改這行 ===
-    # 原本是: return pdf.output()
-    # 請改成下面這樣，用 bytes() 包起來：
-    return bytes(pdf.output())
 
+    generate_exam_pdf(df, "test_exam.pdf")
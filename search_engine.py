@@ -1,95 +1,460 @@
+import bisect
 import sqlite3
+import math
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz # <--- 新增這個
+from rapidfuzz import fuzz, process # <--- 新增這個
+import instrument
+import snapshot
 #from db_utils import DB_NAME # 引用我們之前設定好的資料庫名稱
 
+# 模糊比對要撈的題目 (所有選擇題)；分組是貪婪的、跟順序有關，固定照 id 排 (跟 clusters / 快照一樣)
+FUZZY_SOURCE_SQL = "SELECT id, year, teacher, content FROM questions WHERE q_type='選擇題' ORDER BY id"
+
+# 模糊分組每跑幾題回報一次進度
+PROGRESS_EVERY = 200
+
+# 連線池 (網頁版會用 use_connection_pool 設定；命令列工具維持每次開新連線)
+_connection_pool = None
+
+# 要不要用題庫快照 (snapshot.py) 跑不需要 SQL 的查詢 (網頁版會用 use_snapshots 打開)
+_use_snapshots = False
+
 def get_connection(db_path):
     return sqlite3.connect(db_path)
 
-def search_questions(db_path, year=None, teacher=None, keyword=None):
+def use_connection_pool(pool):
+    """ 設定查詢要用的連線池 (db_pool.ConnectionPool)，傳入 None 就回到每次開新連線 """
+    global _connection_pool
+    _connection_pool = pool
+
+def use_snapshots(enabled):
     """
-    萬用搜尋功能：
-    可以指定年份、老師、或是題目關鍵字。
-    參數如果不填 (None)，就代表該條件不設限。
+    打開之後，沒有關鍵字的搜尋 / 算總數、老師名單、抓重複題、模糊比對都改讀題庫快照
+    (mmap 起來的欄位檔，不用經過 SQLite 跟 pandas)；有關鍵字的搜尋還是走 SQL (FTS 全文檢索)。
     """
+    global _use_snapshots
+    _use_snapshots = enabled
+
+def _snapshot(db_path):
+    """ 有打開快照就回傳 db_path 的快照；快照建不起來 (例如資料夾不能寫) 就回傳 None，退回用 SQL """
+    if not _use_snapshots:
+        return None
+    try:
+        return snapshot.get_snapshot(db_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ 題庫快照無法使用，改用 SQL 查詢: {e}")
+        return None
+
+@contextmanager
+def connection(db_path):
+    """ 取得一條查詢用的連線：有連線池就跟池子借，沒有就開新的、用完關掉 """
+    if _connection_pool is not None:
+        with _connection_pool.connection(db_path) as conn:
+            yield conn
+        return
+
     conn = get_connection(db_path)
-    
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def has_table(conn, name):
+    """ 檢查資料庫有沒有某個表格 (舊的資料庫可能還沒建) """
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cursor.fetchone() is not None
+
+def has_fts_index(conn):
+    """ 檢查資料庫有沒有建立全文檢索索引 (舊的資料庫可能沒有) """
+    return has_table(conn, "questions_fts")
+
+def has_column(conn, column):
+    """ 檢查 questions 表格有沒有某個欄位 (舊的資料庫可能還沒升級) """
+    cursor = conn.execute("PRAGMA table_info(questions)")
+    return column in [row[1] for row in cursor.fetchall()]
+
+SEARCH_COLUMNS = "questions.id, year, teacher, q_type, questions.content, questions.options"
+
+def contains_pattern(text):
+    """
+    「有包含 text 就算」的 LIKE 條件 (要搭配 ESCAPE '\\' 使用)：
+    text 裡的 % 和 _ 當成一般字元，結果才會跟統計表 (facets.py)、快照的比對方式一樣。
+    """
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def _search_filters(conn, year=None, teacher=None, keyword=None):
+    """
+    組出搜尋條件 (FROM ... WHERE ...) 與參數，搜尋、分頁、算總數共用。
+    回傳 (from_where, params, uses_fts)
+    """
     # 這是 SQL 的一個小技巧：WHERE 1=1
     # 這樣我們後面就可以一直用 "AND ..." 接下去，不用擔心語法錯誤
-    query = "SELECT id, year, teacher, q_type, content, options FROM questions WHERE 1=1"
+    query = " FROM questions"
+    where = " WHERE 1=1"
     params = []
+    uses_fts = False
+
+    # 3. 篩選關鍵字 (搜尋題目、選項與完整文字)
+    # trigram 索引至少要 3 個字才查得到，太短的關鍵字還是用 LIKE
+    if keyword and len(keyword) >= 3 and has_fts_index(conn):
+        query += " JOIN questions_fts ON questions_fts.rowid = questions.id"
+        where += " AND questions_fts MATCH ?"
+        # 用雙引號包成片語，避免關鍵字裡的符號被當成 FTS 語法
+        params.append('"' + keyword.replace('"', '""') + '"')
+        uses_fts = True
+    elif keyword:
+        # % 和 _ 要當成一般字元，跟全文檢索的片語比對一樣
+        where += (" AND (questions.content LIKE ? ESCAPE '\\' OR questions.options LIKE ? ESCAPE '\\'"
+                  " OR questions.full_text LIKE ? ESCAPE '\\')")
+        params += [contains_pattern(keyword)] * 3
 
     # 1. 篩選年份
     if year:
-        query += " AND year = ?"
+        where += " AND year = ?"
         params.append(year)
     
     # 2. 篩選老師 (模糊搜尋，只要名字有包含就算)
+    # 先從篩選統計表 (每個老師只有幾列) 挑出符合的名字，再用老師索引撈題目，不用走過整個老師索引；
+    # 還沒有統計表的舊資料庫才從老師索引裡挑
     if teacher:
-        query += " AND teacher LIKE ?"
-        params.append(f"%{teacher}%") # %代表前後可以是任何字
-        
-    # 3. 篩選關鍵字 (搜尋題目內文)
-    if keyword:
-        query += " AND content LIKE ?"
-        params.append(f"%{keyword}%")
+        names = "question_facets" if has_table(conn, "question_facets") else "questions"
+        where += f" AND teacher IN (SELECT DISTINCT teacher FROM {names} WHERE teacher LIKE ? ESCAPE '\\')"
+        params.append(contains_pattern(teacher)) # 前後可以是任何字
+
+    return query + where, params, uses_fts
+
+def build_search_query(conn, year=None, teacher=None, keyword=None):
+    """ 組出 search_questions 用的 SQL 與參數 (另外拉出來，方便用 EXPLAIN QUERY PLAN 檢查) """
+    from_where, params, uses_fts = _search_filters(conn, year, teacher, keyword)
+
+    # 加上排序，讓年份新的在前面 (有關鍵字時最相關的在前面，bm25 越小代表越相關)
+    order_by = " ORDER BY bm25(questions_fts), year DESC" if uses_fts else " ORDER BY year DESC"
+    return "SELECT " + SEARCH_COLUMNS + from_where + order_by, params
 
-    # 加上排序，讓年份新的在前面
-    query += " ORDER BY year DESC"
+def build_search_page_query(conn, year=None, teacher=None, keyword=None, after=None, limit=50, null_years=False):
+    """
+    組出分頁 (keyset pagination) 用的 SQL：固定依 (year DESC, id DESC) 排序，
+    after 是上一頁最後一題的 (year, id)，只撈排在它後面的題目。
+    遞減排序時 NULL 年份排在最後面，所以分成兩段查：
+    - 第一段 (null_years=False)：年份不是 NULL 的題目，用 (year, id) < (after_year, after_id) 比
+    - 第二段 (null_years=True)：NULL 年份的題目，用 id < after_id 比 (after 是 None 就從頭開始)
+    兩段都能直接在年份索引上定位 (SEARCH)，不用 OFFSET，翻到第 100 頁也不用先走過前面 99 頁的資料。
+    """
+    from_where, params, _ = _search_filters(conn, year, teacher, keyword)
+
+    if null_years:
+        from_where += " AND year IS NULL"
+        if after is not None:
+            from_where += " AND questions.id < ?"
+            params.append(after[1])
+    elif after is None:
+        from_where += " AND year IS NOT NULL"
+    else:
+        # row value 比較：NULL 年份比出來是 NULL，自然被排除
+        from_where += " AND (year, questions.id) < (?, ?)"
+        params += list(after)
+
+    query = "SELECT " + SEARCH_COLUMNS + from_where + " ORDER BY year DESC, questions.id DESC LIMIT ?"
+    return query, params + [limit]
+
+@instrument.timed()
+def search_questions(db_path, year=None, teacher=None, keyword=None):
+    """
+    萬用搜尋功能：
+    可以指定年份、老師、或是題目關鍵字。
+    參數如果不填 (None)，就代表該條件不設限。
+    關鍵字會同時搜尋題目、選項與完整文字；有全文檢索索引時依相關度 (bm25) 排序。
+    """
+    with connection(db_path) as conn:
+        query, params = build_search_query(conn, year, teacher, keyword)
 
-    # 使用 Pandas 讀取，因為它印出來比較漂亮，之後要轉 PDF 也方便
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
+        # 使用 Pandas 讀取，因為它印出來比較漂亮，之後要轉 PDF 也方便
+        df = pd.read_sql_query(query, conn, params=params)
+    instrument.note(rows_scanned=len(df))
     
     return df
 
+@instrument.timed()
+def search_questions_page(db_path, year=None, teacher=None, keyword=None, after=None, page_size=50):
+    """
+    分頁搜尋：一次只撈一頁 (page_size 題)，條件跟 search_questions 一樣。
+    after: 上一頁回傳的 next_cursor (第一頁傳 None)
+    回傳 (df, next_cursor)；已經是最後一頁時 next_cursor 是 None。
+    注意：分頁固定依年份、編號排序，不依關鍵字相關度排序。
+    """
+    snap = None if keyword else _snapshot(db_path)
+    if snap is not None:
+        return _snapshot_page(snap, year, teacher, after, page_size)
+
+    with connection(db_path) as conn:
+        # 多撈一題，用來判斷後面還有沒有下一頁
+        frames = []
+        if after is None or after[0] is not None:
+            query, params = build_search_page_query(conn, year, teacher, keyword, after, page_size + 1)
+            frames.append(pd.read_sql_query(query, conn, params=params))
+            # 接下來的 NULL 年份從頭開始走
+            after = None
+        # 有年份的題目走完了還不滿一頁，就接著走 NULL 年份的題目 (有指定年份時不會有 NULL)
+        missing = page_size + 1 - sum(len(df) for df in frames)
+        if missing > 0 and not year:
+            query, params = build_search_page_query(conn, year, teacher, keyword, after, missing,
+                                                    null_years=True)
+            frames.append(pd.read_sql_query(query, conn, params=params))
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    # 從 SQLite 讀了幾列 (包含用來判斷下一頁的那一列)
+    instrument.note(rows_scanned=len(df))
+
+    if len(df) <= page_size:
+        return df, None
+    df = df.iloc[:page_size]
+    last = df.iloc[-1]
+    # pandas 會把 NULL 年份變成 NaN，游標裡要換回 None
+    last_year = None if pd.isna(last["year"]) else last["year"]
+    return df, (last_year, int(last["id"]))
+
+def _snapshot_page(snap, year, teacher, after, page_size):
+    """ search_questions_page 的快照版：沿著快照裡排好的順序 (year DESC, id DESC) 往下找 """
+    # 篩選條件是整欄一起比的，每一題都看過一次
+    instrument.note(rows_scanned=len(snap.ids))
+    rows = snap.order[snap.filter(year=year, teacher=teacher)[snap.order]]
+    if after is not None:
+        after_year, after_id = after
+        codes = snap.year[rows]
+        ids = snap.ids[rows]
+        if after_year is None:
+            rows = rows[(codes == -1) & (ids < after_id)]
+        else:
+            # 字典照字串排序，所以「年份比 after_year 小」= 編碼比它在字典裡的位置小
+            # (after_year 已經不在資料庫裡也照樣比得出來)
+            position = bisect.bisect_left(snap.years, after_year)
+            exact = position < len(snap.years) and snap.years[position] == after_year
+            keep = (codes == -1) | ((codes >= 0) & (codes < position))
+            if exact:
+                keep |= (codes == position) & (ids < after_id)
+            rows = rows[keep]
+
+    df = snap.frame(rows[:page_size])
+    if len(rows) <= page_size:
+        return df, None
+    last = df.iloc[-1]
+    return df, (None if pd.isna(last["year"]) else last["year"], int(last["id"]))
+
+@instrument.timed()
+def count_questions(db_path, year=None, teacher=None, keyword=None):
+    """ 符合搜尋條件的總題數 (只跑 COUNT，不用把題目撈出來) """
+    snap = None if keyword else _snapshot(db_path)
+    if snap is not None:
+        instrument.note(rows_scanned=len(snap.ids))
+        return int(snap.filter(year=year, teacher=teacher).sum())
+
+    with connection(db_path) as conn:
+        from_where, params, _ = _search_filters(conn, year, teacher, keyword)
+        total = conn.execute("SELECT COUNT(*)" + from_where, params).fetchone()[0]
+    # COUNT 至少要走過每一題符合條件的題目
+    instrument.note(rows_scanned=total)
+    return total
+
+def _iter_batches(conn, query, params, batch_size):
+    """ 執行查詢，每次 fetchmany 一批，包成 DataFrame 丟出去 """
+    cursor = conn.execute(query, params)
+    columns = [col[0] for col in cursor.description]
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield pd.DataFrame(rows, columns=columns)
+
+def iter_search_batches(db_path, year=None, teacher=None, keyword=None, batch_size=500):
+    """
+    串流版的 search_questions：結果一批一批 (每批最多 batch_size 題的 DataFrame) 產生，
+    排序跟 search_questions 一樣，但不會一次把全部結果放進記憶體。
+    """
+    with connection(db_path) as conn:
+        query, params = build_search_query(conn, year, teacher, keyword)
+        yield from _iter_batches(conn, query, params, batch_size)
+
 # 新增功能 2-1: 取得所有老師名單 (給下拉選單用)
+@instrument.timed()
 def get_all_teachers(db_path):
-    conn = get_connection(db_path)
-    cursor = conn.cursor()
-    # DISTINCT 確保同一個老師不會重複出現
-    cursor.execute("SELECT DISTINCT teacher FROM questions ORDER BY teacher")
-    teachers = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    snap = _snapshot(db_path)
+    if snap is not None:
+        # 快照的字典本來就是排好序、不重複的老師名單 (SQL 的 ORDER BY 會把 NULL 排最前面)
+        return ([None] if (snap.teacher == -1).any() else []) + list(snap.teachers)
+
+    with connection(db_path) as conn:
+        cursor = conn.cursor()
+        # DISTINCT 確保同一個老師不會重複出現
+        cursor.execute("SELECT DISTINCT teacher FROM questions ORDER BY teacher")
+        teachers = [row[0] for row in cursor.fetchall()]
     return teachers
 
 # 新增功能 3-1: 模糊搜尋重複題目
-def find_fuzzy_duplicates(db_path, threshold=85):
+def prefix_filter_candidates(contents, threshold):
     """
-    使用模糊比對找出相似的題目
-    threshold: 相似度門檻 (0~100)，建議 85 以上
+    前置篩選 (blocking)：用「長度過濾 + 前綴過濾 (prefix filter)」先挑出有機會達到門檻的配對，
+    只有這些配對才需要真的呼叫 fuzz.ratio。
+    回傳一個函數 candidates(i, visited)：列出所有 j > i、還沒被分組、而且「不能被證明低於門檻」的題目索引 (由小到大)。
+
+    原理：fuzz.ratio = 200 * LCS / (len1 + len2)，而 LCS 不會超過兩題「共同字元 (含重複次數)」的數量。
+    把每題拆成 (字, 第幾次出現) 的 token，依全體出現頻率由少到多排序後，
+    兩題若要達到門檻，它們前面一小段 (前綴) 一定至少有一個共同 token。
     """
-    conn = get_connection(db_path)
-    # 撈出所有選擇題
-    df = pd.read_sql_query("SELECT id, year, teacher, content FROM questions WHERE q_type='選擇題'", conn)
-    conn.close()
-    
-    if df.empty:
-        return pd.DataFrame()
+    n = len(contents)
+    t = threshold / 100
+
+    # 門檻 <= 0 時任何配對都成立，沒辦法篩，只好全部比
+    if t <= 0:
+        return lambda i, visited: [j for j in range(i + 1, n) if j not in visited]
+    if t > 1:
+        return lambda i, visited: []
+
+    # 1. 把每一題拆成 token (同一個字第 k 次出現算不同 token，這樣集合交集 = 字元多重集合的交集)
+    token_ids = {}
+    records = []
+    for text in contents:
+        if not text:
+            records.append([])
+            continue
+        seen = {}
+        tokens = []
+        for ch in text:
+            k = seen.get(ch, 0)
+            seen[ch] = k + 1
+            tokens.append(token_ids.setdefault((ch, k), len(token_ids)))
+        records.append(tokens)
+
+    # 2. 依全體出現頻率排序 (稀有的排前面)，前綴就會盡量由罕見字組成
+    freq = [0] * len(token_ids)
+    for tokens in records:
+        for tok in tokens:
+            freq[tok] += 1
+    order_key = lambda tok: (freq[tok], tok)
+
+    lengths = [len(tokens) for tokens in records]
+    index = {}
+    prefixes = []
+    for i, tokens in enumerate(records):
+        length = lengths[i]
+        if length == 0:
+            prefixes.append([])
+            continue
+        tokens.sort(key=order_key)
+        # 至少要有 ceil(t * L / (2 - t)) 個共同 token，所以前綴長度取 L - 需要的數量 + 1
+        # (減掉一點點 epsilon，避免浮點數誤差讓前綴變太短)
+        need = max(1, math.ceil(t * length / (2 - t) - 1e-9))
+        prefix = tokens[:max(1, length - need + 1)]
+        prefixes.append(prefix)
+        for tok in prefix:
+            index.setdefault(tok, []).append(i)
+
+    # 空字串只會跟空字串相似 (fuzz.ratio("", "") == 100)
+    empty = [i for i, text in enumerate(contents) if text == ""]
+
+    def candidates(i, visited):
+        if contents[i] is None:
+            return []
+        if lengths[i] == 0:
+            return [j for j in empty if j > i and j not in visited]
+
+        # 3. 長度過濾：長度差太多的兩題，相似度一定達不到門檻
+        low = t * lengths[i] / (2 - t) - 1e-9
+        high = lengths[i] * (2 - t) / t + 1e-9
+        found = set()
+        for tok in prefixes[i]:
+            found.update(index[tok])
+        found -= visited
+        return sorted(
+            j for j in found
+            if j > i and low <= lengths[j] <= high
+        )
 
-    # 轉成列表比較好處理
-    questions = df.to_dict('records')
+    return candidates
+
+def _cdist_candidates(contents, threshold, chunk_size=256, workers=-1):
+    """
+    批次計算模式：用 rapidfuzz.process.cdist 一次算一整塊相似度矩陣 (多核心平行)，
+    省掉一題一題呼叫 fuzz.ratio 的 Python 額外開銷。
+    回傳一個函數 candidates(i, visited)，內容就是矩陣第 i 列中達到門檻的 j (> i)。
+
+    為了控制記憶體，一次只算 chunk_size 列 (chunk_size x 題數 的 float32)，
+    兩萬題的題庫也不會生出 2 萬 x 2 萬的完整矩陣。
+    已經被分組的題目不會再當組長，所以每一塊只算「還沒被分組的列」對「後面所有題目」。
+    """
+    n = len(contents)
+    # 門檻超過 100 不可能有任何配對達標 (cdist 也不接受這種 score_cutoff)
+    if threshold > 100:
+        return lambda i, visited: []
+    # None 沒辦法丟進 cdist，先換成空字串，再用 mask 把它排除 (原本 fuzz.ratio(None, ...) 一律是 0)；
+    # 門檻 <= 0 時 0 分也算達標，None 跟誰都算相似，跟逐對比的結果一樣就不能排除
+    valid = np.array([text is not None or threshold <= 0 for text in contents], dtype=bool)
+    texts = [text if text is not None else "" for text in contents]
+    rows = {}
+    state = {"next_start": 0}
+
+    def compute_chunk(start, visited):
+        end = min(start + chunk_size, n)
+        query_idx = [i for i in range(start, end) if i not in visited and valid[i]]
+        for i in range(start, end):
+            rows[i] = []
+        if query_idx:
+            # 只需要比對 start 之後的題目 (j > i)，前面的一定已經輪過了
+            scores = process.cdist(
+                [texts[i] for i in query_idx],
+                texts[start:],
+                scorer=fuzz.ratio,
+                score_cutoff=threshold,
+                workers=workers,
+            )
+            # 低於 score_cutoff 的分數會被設成 0；門檻 <= 0 時則每一對都算數
+            hits = scores > 0 if threshold > 0 else np.ones(scores.shape, dtype=bool)
+            hits &= valid[start:]
+            for row, i in enumerate(query_idx):
+                cols = np.flatnonzero(hits[row]) + start
+                rows[i] = cols[cols > i].tolist()
+        state["next_start"] = end
+
+    def candidates(i, visited):
+        # 貪婪分組是由前往後跑的，輪到新的一塊時才計算，並把用完的舊列丟掉
+        while i >= state["next_start"]:
+            rows.clear()
+            compute_chunk(state["next_start"], visited)
+        return [j for j in rows.pop(i, []) if j not in visited]
+
+    return candidates
+
+def _group_fuzzy_duplicates(questions, candidates, threshold, progress=None):
+    """
+    依照原本的貪婪分組規則分組：由前往後，每一題把「後面還沒被分組、相似度達門檻」的題目收進來。
+    candidates(i, visited) 只需要列出可能達標的 j (> i)，其餘配對一定低於門檻，跳過不影響結果。
+    (已經被分組的題目不會再當組長，所以只有真的輪到的題目才會去找候選)
+    progress: 每跑 PROGRESS_EVERY 題呼叫一次 progress(完成比例)，背景工作用來回報進度
+    """
     duplicates_groups = []
     visited_indices = set()
 
-    # 雙重迴圈比對 (這會比較花時間，但在幾千題的規模下還跑得動)
     for i in range(len(questions)):
+        if progress is not None and i % PROGRESS_EVERY == 0:
+            progress(i / len(questions))
         if i in visited_indices:
             continue
-            
+
         current_group = [questions[i]]
-        
-        for j in range(i + 1, len(questions)):
+
+        for j in candidates(i, visited_indices):
             if j in visited_indices:
                 continue
-            
+
             # 計算兩個字串的相似度 (Ratio)
-            similarity = fuzz.ratio(questions[i]['content'], questions[j]['content'])
-            
+            # score_cutoff 讓 rapidfuzz 一發現不可能達標就提早結束
+            similarity = fuzz.ratio(questions[i]['content'], questions[j]['content'], score_cutoff=threshold)
+
             if similarity >= threshold:
                 current_group.append(questions[j])
                 visited_indices.add(j)
-        
+
         # 如果這一組超過 1 題，代表有重複
         if len(current_group) > 1:
             # 整理一下資料格式，方便顯示
@@ -99,22 +464,72 @@ def find_fuzzy_duplicates(db_path, threshold=85):
                 "出現年份": ", ".join([q['year'] for q in current_group]),
                 "相似度": "模糊比對"
             }
+            # 跨資料庫比對時，順便列出出現在哪些資料庫
+            if 'source' in current_group[0]:
+                summary["出現資料庫"] = ", ".join(dict.fromkeys(q['source'] for q in current_group))
             duplicates_groups.append(summary)
 
-    return pd.DataFrame(duplicates_groups)
+    return duplicates_groups
 
-def find_duplicate_questions(db_path, min_count=2):
+@instrument.timed()
+def find_fuzzy_duplicates(db_path, threshold=85, method="prefix", chunk_size=256, progress=None):
     """
-    進階功能：找出重複出現的考古題
-    邏輯：根據「題目內容 (content)」分組，計算出現次數大於 min_count 的題目
+    使用模糊比對找出相似的題目
+    threshold: 相似度門檻 (0~100)，建議 85 以上
+    method: "prefix" = 先用前綴過濾篩候選再逐對精算；"cdist" = 用 rapidfuzz 多核心批次算相似度矩陣
+    chunk_size: cdist 模式一次計算幾列，用來控制記憶體用量
+    progress: 回報進度的函數 (見 _group_fuzzy_duplicates)
     """
-    conn = get_connection(db_path)
-    
+    snap = _snapshot(db_path)
+    if snap is not None:
+        # 快照裡直接挑出選擇題，只解碼分組要用的題目跟年份
+        indices = np.flatnonzero(snap.filter(q_type='選擇題'))
+        questions = [{"content": content, "year": year}
+                     for content, year in zip(snap.contents(indices), snap.decode("year", indices))]
+        if not questions:
+            return pd.DataFrame()
+    else:
+        with connection(db_path) as conn:
+            # 撈出所有選擇題
+            df = pd.read_sql_query(FUZZY_SOURCE_SQL, conn)
+
+        if df.empty:
+            return pd.DataFrame()
+
+        # 轉成列表比較好處理
+        questions = df.to_dict('records')
+    instrument.note(rows_scanned=len(questions))
+    return pd.DataFrame(fuzzy_duplicate_groups(questions, threshold, method, chunk_size, progress))
+
+def fuzzy_duplicate_groups(questions, threshold=85, method="prefix", chunk_size=256, progress=None):
+    """ 對一串題目 (dict，至少要有 content / year) 做模糊分組，回傳每一組的摘要 (list of dict) """
+    contents = [q['content'] for q in questions]
+    if method == "cdist":
+        # 批次模式：分塊算相似度矩陣，直接拿達標的位置來分組
+        candidates = _cdist_candidates(contents, threshold, chunk_size=chunk_size)
+    elif method == "prefix":
+        # 先用前綴過濾篩出候選配對，再逐一精算 (不用再跑完整的雙重迴圈)
+        candidates = prefix_filter_candidates(contents, threshold)
+    else:
+        raise ValueError(f"未知的比對方式: {method}")
+    return _group_fuzzy_duplicates(questions, candidates, threshold, progress)
+
+def build_duplicate_query(conn):
+    """ 組出 find_duplicate_questions 用的 SQL (有正規化欄位就用正規化後的雜湊值分組) """
+    # 升級過的資料庫可以用 (q_type, norm_hash) 索引分組：只差空白、標點、全形半形的題目會算同一題，
+    # 也不用比較一長串題目文字；更舊的資料庫退回用 content_hash 或原始文字
+    if has_column(conn, "norm_hash"):
+        group_key = "norm_hash"
+    elif has_column(conn, "content_hash"):
+        group_key = "content_hash"
+    else:
+        group_key = "content"
+
     # SQL 語法解析：
     # GROUP BY content: 把題目文字一模一樣的歸成同一類
     # HAVING COUNT(*) >= ?: 只留下出現次數大於等於 N 次的
     # GROUP_CONCAT(year): 把出現過的年份串起來 (例如: B10, B12)
-    sql = """
+    return f"""
     SELECT 
         content, 
         COUNT(*) as frequency, 
@@ -122,16 +537,59 @@ def find_duplicate_questions(db_path, min_count=2):
         GROUP_CONCAT(teacher) as teachers
     FROM questions
     WHERE q_type = '選擇題'  -- 我們通常只比較選擇題
-    GROUP BY content
+    GROUP BY {group_key}
     HAVING frequency >= ?
     ORDER BY frequency DESC
     """
-    
-    df = pd.read_sql_query(sql, conn, params=(min_count,))
-    conn.close()
+
+@instrument.timed()
+def find_duplicate_questions(db_path, min_count=2):
+    """
+    進階功能：找出重複出現的考古題
+    邏輯：根據「正規化後的題目內容」分組，計算出現次數大於 min_count 的題目
+    """
+    snap = _snapshot(db_path)
+    if snap is not None:
+        return _snapshot_duplicates(snap, min_count)
+
+    with connection(db_path) as conn:
+        sql = build_duplicate_query(conn)
+        df = pd.read_sql_query(sql, conn, params=(min_count,))
     
     return df
 
+def _snapshot_duplicates(snap, min_count):
+    """ find_duplicate_questions 的快照版：用分組編碼 (dup_key) 分組，欄位跟 SQL 版一樣 """
+    indices = np.flatnonzero(snap.filter(q_type='選擇題'))
+    keys = snap.dup_key[indices]
+    # 同一組的題目排在一起 (stable 排序，組內維持 id 順序)
+    order = np.argsort(keys, kind="stable")
+    by_key = indices[order]
+    _, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+    # 次數多的在前面，一樣多就照分組編碼
+    chosen = np.flatnonzero(counts >= min_count)
+    chosen = chosen[np.argsort(-counts[chosen], kind="stable")]
+
+    years = snap.decode("year", by_key)
+    teachers = snap.decode("teacher", by_key)
+    rows = []
+    for g in chosen:
+        start, end = starts[g], starts[g] + counts[g]
+        # GROUP_CONCAT 會跳過 NULL，整組都是 NULL 時是 NULL
+        rows.append({
+            "content": snap.content(by_key[start]),
+            "frequency": int(counts[g]),
+            "years": ",".join(y for y in years[start:end] if y is not None) or None,
+            "teachers": ",".join(t for t in teachers[start:end] if t is not None) or None,
+        })
+    return pd.DataFrame(rows, columns=["content", "frequency", "years", "teachers"])
+
+def iter_duplicate_batches(db_path, min_count=2, batch_size=500):
+    """ 串流版的 find_duplicate_questions：重複題一批一批產生 (每批是一個 DataFrame) """
+    with connection(db_path) as conn:
+        sql = build_duplicate_query(conn)
+        yield from _iter_batches(conn, sql, (min_count,), batch_size)
+
 # --- 測試區 (讓你在終端機可以直接玩玩看) ---
 '''
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+#語意相似題：把每題轉成向量 (字元 n-gram TF-IDF + SVD 降維)，找「換句話說」的相似題
+import os
+import sqlite3
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import instrument
+import search_engine
+import text_norm
+
+# 全部只用 numpy，在 CPU 上跑，不用下載任何模型：
+# 1. 每題正規化後切成 2~3 字的片段 (n-gram)，用 crc32 雜湊到固定數量的欄位 (不用存字典)
+# 2. TF-IDF 加權 (罕見的片段比較重要)
+# 3. 用隨機化 SVD 降到 DIMS 維：意思相近但用字不完全一樣的題目，向量也會靠在一起
+# 向量存成 float32 的 .npy 檔 (跟資料庫放在一起)，查詢時用 mmap 讀，不用整個載入記憶體
+
+NGRAM_SIZES = (2, 3)
+HASH_BUCKETS = 2 ** 16
+DIMS = 128
+CHUNK_ROWS = 2000   # 矩陣運算一次處理幾題 (控制記憶體用量)
+SCORE_BLOCK_BYTES = 64 * 1024 * 1024   # 語意分群時一塊相似度矩陣 (幾題 x 全部題數 的 float32) 最多多大
+
+SOURCE_SQL = "SELECT id, content FROM questions ORDER BY id"
+
+def vectors_path(db_path):
+    return db_path + ".vectors.npy"
+
+def model_path(db_path):
+    return db_path + ".vectors-model.npz"
+
+def _ngram_counts(text):
+    """ 一題的 n-gram 雜湊值與出現次數 """
+    norm = text_norm.normalize(text) or ""
+    grams = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(norm) - n + 1):
+            bucket = zlib.crc32(norm[i:i + n].encode("utf-8")) % HASH_BUCKETS
+            grams[bucket] = grams.get(bucket, 0) + 1
+    return grams
+
+def _to_csr(texts):
+    """ 把多題文字轉成稀疏矩陣 (CSR 格式的三個陣列：indptr, cols, counts) """
+    indptr = [0]
+    cols = []
+    counts = []
+    for text in texts:
+        grams = _ngram_counts(text)
+        cols.extend(grams.keys())
+        counts.extend(grams.values())
+        indptr.append(len(cols))
+    return (np.array(indptr, dtype=np.int64), np.array(cols, dtype=np.int64),
+            np.array(counts, dtype=np.float32))
+
+def _tfidf(indptr, cols, counts, idf):
+    """ 次線性 TF (1 + log) 乘上 IDF，每一列再做 L2 正規化 """
+    vals = (1 + np.log(counts)) * idf[cols]
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights=vals * vals, minlength=len(indptr) - 1))
+    norms[norms == 0] = 1
+    return (vals / norms[rows]).astype(np.float32)
+
+def _csr_dot(indptr, cols, vals, dense):
+    """ 稀疏矩陣 (CSR) 乘上 dense 矩陣，分塊算避免一次佔太多記憶體 """
+    n = len(indptr) - 1
+    out = np.zeros((n, dense.shape[1]), dtype=np.float32)
+    for start in range(0, n, CHUNK_ROWS):
+        end = min(start + CHUNK_ROWS, n)
+        lo, hi = indptr[start], indptr[end]
+        if lo == hi:
+            continue
+        products = vals[lo:hi, None] * dense[cols[lo:hi]]
+        # 每一列的非零元素是連在一起的，用 reduceat 一次加總 (空的列跳過)
+        starts = indptr[start:end] - lo
+        nonempty = np.diff(indptr[start:end + 1]) > 0
+        out[start:end][nonempty] = np.add.reduceat(products, starts[nonempty])
+    return out
+
+def _transpose(indptr, cols, vals, width):
+    """ CSR 轉置 (變成以欄為單位的 CSR)，讓 X^T 乘法也能用 _csr_dot """
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.argsort(cols, kind="stable")
+    t_indptr = np.concatenate([[0], np.cumsum(np.bincount(cols, minlength=width))])
+    return t_indptr, rows[order], vals[order]
+
+def _randomized_svd(indptr, cols, vals, dims, seed=0, oversample=10, power_iters=2):
+    """
+    隨機化 SVD (Halko et al.)：不用算完整的 SVD，只求前 dims 個主成分。
+    回傳 (每題的向量 n x dims, 投影矩陣 buckets x dims)
+    """
+    # 只保留真的有用到的雜湊欄位，矩陣小很多 (題目少的時候差很多)
+    used, local_cols = np.unique(cols, return_inverse=True)
+    width = len(used)
+    x = (indptr, local_cols, vals)
+    x_t = _transpose(indptr, local_cols, vals, width)
+
+    rng = np.random.default_rng(seed)
+    sketch = dims + oversample
+    omega = rng.standard_normal((width, sketch)).astype(np.float32)
+    q, _ = np.linalg.qr(_csr_dot(*x, omega))
+    for _ in range(power_iters):
+        z, _ = np.linalg.qr(_csr_dot(*x_t, q))
+        q, _ = np.linalg.qr(_csr_dot(*x, z))
+    b_t = _csr_dot(*x_t, q)                            # (Q^T X)^T，width x sketch
+    v, s, _ = np.linalg.svd(b_t, full_matrices=False)  # b_t = V S U_b^T
+    dims = min(dims, len(s))
+    projection = np.zeros((HASH_BUCKETS, dims), dtype=np.float32)
+    projection[used] = v[:, :dims]
+    return _csr_dot(*x, projection[used]), projection
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+@instrument.timed()
+def build_index(db_path, dims=DIMS, seed=0, progress=None):
+    """
+    替整個資料庫建立語意向量 (題目有變動時重跑一次)，回傳建立了幾題。
+    大題庫要跑好幾分鐘，網頁上是丟到背景工作跑 (jobs.py)。
+    progress: 每做完一個步驟呼叫一次 progress(完成比例)
+    """
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(SOURCE_SQL).fetchall()
+    conn.close()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+
+    indptr, cols, counts = _to_csr(row[1] for row in rows)
+    if progress is not None:
+        progress(0.3)
+    n = len(ids)
+    df = np.bincount(cols, minlength=HASH_BUCKETS)
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+    vals = _tfidf(indptr, cols, counts, idf)
+
+    if n:
+        vectors, projection = _randomized_svd(indptr, cols, vals, dims, seed)
+    else:
+        vectors = np.zeros((0, dims), dtype=np.float32)
+        projection = np.zeros((HASH_BUCKETS, dims), dtype=np.float32)
+    vectors = _normalize_rows(vectors)
+    if progress is not None:
+        progress(0.9)
+
+    # 先寫暫存檔再改名，正在查詢的人不會讀到寫一半的檔案
+    tmp_vectors = vectors_path(db_path) + ".tmp.npy"
+    tmp_model = model_path(db_path) + ".tmp.npz"
+    np.save(tmp_vectors, vectors)
+    np.savez(tmp_model, ids=ids, idf=idf, projection=projection)
+    os.replace(tmp_vectors, vectors_path(db_path))
+    os.replace(tmp_model, model_path(db_path))
+    print(f"語意索引建立完成：{n} 題，{vectors.shape[1]} 維。")
+    return n
+
+class SemanticIndex:
+    """ 載入好的語意索引 (向量用 mmap 讀取) """
+
+    def __init__(self, db_path):
+        model = np.load(model_path(db_path))
+        self.ids = model["ids"]
+        self.idf = model["idf"]
+        self.projection = model["projection"]
+        self.vectors = np.load(vectors_path(db_path), mmap_mode="r")
+        self._positions = {int(qid): i for i, qid in enumerate(self.ids)}
+
+    def embed(self, text):
+        """ 把一段文字轉成跟題庫同一個空間的向量 """
+        indptr, cols, counts = _to_csr([text])
+        vals = _tfidf(indptr, cols, counts, self.idf)
+        return _normalize_rows(_csr_dot(indptr, cols, vals, self.projection))[0]
+
+    def search(self, vector, top_k=10, exclude=None):
+        """ 找跟 vector 最像的 top_k 題，回傳 [(question_id, 相似度), ...] (相似度 = cosine，-1 ~ 1) """
+        if len(self.ids) == 0:
+            return []
+        scores = self.vectors @ vector
+        if exclude is not None and exclude in self._positions:
+            scores[self._positions[exclude]] = -np.inf
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def vector_of(self, question_id):
+        pos = self._positions.get(int(question_id))
+        return None if pos is None else np.asarray(self.vectors[pos])
+
+def has_index(db_path):
+    return os.path.exists(vectors_path(db_path)) and os.path.exists(model_path(db_path))
+
+def is_stale(db_path, index):
+    """ 資料庫裡的題目跟建索引時不一樣 (有新增或刪除) 就需要重建 """
+    with search_engine.connection(db_path) as conn:
+        current = np.array([row[0] for row in conn.execute("SELECT id FROM questions ORDER BY id")],
+                           dtype=np.int64)
+    return not np.array_equal(current, index.ids)
+
+def _attach_questions(db_path, hits):
+    """ 把 [(question_id, 相似度)] 補上題目內容，變成 DataFrame """
+    if not hits:
+        return pd.DataFrame()
+    placeholders = ",".join("?" * len(hits))
+    with search_engine.connection(db_path) as conn:
+        df = pd.read_sql_query(
+            f"SELECT id, year, teacher, q_type, content, options FROM questions WHERE id IN ({placeholders})",
+            conn, params=[qid for qid, _ in hits])
+    scores = dict(hits)
+    df["相似度"] = df["id"].map(scores).round(3)
+    return df.sort_values("相似度", ascending=False).reset_index(drop=True)
+
+@instrument.timed()
+def find_similar(db_path, question_id=None, text=None, top_k=10, index=None):
+    """
+    找語意上相似的題目：給 question_id (題庫裡的某一題) 或 text (任意一段文字)。
+    回傳 DataFrame (跟搜尋結果一樣的欄位，多一欄「相似度」)；還沒建索引就回傳 None。
+    """
+    if index is None:
+        if not has_index(db_path):
+            return None
+        index = SemanticIndex(db_path)
+
+    if question_id is not None:
+        vector = index.vector_of(question_id)
+        if vector is None:
+            return pd.DataFrame()
+        hits = index.search(vector, top_k, exclude=int(question_id))
+    else:
+        hits = index.search(index.embed(text or ""), top_k)
+    return _attach_questions(db_path, hits)
+
+@instrument.timed()
+def semantic_clusters(db_path, threshold=0.8, index=None, progress=None):
+    """
+    語意分群 (格式跟 find_fuzzy_duplicates 一樣)：由前往後，每一題把後面還沒分組、
+    cosine 相似度 >= threshold 的題目收進來。分塊做矩陣乘法，不會生出完整的 n x n 矩陣。
+    索引建好之後才刪掉的題目 (索引過期) 會被略過。
+    計算量是題數的平方 (記憶體是固定的)，大題庫要跑很久，網頁上是丟到背景工作跑。
+    progress: 每算完一塊呼叫一次 progress(完成比例)
+    """
+    if index is None:
+        if not has_index(db_path):
+            return None
+        index = SemanticIndex(db_path)
+
+    n = len(index.ids)
+    # 每一塊是 chunk x n 的分數矩陣，題目越多一次算的列數就越少，記憶體用量固定
+    chunk = max(1, min(CHUNK_ROWS, SCORE_BLOCK_BYTES // (4 * max(n, 1))))
+    visited = np.zeros(n, dtype=bool)
+    groups = []
+    for start in range(0, n, chunk):
+        if progress is not None:
+            progress(start / n)
+        end = min(start + chunk, n)
+        scores = np.asarray(index.vectors[start:end]) @ np.asarray(index.vectors[start:]).T
+        for i in range(start, end):
+            if visited[i]:
+                continue
+            row = scores[i - start]
+            members = np.flatnonzero(row >= threshold) + start
+            members = members[(members > i) & ~visited[members]]
+            if len(members):
+                visited[members] = True
+                groups.append([i] + members.tolist())
+
+    if not groups:
+        return pd.DataFrame()
+    with search_engine.connection(db_path) as conn:
+        info = pd.read_sql_query("SELECT id, year, content FROM questions", conn).set_index("id")
+    live = info.index
+    summaries = []
+    for group in groups:
+        ids = index.ids[group]
+        rows = info.loc[ids[np.isin(ids, live)]]
+        if len(rows) < 2:
+            continue
+        summaries.append({
+            "主要題目": rows["content"].iloc[0],
+            "重複次數": len(rows),
+            "出現年份": ", ".join(rows["year"].astype(str)),
+            "相似度": "語意相似",
+        })
+    return pd.DataFrame(summaries)
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else "med_exams.db"
+    build_index(path)
+    print(find_similar(path, text=sys.argv[2] if len(sys.argv) > 2 else "糖解作用的調控酵素").head())
@@ -0,0 +1,243 @@
+#題庫快照：把整個資料庫轉成一個欄位式 (columnar) 的檔案，用 mmap 讀，分析時不用再透過 SQLite + pandas
+import bisect
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import db_pool
+
+# 檔案格式 (全部放在同一個檔案，重建時寫暫存檔再改名，換檔是原子的)：
+#   MAGIC (8 bytes) + header 長度 (8 bytes) + header (JSON) + 各欄位的陣列 (每個都對齊到 64 bytes)
+# 欄位：
+#   ids                            題目 id (由小到大)
+#   year / teacher / q_type        字典編碼：存小整數，對照表在 header 裡 (-1 = NULL)
+#   content / options              所有題目的文字接成一整塊 UTF-8 (*_text)，加上每題的起點 (*_offsets)，
+#                                  跟哪幾題是 NULL (*_null)
+#   dup_key                        抓重複題分組用的編碼 (norm_hash 相同 = 同一個編碼)
+#   order                          依 (年份新到舊, id 大到小) 排好的順序，分頁直接沿著它走
+MAGIC = b"MEDSNAP1"
+ALIGN = 64
+
+def snapshot_path(db_path):
+    return db_path + ".snapshot"
+
+def _encode(values):
+    """ 字典編碼：回傳 (編碼陣列, 對照表)；對照表照字串排序，所以編碼大小 = 字串大小 (NULL 是 -1) """
+    table = sorted({v for v in values if v is not None})
+    lookup = {v: i for i, v in enumerate(table)}
+    return np.array([lookup[v] if v is not None else -1 for v in values], dtype=np.int32), table
+
+def _text_column(values):
+    """ 文字欄位：接成一整塊 UTF-8，回傳 (bytes, 起點陣列 n+1 個, 是否 NULL) """
+    encoded = [(v or "").encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return b"".join(encoded), offsets, np.array([v is None for v in values], dtype=bool)
+
+def build(db_path):
+    """ 從資料庫建立快照檔 (題目有變動時會自動呼叫)，回傳題數 """
+    version = _version_of(db_path)
+    conn = db_pool.open_readonly_connection(db_path)
+    try:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(questions)")]
+        # 跟 search_engine.build_duplicate_query 一樣：有正規化的雜湊值就用它分組
+        key = next(c for c in ("norm_hash", "content_hash", "content") if c in columns)
+        rows = conn.execute(
+            f"SELECT id, year, teacher, q_type, content, options, {key} FROM questions ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    year, years = _encode([r[1] for r in rows])
+    teacher, teachers = _encode([r[2] for r in rows])
+    q_type, q_types = _encode([r[3] for r in rows])
+    content_text, content_offsets, content_null = _text_column([r[4] for r in rows])
+    options_text, options_offsets, options_null = _text_column([r[5] for r in rows])
+    # 分組編碼只需要「相不相同」；NULL 在 SQL 的 GROUP BY 裡也是自成一組，這裡用 -1
+    dup_key, _ = _encode([r[6] for r in rows])
+    # 年份新的在前 (NULL 在最後)，同一年 id 大的在前，跟 build_search_page_query 的排序一樣
+    order = np.lexsort((-ids, -year.astype(np.int64))).astype(np.int64)
+    del rows
+
+    arrays = {
+        "ids": ids, "year": year, "teacher": teacher, "q_type": q_type,
+        "content_offsets": content_offsets, "options_offsets": options_offsets,
+        "content_null": content_null, "options_null": options_null,
+        "dup_key": dup_key, "order": order,
+        "content_text": np.frombuffer(content_text, dtype=np.uint8),
+        "options_text": np.frombuffer(options_text, dtype=np.uint8),
+    }
+    _write(snapshot_path(db_path), {
+        "db_version": version,
+        "rows": len(ids),
+        "dictionaries": {"year": years, "teacher": teachers, "q_type": q_types},
+    }, arrays)
+    return len(ids)
+
+def _write(path, header, arrays):
+    # header 裡記每個陣列的 (dtype, 長度, 位置)；位置從 header 後面的資料區開頭算起
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, len(array), offset]
+        offset = _align(offset + array.nbytes)
+    header["arrays"] = layout
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _align(16 + len(header_bytes))
+
+    # 暫存檔用不會重複的檔名 (放在同一個資料夾，os.replace 才是原子操作)：
+    # 好幾個行程 (網頁、背景工作) 同時建同一份快照時，才不會寫到同一個暫存檔
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                               dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name][2])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        # 先寫暫存檔再改名，正在讀舊快照的人不受影響 (舊的 mmap 會繼續指向舊檔案)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def _version_of(db_path):
+    """ 資料庫目前的版本 (轉成 JSON 存得下、讀回來可以直接比較的格式) """
+    return [list(v) if v else None for v in db_pool.db_version(db_path)]
+
+class Snapshot:
+    """ 載入好的快照 (整個檔案 mmap 起來，陣列直接指向檔案內容，不會複製一份) """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:8] != MAGIC:
+            raise ValueError(f"{path} 不是題庫快照檔")
+        length = int.from_bytes(self._mmap[8:16], "little")
+        header = json.loads(self._mmap[16:16 + length].decode("utf-8"))
+        data_start = _align(16 + length)
+        self.db_version = header["db_version"]
+        self.rows = header["rows"]
+        self.years = header["dictionaries"]["year"]
+        self.teachers = header["dictionaries"]["teacher"]
+        self.q_types = header["dictionaries"]["q_type"]
+        for name, (dtype, count, offset) in header["arrays"].items():
+            setattr(self, name, np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=count,
+                                              offset=data_start + offset))
+
+    def __len__(self):
+        return self.rows
+
+    def _text(self, name, i):
+        if getattr(self, name + "_null")[i]:
+            return None
+        offsets = getattr(self, name + "_offsets")
+        start, end = offsets[i], offsets[i + 1]
+        return getattr(self, name + "_text")[start:end].tobytes().decode("utf-8")
+
+    def content(self, i):
+        return self._text("content", i)
+
+    def contents(self, indices):
+        return [self._text("content", i) for i in indices]
+
+    def _table(self, column):
+        return {"year": self.years, "teacher": self.teachers, "q_type": self.q_types}[column]
+
+    def decode(self, column, indices):
+        """ 把某些題目的 year / teacher / q_type 編碼轉回字串 (NULL 是 None) """
+        table = self._table(column)
+        return [table[c] if c >= 0 else None for c in getattr(self, column)[indices].tolist()]
+
+    def code_of(self, column, value):
+        """ 某個值在字典裡的編碼 (找不到回傳 None) """
+        table = self._table(column)
+        i = bisect.bisect_left(table, value)
+        return i if i < len(table) and table[i] == value else None
+
+    def filter(self, year=None, teacher=None, q_type=None):
+        """
+        篩選 (條件跟 search_engine 一樣)：年份、題型要完全相同；老師名字有包含就算 (英文不分大小寫，同 LIKE)。
+        只比對字典 (幾十個老師)，再用編碼一次篩完所有題目，回傳布林陣列。
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        for column, value in (("year", year), ("q_type", q_type)):
+            if value:
+                code = self.code_of(column, value)
+                if code is None:
+                    return np.zeros(self.rows, dtype=bool)
+                mask &= getattr(self, column) == code
+        if teacher:
+            needle = teacher.lower()
+            codes = [i for i, name in enumerate(self.teachers) if needle in name.lower()]
+            mask &= np.isin(self.teacher, codes)
+        return mask
+
+    def frame(self, indices):
+        """ 把某些題目 (位置) 轉成跟搜尋結果一樣欄位的 DataFrame """
+        indices = np.asarray(indices, dtype=np.int64)
+        return pd.DataFrame({
+            "id": self.ids[indices],
+            "year": self.decode("year", indices),
+            "teacher": self.decode("teacher", indices),
+            "q_type": self.decode("q_type", indices),
+            "content": [self._text("content", i) for i in indices],
+            "options": [self._text("options", i) for i in indices],
+        })
+
+    def close(self):
+        self._mmap.close()
+
+# 每個行程只載入一次 (db_path -> Snapshot)
+_loaded = {}
+_lock = threading.Lock()
+
+def _is_current(snap, db_path):
+    return snap.db_version == _version_of(db_path)
+
+def get_snapshot(db_path):
+    """
+    取得資料庫的快照：已經載入而且資料庫沒變就直接用；
+    資料庫有變動 (匯入新題目) 就自動重建。
+    """
+    with _lock:
+        snap = _loaded.get(db_path)
+        if snap is not None and _is_current(snap, db_path):
+            return snap
+
+        path = snapshot_path(db_path)
+        if os.path.exists(path):
+            snap = Snapshot(path)
+            if not _is_current(snap, db_path):
+                snap = None
+        else:
+            snap = None
+        if snap is None:
+            build(db_path)
+            snap = Snapshot(path)
+        # 舊的快照不主動 close：可能還有別的執行緒正在用它的陣列，等沒人引用時自動釋放
+        _loaded[db_path] = snap
+        return snap
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    import sys
+    import time
+    path = sys.argv[1] if len(sys.argv) > 1 else "med_exams.db"
+    start = time.perf_counter()
+    print(f"快照建立完成：{build(path)} 題，{time.perf_counter() - start:.2f} 秒")
+    snap = get_snapshot(path)
+    print(f"老師: {snap.teachers}")
+    print(snap.frame(snap.order[:5]))
@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+
+import pytest
+from fpdf import FPDF
+
+import batch_import
+import db_utils
+import exam_parser
+import text_norm
+
+# 測試用的 PDF 只能用內建的英文字型，所以年份、老師那一行換成英文的寫法
+COURSE = {
+    "year": r"Year (?P<year>B\d+)",
+    "year_hint": r"B\d",
+    "teacher": r"Teacher (?P<teacher_name>.*)",
+    "question": r"(?P<qid>\d+)\.\s+(?P<qtext>.*)",
+    "option": r"\([A-E]\)",
+}
+
+def make_pdf(path, pages):
+    """ pages: 每一頁的文字 (一行一個字串) """
+    pdf = FPDF()
+    pdf.set_font("Helvetica", size=11)
+    for lines in pages:
+        pdf.add_page()
+        for line in lines:
+            pdf.cell(0, 8, line, new_x="LMARGIN", new_y="NEXT")
+    pdf.output(str(path))
+
+def exam_pages(changed_page=None, extra_pages=0):
+    """ 一份 4 頁的考卷 (第 2 題跨頁)；changed_page 那一頁的題目後面加幾個字，extra_pages 是後面多加的頁數 """
+    pages = [
+        ["Year B12", "Teacher Wang", "1. Which enzyme is rate limiting in glycolysis?",
+         "(A) hexokinase (B) PFK-1", "2. Which vitamin is needed by pyruvate"],
+        ["dehydrogenase?", "(A) B1 (B) B12", "Teacher Lee", "3. Where does the TCA cycle happen?",
+         "(A) cytosol (B) mitochondria"],
+        ["Year B13", "Teacher Wang", "1. Which enzyme is rate limiting in glycolysis?",
+         "(A) hexokinase (B) PFK-1", "2. Explain the Cori cycle."],
+        ["Teacher Lee", "3. What is the product of beta oxidation?", "(A) acetyl-CoA (B) glucose"],
+    ]
+    for i in range(extra_pages):
+        pages.append(["Year B14", "Teacher Chen", f"{i + 1}. Which organ makes urea number {i}?",
+                      "(A) liver (B) kidney"])
+    if changed_page is not None:
+        pages[changed_page] = [line + " (revised)" if line[0].isdigit() else line for line in pages[changed_page]]
+    return pages
+
+def import_exam(pdf_path, db_path, incremental):
+    return exam_parser.parse_and_save_exam(str(pdf_path), str(db_path), incremental=incremental,
+                                           course=COURSE)
+
+def snapshot_db(db_path):
+    """ 題目、全文檢索、篩選統計的內容 (不含自動編號，方便跟重新匯入的資料庫比) """
+    conn = sqlite3.connect(db_path)
+    questions = conn.execute("""
+        SELECT year, teacher, q_type, question_id, content, options, full_text, content_hash,
+               source_pdf, source_page, source_seq, content_norm, norm_hash
+        FROM questions ORDER BY source_pdf, source_seq
+    """).fetchall()
+    # FTS 索引跟題目表格對不起來的話，integrity-check 會丟出錯誤
+    conn.execute("INSERT INTO questions_fts(questions_fts) VALUES ('integrity-check')")
+    fts = {
+        word: conn.execute("SELECT COUNT(*) FROM questions_fts WHERE questions_fts MATCH ?",
+                           (f'"{word}"',)).fetchone()[0]
+        for word in ("Which", "revised", "enzyme", "liver", "mitochondria", "glucose")
+    }
+    facets = sorted(conn.execute("SELECT year, teacher, q_type, questions FROM question_facets").fetchall(),
+                    key=repr)
+    conn.close()
+    return questions, fts, facets
+
+@pytest.mark.parametrize("changed_page, extra_pages", [(1, 0), (3, 0), (None, 2), (2, 1)])
+def test_incremental_import_matches_fresh_import(tmp_path, changed_page, extra_pages):
+    pdf_path = tmp_path / "exam.pdf"
+    make_pdf(pdf_path, exam_pages())
+    incremental_db = tmp_path / "incremental.db"
+    import_exam(pdf_path, incremental_db, incremental=True)
+
+    make_pdf(pdf_path, exam_pages(changed_page, extra_pages))
+    import_exam(pdf_path, incremental_db, incremental=True)
+    fresh_db = tmp_path / "fresh.db"
+    import_exam(pdf_path, fresh_db, incremental=False)
+
+    assert snapshot_db(incremental_db) == snapshot_db(fresh_db)
+
+def test_incremental_import_only_reparses_changed_pages(tmp_path):
+    pdf_path = tmp_path / "exam.pdf"
+    db_path = str(tmp_path / "exam.db")
+    make_pdf(pdf_path, exam_pages())
+    import_exam(pdf_path, db_path, incremental=True)
+
+    # 只重新解析最後一頁：第 3 頁最後那題還沒結束 (可能接到下一頁)，所以它也會重寫，共 2 題
+    make_pdf(pdf_path, exam_pages(changed_page=3))
+    assert exam_parser.import_pdf(str(pdf_path), db_path, incremental=True, course=COURSE) == (2, 1)
+    # 整份檔案沒變就直接跳過
+    assert exam_parser.import_pdf(str(pdf_path), db_path, incremental=True, course=COURSE) is None
+
+    # 第 2 題跨頁：第 2 頁開頭記下的狀態裡要有這題還沒讀完的部分
+    state = json.loads(db_utils.get_pdf_pages(db_path, "exam.pdf")[1][1])
+    assert state["question"]["question_id"] == "2"
+
+def sample_questions(count, fail_at=None):
+    """ 產生 count 題 (generator)；第 fail_at 題時丟出錯誤，模擬匯入到一半出問題 """
+    for i in range(count):
+        if i == fail_at:
+            raise RuntimeError("解析失敗")
+        yield {
+            "year": "B12", "teacher": "Wang", "q_type": "選擇題", "question_id": str(i + 1),
+            "question_text": f"Which enzyme number {i}?", "options_text": "(A) yes (B) no\n",
+            "full_text": f"Which enzyme number {i}?\n(A) yes (B) no",
+            "source_pdf": "exam.pdf", "source_page": 0, "source_seq": i,
+        }
+
+def test_insert_questions_rolls_back_on_error(tmp_path):
+    db_path = str(tmp_path / "exam.db")
+    db_utils.init_db(db_path)
+    db_utils.insert_questions(sample_questions(3), db_path)
+    before = snapshot_db(db_path)
+
+    # 錯誤發生在第二批 (前一批已經 executemany 過了)，整批都不能留下來
+    with pytest.raises(RuntimeError):
+        db_utils.insert_questions(sample_questions(10, fail_at=7), db_path, batch_size=4)
+    assert snapshot_db(db_path) == before
+
+def test_replace_pdf_questions_rolls_back_on_error(tmp_path):
+    db_path = str(tmp_path / "exam.db")
+    db_utils.init_db(db_path)
+    db_utils.replace_pdf_questions(db_path, "exam.pdf", 0, 0, sample_questions(5), [(0, "old", "{}")],
+                                   "old-hash", 1)
+    before = snapshot_db(db_path)
+
+    # 舊題目已經刪掉、新題目寫到一半才出錯：舊題目、頁面紀錄、匯入紀錄都要還在
+    with pytest.raises(RuntimeError):
+        db_utils.replace_pdf_questions(db_path, "exam.pdf", 2, 0, sample_questions(10, fail_at=6),
+                                       [(0, "new", "{}")], "new-hash", 1, batch_size=4)
+    assert snapshot_db(db_path) == before
+    assert db_utils.get_pdf_import(db_path, "exam.pdf") == ("old-hash", 1)
+    assert db_utils.get_pdf_pages(db_path, "exam.pdf") == {0: ("old", "{}")}
+
+@pytest.mark.parametrize("start", [0, 3])
+def test_parallel_page_extraction_matches_single_process(tmp_path, start):
+    pdf_path = str(tmp_path / "exam.pdf")
+    make_pdf(pdf_path, exam_pages(extra_pages=6))
+    expected = list(exam_parser.iter_page_texts(pdf_path, workers=1, start=start))
+    # 每段 3 頁、2 個行程：頁碼範圍不整除，回傳的順序還是要跟單行程一樣
+    assert list(exam_parser.iter_page_texts(pdf_path, workers=2, pages_per_task=3, start=start)) == expected
+    assert len(expected) == 10 - start
+
+def test_parallel_import_matches_single_process(tmp_path):
+    pdf_path = str(tmp_path / "exam.pdf")
+    make_pdf(pdf_path, exam_pages(extra_pages=6))
+    for workers in (1, 2):
+        exam_parser.parse_and_save_exam(pdf_path, str(tmp_path / f"workers{workers}.db"), workers=workers,
+                                        course=COURSE)
+    assert snapshot_db(str(tmp_path / "workers1.db")) == snapshot_db(str(tmp_path / "workers2.db"))
+
+@pytest.mark.parametrize("line, teacher", [
+    ("➢ 顏伯勳老師", "顏伯勳"),
+    ("➢顏伯勳 老師", "顏伯勳"),
+    ("➢ 王志明", "王志明"),
+    ("➢ 老師", ""),
+])
+def test_teacher_name_comes_from_the_course_pattern(line, teacher):
+    questions = list(exam_parser.parse_lines([line, "1. 下列何者正確？", "(A) 甲 (B) 乙"]))
+    assert questions[0]["teacher"] == teacher
+
+def test_teacher_pattern_without_name_group_keeps_the_rest_of_the_line():
+    course = dict(COURSE, teacher=r"Teacher:")
+    questions = list(exam_parser.parse_lines(["Teacher: Wang", "1. Which one?"], course=course))
+    assert questions[0]["teacher"] == "Wang"
+
+@pytest.mark.parametrize("a, b", [
+    ("下列關於 DNA 的敘述，何者正確？", "下列關於ＤＮＡ的敘述,何者正確?\n"),
+    ("Where is the TCA  cycle ?", "where is the TCA\ncycle?"),
+    ("(A) ATP, ADP", "（Ａ）ATP ADP"),
+    ("維生素 B12 缺乏", "維生素B12缺乏"),
+])
+def test_normalize_merges_formatting_differences(a, b):
+    assert text_norm.normalize(a) == text_norm.normalize(b)
+
+@pytest.mark.parametrize("a, b", [
+    ("not a substrate", "nota substrate"),
+    ("B 12", "B12"),
+    ("PFK 1", "PFK1"),
+])
+def test_normalize_keeps_word_boundaries(a, b):
+    # 英文單字、數字之間的空白要留著，不然不同的字會被併成同一題
+    assert text_norm.normalize(a) != text_norm.normalize(b)
+
+def test_norm_version_change_recomputes_stored_norms(tmp_path):
+    db_path = str(tmp_path / "exam.db")
+    db_utils.init_db(db_path)
+    db_utils.insert_questions(sample_questions(1), db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE questions SET content_norm = 'stale', norm_hash = 'stale'")
+    conn.execute("UPDATE db_meta SET value = '0' WHERE key = 'norm_version'")
+    conn.commit()
+    conn.close()
+
+    db_utils.init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    norm, norm_hash = conn.execute("SELECT content_norm, norm_hash FROM questions").fetchone()
+    conn.close()
+    assert norm == text_norm.normalize("Which enzyme number 0?")
+    assert norm_hash == text_norm.norm_hash("Which enzyme number 0?")
+
+def test_batch_import_resumes_where_it_stopped(tmp_path):
+    biochem = tmp_path / "pdfs" / "biochem-B12.pdf"
+    physio = tmp_path / "pdfs" / "physio-B12.pdf"
+    biochem.parent.mkdir()
+    make_pdf(biochem, exam_pages())
+    make_pdf(physio, exam_pages(changed_page=1))
+    mapping = batch_import.parse_mapping([f"biochem*={tmp_path / 'biochem.db'}", f"physio*={tmp_path / 'physio.db'}"])
+    plan = batch_import.plan_imports(batch_import.find_pdfs([str(tmp_path / "pdfs")]), mapping)
+    assert plan == {str(tmp_path / "biochem.db"): [str(biochem)], str(tmp_path / "physio.db"): [str(physio)]}
+
+    # 第一次只跑完生化就中斷了
+    first = batch_import.run_batch({str(tmp_path / "biochem.db"): [str(biochem)]}, course=COURSE, workers=2)
+    assert [(r["skipped"], r["pages"]) for r in first] == [(False, 4)]
+
+    # 重跑整批：生化已經匯入過直接跳過；生理從頭匯入。之後生理的 PDF 多了兩頁，只解析新的兩頁
+    second = batch_import.run_batch(plan, course=COURSE, workers=2)
+    assert sorted((os.path.basename(r["pdf"]), r["skipped"], r["pages"]) for r in second) == [
+        ("biochem-B12.pdf", True, 0), ("physio-B12.pdf", False, 4)]
+    make_pdf(physio, exam_pages(changed_page=1, extra_pages=2))
+    third = batch_import.run_batch(plan, course=COURSE, workers=2)
+    assert sorted((os.path.basename(r["pdf"]), r["skipped"], r["pages"], r["questions"]) for r in third) == [
+        ("biochem-B12.pdf", True, 0, 0), ("physio-B12.pdf", False, 2, 3)]
+
+    # 跟一次匯入整份 PDF 的結果一樣
+    import_exam(physio, tmp_path / "fresh.db", incremental=False)
+    assert snapshot_db(str(tmp_path / "physio.db"))[0] == snapshot_db(str(tmp_path / "fresh.db"))[0]
+
+def test_batch_import_rejects_unmapped_and_duplicate_names(tmp_path):
+    with pytest.raises(ValueError):
+        batch_import.parse_mapping(["no-equals-sign"])
+    with pytest.raises(ValueError):
+        batch_import.plan_imports(["/a/exam.pdf"], [("biochem*", "biochem.db")])
+    with pytest.raises(ValueError):
+        batch_import.plan_imports(["/a/exam.pdf", "/b/exam.pdf"], [], default_db="all.db")
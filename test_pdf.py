@@ -0,0 +1,180 @@
+import pandas as pd
+import pypdfium2 as pdfium
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fpdf import FPDF
+
+import pdf_generator
+
+QUESTIONS = pd.DataFrame({
+    "year": ["B12", "B13"],
+    "teacher": ["顏伯勳", "王志明"],
+    "q_type": ["選擇題", "選擇題"],
+    "content": ["下列關於糖解作用的敘述何者正確？", "檸檬酸循環發生在哪裡？"],
+    "options": ["(A) 產生 ATP (B) 消耗 NADH", "(A) 粒線體 (B) 細胞質"],
+})
+
+def make_font(path, text):
+    """ 用 fontTools 做一個很小的 TrueType 字型，text 裡的每個字 (加上 ASCII) 都畫成一個方塊 """
+    chars = sorted(set(text) | {chr(c) for c in range(32, 127)})
+    names = [f"uni{ord(c):04X}" for c in chars]
+    glyphs = {}
+    for name in [".notdef"] + names:
+        pen = TTGlyphPen(None)
+        pen.moveTo((100, 0))
+        pen.lineTo((100, 700))
+        pen.lineTo((800, 700))
+        pen.lineTo((800, 0))
+        pen.closePath()
+        glyphs[name] = pen.glyph()
+
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder([".notdef"] + names)
+    builder.setupCharacterMap({ord(c): name for c, name in zip(chars, names)})
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (900, 100) for name in glyphs})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": "TestCJK", "styleName": "Regular"})
+    builder.setupOS2(sTypoAscender=800, usWinAscent=800, usWinDescent=200)
+    builder.setupPost()
+    builder.save(str(path))
+
+@pytest.fixture
+def cjk_font(tmp_path, monkeypatch):
+    """ 測試用的中文字型：放在工作目錄下，檔名跟正式的 FONT_PATH 一樣 (平行排版的子行程也找得到) """
+    text = "".join(QUESTIONS.astype(str).to_numpy().ravel()) + "".join(pdf_generator.LAYOUTS["questions"][0]) \
+        + "".join(heading for heading, _ in pdf_generator.LAYOUTS.values()) + "重複次年份：老師資料庫|0123456789"
+    monkeypatch.chdir(tmp_path)
+    make_font(tmp_path / pdf_generator.FONT_PATH, text)
+    pdf_generator._font_cache.clear()
+    yield tmp_path / pdf_generator.FONT_PATH
+    pdf_generator._font_cache.clear()
+
+def pdf_text(data):
+    """ 每一頁的文字 """
+    doc = pdfium.PdfDocument(data)
+    try:
+        return [doc[i].get_textpage().get_text_range() for i in range(len(doc))]
+    finally:
+        doc.close()
+
+def test_cached_font_renders_cjk_like_add_font(cjk_font):
+    cached = pdf_generator.get_pdf_bytes(QUESTIONS)
+    # 同一個行程裡再排一次：上一份文件用到的字不能留在共用的字型裡
+    assert pdf_generator.get_pdf_bytes(QUESTIONS.iloc[1:]) is not None
+    assert pdf_text(pdf_generator.get_pdf_bytes(QUESTIONS)) == pdf_text(cached)
+
+    # 跟每次都用 add_font 重新解析字型的結果一樣
+    original = pdf_generator.add_cached_font
+    def add_font(pdf, font_path=None):
+        pdf.add_font(pdf_generator.FONT_NAME, '', font_path or pdf_generator.FONT_PATH)
+    pdf_generator.add_cached_font = add_font
+    try:
+        expected = pdf_generator.get_pdf_bytes(QUESTIONS)
+    finally:
+        pdf_generator.add_cached_font = original
+    assert pdf_text(cached) == pdf_text(expected)
+
+    text = "".join(pdf_text(cached))
+    for content in QUESTIONS["content"]:
+        assert content in text
+    assert "顏伯勳" in text
+
+def test_cached_font_falls_back_on_other_fpdf_versions(cjk_font, monkeypatch):
+    monkeypatch.setattr(pdf_generator.fpdf, "__version__", "9.0.0")
+    pdf = FPDF()
+    pdf_generator.add_cached_font(pdf)
+    # 不認得的版本就照 fpdf2 正常的方式載入字型 (不是快取的那一份)
+    template, _ = pdf_generator._load_font_template(pdf_generator.FONT_PATH)
+    font = pdf.fonts[pdf_generator.FONT_NAME.lower()]
+    assert font.cw is not template.cw
+    pdf.add_page()
+    pdf.set_font(pdf_generator.FONT_NAME, '', 12)
+    pdf.cell(0, 10, "糖解作用")
+    assert "糖解作用" in pdf_text(bytes(pdf.output()))[0]
+
+def test_pdf_cache_evicts_least_recently_used():
+    cache = pdf_generator.PDFCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"   # a 變成最近用過的
+    cache.put("c", b"1234")            # 超過 10 bytes，丟掉最久沒用的 b
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.total_bytes == 8
+
+    # 同一個 key 放新的內容，大小要重新算
+    cache.put("a", b"12")
+    assert cache.total_bytes == 6
+    # 單一檔案就超過上限的不放進快取，也不會把其他的擠掉
+    cache.put("huge", b"x" * 11)
+    assert "huge" not in cache and "a" in cache and "c" in cache
+
+def test_pdf_cache_creates_each_key_once():
+    cache = pdf_generator.PDFCache()
+    calls = []
+    def make_pdf():
+        calls.append(1)
+        return b"%PDF"
+    assert cache.get_or_create(("db", 1, "B12"), make_pdf) == b"%PDF"
+    assert cache.get_or_create(("db", 1, "B12"), make_pdf) == b"%PDF"
+    assert len(calls) == 1
+    # 資料庫版本變了就是不同的 key，要重新產生
+    cache.get_or_create(("db", 2, "B12"), make_pdf)
+    assert len(calls) == 2
+    # 產生失敗 (沒有字型檔) 時不記住，下次還會再試
+    assert cache.get_or_create("no-font", lambda: None) is None
+    assert "no-font" not in cache
+
+def test_cluster_report_is_labelled_approximate(cjk_font, tmp_path):
+    groups = pd.DataFrame({"主要題目": ["下列關於糖解作用的敘述何者正確？"], "重複次數": [2],
+                           "出現年份": ["B12, B13"], "相似度": ["預先分群 (近似)"]})
+    output = str(tmp_path / "clusters.pdf")
+    assert pdf_generator.export_pdf([groups], output, layout="clusters") == (1, 1)
+    text = pdf_text(output)[0]
+    assert pdf_generator.LAYOUTS["clusters"][0] in text
+    assert "重複 2 次" in text
+
+def many_questions(count):
+    return pd.concat([QUESTIONS] * (count // len(QUESTIONS)), ignore_index=True)
+
+def test_each_export_chunk_starts_a_new_page(cjk_font, tmp_path):
+    questions = many_questions(120)
+    whole = str(tmp_path / "whole.pdf")
+    assert pdf_generator.export_pdf([questions], whole) is not None
+    whole_pages = len(pdf_text(whole))
+
+    chunk_rows = 20
+    chunks = [questions.iloc[start:start + chunk_rows] for start in range(0, len(questions), chunk_rows)]
+    output = str(tmp_path / "chunked.pdf")
+    count, pages = pdf_generator.export_pdf(chunks, output)
+    texts = pdf_text(output)
+    assert (count, pages) == (120, len(texts))
+
+    # 分段排版時每一段從新的一頁開始：頁數是各段自己排的頁數加起來，每段最多多一頁
+    per_chunk = [len(pdf_text(pdf_generator.get_pdf_bytes(chunk))) for chunk in chunks]
+    assert pages == sum(per_chunk)
+    assert whole_pages <= pages <= whole_pages + len(chunks) - 1
+
+    # 題號、頁碼接著算：每一段的第一題在某一頁的開頭 (標題後面)
+    for index in range(0, 120, chunk_rows):
+        page = next(text for text in texts if f"{index + 1}. " in text)
+        assert page.index(f"{index + 1}. ") < page.index(f"{index + 2}. ")
+        assert f"{index}. " not in page or index == 0
+    assert [f"Page {n}" in text for n, text in enumerate(texts, 1)] == [True] * len(texts)
+
+def test_parallel_export_matches_serial(cjk_font, tmp_path):
+    questions = many_questions(60)
+    chunks = [questions.iloc[start:start + 10] for start in range(0, len(questions), 10)]
+    serial = str(tmp_path / "serial.pdf")
+    parallel = str(tmp_path / "parallel.pdf")
+    assert pdf_generator.export_pdf(chunks, serial) == pdf_generator.export_pdf(chunks, parallel, workers=2)
+    # 平行排版的頁碼是合併之後才蓋上去的，內容 (含頁碼) 要跟依序排版一樣
+    assert pdf_text(parallel) == pdf_text(serial)
+
+def test_small_export_stays_serial(cjk_font, tmp_path, monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("分段比 workers 少，不應該開行程池")
+    monkeypatch.setattr(pdf_generator, "_export_parallel", no_pool)
+    output = str(tmp_path / "small.pdf")
+    assert pdf_generator.export_pdf([QUESTIONS], output, workers=4) == (2, 1)
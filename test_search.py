@@ -0,0 +1,454 @@
+import glob
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from rapidfuzz import fuzz
+
+import analytics
+import benchmark
+import check_query_plans
+import clusters
+import db_pool
+import db_utils
+import facets
+import federated
+import jobs
+import search_engine
+import semantic
+import snapshot
+import text_norm
+
+@pytest.fixture
+def sample_db(tmp_path):
+    """ 300 題的題庫：年份、老師有一部分是 NULL (分頁時 NULL 年份排在最後面) """
+    db_path = str(tmp_path / "exam.db")
+    db_utils.init_db(db_path)
+    rng = random.Random(0)
+    db_utils.insert_questions(({
+        "year": rng.choice(["B10", "B11", "B12", "B13", None]),
+        "teacher": rng.choice(["Wang", "Lee", "Wang Jr", None]),
+        "q_type": "選擇題",
+        "question_id": str(i + 1),
+        "question_text": f"Which enzyme number {i}?",
+        "options_text": "(A) yes (B) no\n",
+        "full_text": f"Which enzyme number {i}?\n(A) yes (B) no",
+    } for i in range(300)), db_path)
+    return db_path
+
+@pytest.fixture(params=[False, True], ids=["sql", "snapshot"])
+def use_snapshots(request, monkeypatch):
+    monkeypatch.setattr(search_engine, "_use_snapshots", request.param)
+    return request.param
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"year": "B12"},
+    {"teacher": "Wang"},
+    {"year": "B11", "teacher": "Lee"},
+    {"keyword": "enzyme number 1"},
+    {"keyword": "no such question"},
+])
+@pytest.mark.parametrize("page_size", [1, 7, 50, 500])
+def test_cursor_walk_covers_search_results(sample_db, use_snapshots, filters, page_size):
+    expected = search_engine.search_questions(sample_db, **filters)
+
+    seen = []
+    after = None
+    while True:
+        df, after = search_engine.search_questions_page(sample_db, after=after, page_size=page_size, **filters)
+        assert len(df) <= page_size
+        seen += [(None if pd.isna(year) else year, int(qid)) for year, qid in zip(df["year"], df["id"])]
+        if after is None:
+            break
+
+    # 沒有漏掉、也沒有重複的題目
+    ids = [qid for _, qid in seen]
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == sorted(expected["id"].tolist())
+    # 順序是 (年份新到舊、NULL 最後, id 大到小)
+    keys = [(year is not None, year or "", qid) for year, qid in seen]
+    assert keys == sorted(keys, reverse=True)
+
+def test_teacher_facet_counts_match_search(tmp_path, use_snapshots):
+    db_path = str(tmp_path / "exam.db")
+    db_utils.init_db(db_path)
+    # % 和 _ 要當成一般字元，不能變成 LIKE 的萬用字元
+    names = ["Wang_Li", "WangALi", "Lee%", "Lee Jr", None]
+    db_utils.insert_questions(({
+        "year": "B12", "teacher": names[i % len(names)], "q_type": "選擇題", "question_id": str(i + 1),
+        "question_text": f"Which enzyme number {i}?", "options_text": "(A) yes (B) no\n",
+        "full_text": f"Which enzyme number {i}?",
+    } for i in range(50)), db_path)
+
+    table = facets.load_facets(db_path)
+    counts = facets.teacher_counts(table)
+    assert counts[-1] == (None, 10)
+    assert sum(n for _, n in counts) == facets.count(table) == 50
+    for name, n in counts[:-1]:
+        assert n == 10
+        assert search_engine.count_questions(db_path, teacher=name) == n
+        assert len(search_engine.search_questions(db_path, teacher=name)) == n
+
+def legacy_fuzzy_groups(questions, threshold):
+    """ 原本的雙重迴圈：每一對都用 fuzz.ratio 比 (當作正確答案) """
+    groups = []
+    visited = set()
+    for i in range(len(questions)):
+        if i in visited:
+            continue
+        group = [i]
+        for j in range(i + 1, len(questions)):
+            if j not in visited and fuzz.ratio(questions[i]["content"], questions[j]["content"]) >= threshold:
+                group.append(j)
+                visited.add(j)
+        if len(group) > 1:
+            groups.append({"主要題目": questions[i]["content"], "重複次數": len(group),
+                           "出現年份": ", ".join(questions[k]["year"] for k in group), "相似度": "模糊比對"})
+    return groups
+
+@pytest.mark.parametrize("seed", range(60))
+def test_fuzzy_grouping_matches_pairwise_scan(seed):
+    rng = random.Random(seed)
+    stems = ["".join(rng.choice("abcde甲乙丙") for _ in range(rng.randint(1, 12))) for _ in range(8)]
+    contents = []
+    for i in range(rng.randint(1, 60)):
+        roll = rng.random()
+        if roll < 0.05:
+            contents.append(None)
+        elif roll < 0.1:
+            contents.append("")
+        else:
+            # 從幾個題幹改一兩個字，做出相似但不完全一樣的題目
+            text = list(rng.choice(stems))
+            for _ in range(rng.randint(0, 2)):
+                text[rng.randrange(len(text))] = rng.choice("abcde甲乙丙")
+            contents.append("".join(text))
+    questions = [{"content": text, "year": f"B{i % 4 + 10}"} for i, text in enumerate(contents)]
+    threshold = rng.choice([0, 30, 50, 70, 85, 90, 100, 101])
+
+    expected = legacy_fuzzy_groups(questions, threshold)
+    assert search_engine.fuzzy_duplicate_groups(questions, threshold, "prefix") == expected
+    for chunk_size in (1, 7, 256):
+        assert search_engine.fuzzy_duplicate_groups(questions, threshold, "cdist", chunk_size) == expected
+
+@pytest.mark.parametrize("keyword, expected", [("0%", ["50% off"]), ("_", ["a_b"]), ("%", ["50% off"]), ("50% off", ["50% off"])])
+def test_keyword_treats_wildcards_literally(tmp_path, keyword, expected):
+    db_path = str(tmp_path / "exam.db")
+    db_utils.init_db(db_path)
+    db_utils.insert_questions(({
+        "year": "B12", "teacher": "Wang", "q_type": "選擇題", "question_id": str(i + 1),
+        "question_text": text, "options_text": "", "full_text": text,
+    } for i, text in enumerate(["50% off", "500 off", "a_b", "axb"])), db_path)
+    # 短關鍵字走 LIKE、長關鍵字走全文檢索，兩條路徑都不能把 % 和 _ 當成萬用字元
+    assert search_engine.search_questions(db_path, keyword=keyword)["content"].tolist() == expected
+
+def test_hot_paths_use_indexes(tmp_path):
+    db_path = str(tmp_path / "plan_check.db")
+    check_query_plans.make_sample_db(db_path)
+    # 任何一條搜尋路徑退化成 SCAN 就會 AssertionError
+    check_query_plans.check_all(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        sql, params = search_engine.build_search_query(conn, keyword="糖解")
+        assert check_query_plans.report_known_scan(conn, "短關鍵字 (LIKE)", sql, params)
+        # 全表掃描一定會被抓到 (確認檢查本身有效)
+        with pytest.raises(AssertionError):
+            check_query_plans.assert_no_full_scan(conn, "沒有條件", "SELECT * FROM questions WHERE content LIKE '%a%'")
+    finally:
+        conn.close()
+
+def test_connection_pool_reuses_and_refreshes_connections(sample_db, tmp_path):
+    pool = db_pool.ConnectionPool(max_idle_per_db=1)
+    try:
+        with pool.connection(sample_db) as conn:
+            first = conn
+            # 唯讀連線不能寫入
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM questions")
+        with pool.connection(sample_db) as conn:
+            assert conn is first
+            # 同時借兩條時，第二條是新開的；還回去時超過 max_idle_per_db 的會關掉
+            with pool.connection(sample_db) as other:
+                assert other is not first
+
+        # 匯入新題目後版本會變 (快取的 key 跟著變)，借出來的連線也看得到新題目
+        version = db_pool.db_version(sample_db)
+        db_utils.insert_questions([{
+            "year": "B14", "teacher": "Chen", "q_type": "選擇題", "question_id": "1",
+            "question_text": "Brand new question", "options_text": "", "full_text": "Brand new question",
+        }], sample_db)
+        assert db_pool.db_version(sample_db) != version
+        with pool.connection(sample_db) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0] == 301
+
+        # 整個檔案被換掉 (例如重新匯入) 之後，舊連線要丟掉，不能讀到舊檔案
+        # (先把 WAL 寫回主檔，不然留下來的 -wal 檔會被套用到新檔案上)
+        replacement = str(tmp_path / "replacement.db")
+        db_utils.init_db(replacement)
+        writer = sqlite3.connect(sample_db)
+        writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        writer.close()
+        os.replace(replacement, sample_db)
+        with pool.connection(sample_db) as conn:
+            assert conn is not first
+            assert conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0] == 0
+    finally:
+        pool.close_all()
+
+def make_db(path, texts, year="B12"):
+    db_utils.init_db(path)
+    db_utils.insert_questions(({
+        "year": year, "teacher": "Wang", "q_type": "選擇題", "question_id": str(i + 1),
+        "question_text": text, "options_text": "(A) yes (B) no\n", "full_text": text + "\n(A) yes (B) no",
+    } for i, text in enumerate(texts)), path)
+    return path
+
+@pytest.fixture
+def subject_dbs(tmp_path):
+    return [
+        make_db(str(tmp_path / "biochem.db"), ["Which enzyme limits glycolysis?", "Where is the TCA cycle?",
+                                                "Which enzyme limits glycolysis?"], year="B12"),
+        make_db(str(tmp_path / "physio.db"), ["Where is the TCA cycle?", "What raises cardiac output?"], year="B13"),
+        make_db(str(tmp_path / "pharm.db"), ["Where is the TCA  cycle ?", "Which drug blocks COX?"], year="B11"),
+    ]
+
+def test_federated_search_merges_every_database(subject_dbs):
+    df = federated.federated_search(subject_dbs, keyword="TCA")
+    assert sorted(df["source"]) == ["biochem.db", "pharm.db", "physio.db"]
+    # 沒有關鍵字時依年份排序
+    df = federated.federated_search(subject_dbs)
+    assert len(df) == 7
+    assert df["year"].tolist() == sorted(df["year"], reverse=True)
+    assert federated.federated_search(subject_dbs, keyword="no such question").empty
+
+@pytest.mark.parametrize("attach_limit", [1, 2, 10])
+def test_cross_duplicates_match_across_attach_batches(subject_dbs, monkeypatch, attach_limit):
+    # 資料庫比 attach 上限多的時候要分好幾批，結果要一樣
+    monkeypatch.setattr(federated, "_attach_limit", lambda conn: attach_limit)
+    df = federated.find_cross_duplicates(subject_dbs)
+    rows = {text_norm.normalize(row.content): (row.frequency, row.databases, sorted(row.sources.split(",")))
+            for row in df.itertuples()}
+    # 多了空白的題目正規化之後也算同一題
+    assert rows[text_norm.normalize("Where is the TCA cycle?")] == (3, 3, ["biochem.db", "pharm.db", "physio.db"])
+    assert rows[text_norm.normalize("Which enzyme limits glycolysis?")] == (2, 1, ["biochem.db"])
+
+    only_cross = federated.find_cross_duplicates(subject_dbs, min_databases=2)
+    assert len(only_cross) == 1
+
+def test_cross_fuzzy_duplicates_lists_sources(subject_dbs):
+    df = federated.find_cross_fuzzy_duplicates(subject_dbs, threshold=90, min_databases=2)
+    assert len(df) == 1
+    assert df.iloc[0]["重複次數"] == 3
+    assert sorted(df.iloc[0]["出現資料庫"].split(", ")) == ["biochem.db", "pharm.db", "physio.db"]
+
+def test_stored_clusters_match_live_grouping_after_rebuild(tmp_path):
+    rng = random.Random(1)
+    stems = ["Which enzyme limits glycolysis", "Where does the TCA cycle happen", "What raises cardiac output"]
+    texts = [rng.choice(stems) + " " * rng.randint(0, 2) + rng.choice(["?", "", " now?"]) for _ in range(40)]
+    db_path = make_db(str(tmp_path / "exam.db"), texts)
+    clusters.rebuild_clusters(db_path, threshold=70)
+
+    assert clusters.load_clusters(db_path, 60) is None
+    for threshold in (70, 90):
+        stored = clusters.load_clusters(db_path, threshold)
+        live = search_engine.find_fuzzy_duplicates(db_path, threshold)
+        # 分群的門檻就是 70 的時候，重新分群的結果跟逐題比對一樣；都標成近似結果
+        assert (stored["相似度"] == clusters.APPROXIMATE_LABEL).all()
+        if threshold == 70:
+            assert stored.drop(columns="相似度").equals(live.drop(columns="相似度"))
+        assert stored["重複次數"].sum() <= len(texts)
+
+def test_benchmark_bank_is_reproducible():
+    first = list(benchmark.make_questions(300, seed=3))
+    assert first == list(benchmark.make_questions(300, seed=3))
+    assert first != list(benchmark.make_questions(300, seed=4))
+    # 有一部分是一字不差的重複題，抓重複題才量得到東西
+    stems = [q["question_text"] for q in first]
+    assert len(set(stems)) < len(stems)
+
+def test_benchmark_report_and_compare(tmp_path, monkeypatch, capsys):
+    # 解析器的語料縮小一點，測試才不會跑太久
+    monkeypatch.setattr(benchmark, "bench_parser_throughput",
+                        lambda: {"p50_ms": 1.0, "p95_ms": 1.0, "peak_kb": 1.0, "runs": 1})
+    report = benchmark.run(sizes=[200], repeat=1, fuzzy_max=200, data_dir=str(tmp_path))
+    json.dumps(report)  # 要能存成 JSON 當基準
+    assert {"200/ingest", "200/search_year", "200/search_keyword_short", "200/duplicates",
+            "200/fuzzy_duplicates", "parser"} <= set(report["results"])
+    assert all(r["p50_ms"] >= 0 and r["runs"] >= 1 for r in report["results"].values() if "p50_ms" in r)
+
+    old = {"results": {"a": {"p50_ms": 10.0}, "b": {"p50_ms": 10.0}, "c": {"p50_ms": 10.0}, "gone": {"p50_ms": 1.0}}}
+    new = {"results": {"a": {"p50_ms": 13.0}, "b": {"p50_ms": 11.0}, "c": {"p50_ms": 5.0},
+                       "new": {"p50_ms": 99.0}, "ingest": {"seconds": 1.0}}}
+    # 只有變慢超過 20% 的算退步；新增、刪掉、沒有 p50 的項目不比
+    assert benchmark.compare(old, new) == ["a"]
+    assert benchmark.compare(old, new, tolerance=0.05) == ["a", "b"]
+
+def wait_for(runner, job_id, timeout=60):
+    """ 等背景工作跑完，回傳最後的狀態 """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = runner.status(job_id)
+        if job["status"] not in jobs.ACTIVE:
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"工作 {job_id} 沒有在 {timeout} 秒內跑完")
+
+@pytest.fixture
+def job_runner(tmp_path):
+    runner = jobs.JobRunner(jobs_db=str(tmp_path / "jobs.db"), result_dir=str(tmp_path / "results"), max_workers=1)
+    yield runner
+    runner.shutdown()
+
+def test_semantic_index_and_clusters_run_as_jobs(job_runner, tmp_path):
+    db_path = make_db(str(tmp_path / "exam.db"), ["Which enzyme limits glycolysis?", "Which enzyme limits glycolysis ?",
+                                                   "What raises cardiac output?"])
+    job_id = job_runner.submit("semantic_index", db_path=db_path, index_mtime=None)
+    assert wait_for(job_runner, job_id)["status"] == "done"
+    assert job_runner.result(job_id) == 3
+    assert semantic.has_index(db_path)
+
+    index_mtime = os.path.getmtime(semantic.vectors_path(db_path))
+    job_id = job_runner.submit("semantic_clusters", db_path=db_path, threshold=0.9, index_mtime=index_mtime)
+    assert wait_for(job_runner, job_id)["status"] == "done"
+    df = job_runner.result(job_id)
+    assert df["重複次數"].tolist() == [2]
+    # 索引重建過 (修改時間不一樣) 就是新的工作，不會拿到舊的分群結果
+    assert job_runner.submit("semantic_clusters", db_path=db_path, threshold=0.9, index_mtime=index_mtime + 1) != job_id
+
+def test_term_stats_match_a_scan_of_the_questions(tmp_path):
+    db_path = str(tmp_path / "exam.db")
+    db_utils.init_db(db_path)
+    rng = random.Random(2)
+    rows = []
+    for i in range(200):
+        terms = rng.sample(["糖解作用", "酮體", "NADH", "acetyl-CoA", "LDL", "glycogen"], 2)
+        rows.append({
+            "year": rng.choice(["B9", "B10", "B11"]), "teacher": rng.choice(["Wang_Li", "WangALi", "Lee"]),
+            "q_type": "選擇題", "question_id": str(i + 1),
+            "question_text": f"Which statement about {terms[0]} is correct?",
+            "options_text": f"(A) {terms[1]} (B) none\n", "full_text": "",
+        })
+    db_utils.insert_questions(rows, db_path)
+    analytics.rebuild_term_stats(db_path)
+    assert analytics.list_years(db_path) == ["B9", "B10", "B11"]
+
+    def scan(teacher=None, years=None):
+        counts = {}
+        selected = [r for r in rows if (teacher is None or teacher in r["teacher"])
+                    and (years is None or r["year"] in years)]
+        for r in selected:
+            for term in analytics.extract_terms(f"{r['question_text']}\n{r['options_text']}"):
+                counts[term] = counts.get(term, 0) + 1
+        return counts, len(selected)
+
+    # 老師名字裡的 _ 是一般字元；年份範圍照數字比 (B9 < B10)
+    for teacher, year_from, year_to, years in [(None, None, None, None), ("Wang_Li", None, None, None),
+                                               ("Lee", "B9", "B10", {"B9", "B10"}), (None, "B10", None, {"B10", "B11"})]:
+        expected, total = scan(teacher, years)
+        df = analytics.top_terms(db_path, teacher, year_from, year_to, limit=100)
+        assert dict(zip(df["關鍵詞"], df["題數"])) == expected
+        assert df["占比"].tolist() == [round(n / total, 3) for n in df["題數"]]
+
+    trending = analytics.trending_terms(db_path, min_count=1, limit=100)
+    now, now_total = scan(years={"B11"})
+    before, before_total = scan(years={"B9", "B10"})
+    for row in trending.itertuples():
+        assert row.今年題數 == now[row.關鍵詞]
+        assert row.以前題數 == before.get(row.關鍵詞, 0)
+        assert row.成長倍數 == round(((row.今年題數 + 1) / (now_total + 1)) / ((row.以前題數 + 1) / (before_total + 1)), 2)
+
+def test_job_cleanup_only_fails_jobs_of_stopped_runners(tmp_path):
+    jobs_db = str(tmp_path / "jobs.db")
+    first = jobs.JobRunner(jobs_db=jobs_db, result_dir=str(tmp_path / "results"), max_workers=1)
+    conn = sqlite3.connect(jobs_db)
+    rows = [("alive", first.runner_id), ("orphan", "runner-that-never-beat"), ("legacy", None)]
+    conn.executemany("INSERT INTO jobs (id, kind, params, status, runner, created_at) VALUES (?, 'x', '{}', 'running', ?, 0)",
+                     rows)
+    conn.commit()
+
+    # 另一個 JobRunner 啟動時，不能把還活著的 JobRunner 正在跑的工作標成失敗
+    second = jobs.JobRunner(jobs_db=jobs_db, result_dir=str(tmp_path / "results"), max_workers=1)
+    try:
+        status = dict(conn.execute("SELECT id, status FROM jobs"))
+        assert status == {"alive": "running", "orphan": "failed", "legacy": "failed"}
+
+        # 第一個 JobRunner 太久沒有心跳 (例如整個行程被砍掉)，它的工作就會被標成失敗
+        conn.execute("UPDATE runners SET heartbeat = 0 WHERE id = ?", (first.runner_id,))
+        conn.commit()
+        second._fail_orphaned_jobs()
+        assert conn.execute("SELECT status FROM jobs WHERE id = 'alive'").fetchone()[0] == "failed"
+    finally:
+        conn.close()
+        first.shutdown()
+        second.shutdown()
+
+def test_concurrent_snapshot_builds_do_not_collide(sample_db, monkeypatch):
+    # 第一個建快照的人寫完暫存檔、還沒改名時，第二個人從頭到尾建完一次：
+    # 兩個人的暫存檔不能是同一個檔案，不然第一個人改名時會找不到 (或改到別人寫的內容)
+    paused = threading.Event()
+    resume = threading.Event()
+    real_replace = os.replace
+
+    def slow_replace(src, dst):
+        if threading.current_thread().name == "first":
+            paused.set()
+            resume.wait(10)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", slow_replace)
+    errors = []
+    def build_first():
+        try:
+            snapshot.build(sample_db)
+        except Exception as e:
+            errors.append(e)
+    first = threading.Thread(target=build_first, name="first")
+    first.start()
+    assert paused.wait(10)
+    assert snapshot.build(sample_db) == 300
+    resume.set()
+    first.join()
+    assert errors == []
+
+    snap = snapshot.Snapshot(snapshot.snapshot_path(sample_db))
+    assert len(snap.contents(np.arange(300))) == 300
+    assert glob.glob(snapshot.snapshot_path(sample_db) + ".*") == []
+
+def facet_rows(db_path):
+    """ (篩選統計表, 直接從題目表格算出來的統計) """
+    conn = sqlite3.connect(db_path)
+    try:
+        stored = conn.execute("SELECT year, teacher, q_type, questions FROM question_facets").fetchall()
+        scanned = conn.execute("SELECT year, teacher, q_type, COUNT(*) FROM questions "
+                               "GROUP BY year, teacher, q_type").fetchall()
+    finally:
+        conn.close()
+    return sorted(stored, key=repr), sorted(scanned, key=repr)
+
+def test_facet_triggers_track_inserts_updates_and_deletes(sample_db):
+    stored, scanned = facet_rows(sample_db)
+    assert stored == scanned
+
+    conn = sqlite3.connect(sample_db)
+    # 改年份 / 老師 (包括改成 NULL、從 NULL 改回來)、刪題目，統計表都要跟著變，數到 0 的組合要刪掉
+    conn.execute("UPDATE questions SET teacher = NULL WHERE teacher = 'Lee' AND year = 'B10'")
+    conn.execute("UPDATE questions SET year = 'B14' WHERE year IS NULL AND teacher = 'Wang'")
+    conn.execute("UPDATE questions SET q_type = '非選擇題' WHERE id % 7 = 0")
+    conn.execute("DELETE FROM questions WHERE year = 'B11'")
+    conn.commit()
+    conn.close()
+    stored, scanned = facet_rows(sample_db)
+    assert stored == scanned
+    assert all(n > 0 for *_, n in stored)
+
+    # 題目全部刪掉 (重新匯入) 之後統計表也要是空的
+    db_utils.clear_db(sample_db)
+    assert facet_rows(sample_db) == ([], [])
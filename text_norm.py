@@ -0,0 +1,51 @@
+#題目文字正規化：同一題只差空白、全形半形、標點，正規化之後就會一模一樣
+import hashlib
+import re
+import unicodedata
+
+# 正規化規則改過的話要把這個數字加 1，舊資料庫會自動重算 content_norm
+NORM_VERSION = 2
+
+# 選項代號，例如 (A)、(b)、（C）(NFKC 之後全形括號會變成半形)
+OPTION_LETTER = re.compile(r"\(\s*[A-Ea-e]\s*\)")
+# 「字」：英文字母、數字、希臘字母等等，不含中日韓文字 (中文本來就不靠空白分詞)
+_WORD = r"[^\W_\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]"
+# 兩個字中間的空白 (第 1 組) 留一個，其他地方的空白全部拿掉
+WHITESPACE = re.compile(rf"(?<={_WORD})(\s+)(?={_WORD})|\s+")
+
+def _is_punctuation(ch):
+    # Unicode 分類 P 開頭的都是標點 (，。、「」“”() 等等)
+    return unicodedata.category(ch).startswith("P")
+
+def normalize(text):
+    """
+    把題目文字轉成比對用的標準形式：
+    1. NFKC：全形英數、全形標點轉成半形 (Ａ→A、（→()
+    2. 拿掉選項代號 (A)(B)...
+    3. 標點符號當成空白 (只差一個逗號、引號樣式不同也算同一題)
+    4. 英文單字、數字之間的空白縮成一個 ("not a" 跟 "nota" 不一樣)，其他空白全部拿掉
+       (PDF 抽出來的空白、換行位置常常不一樣，中文本來也不靠空白分詞)
+    5. 英文字母不分大小寫
+    """
+    if text is None:
+        return None
+    text = unicodedata.normalize("NFKC", text)
+    text = OPTION_LETTER.sub("", text)
+    text = "".join(" " if _is_punctuation(ch) else ch for ch in text)
+    text = WHITESPACE.sub(lambda m: " " if m.group(1) else "", text)
+    return text.casefold()
+
+def norm_hash(text):
+    """ 正規化後文字的雜湊值 (SHA-1)，抓重複題時用它分組 """
+    norm = normalize(text)
+    if norm is None:
+        return None
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+# --- 測試區 ---
+if __name__ == "__main__":
+    a = "下列關於 DNA 的敘述，何者正確？"
+    b = "下列關於ＤＮＡ的敘述,何者正確?\n"
+    print(normalize(a))
+    print(normalize(b))
+    print("同一題" if norm_hash(a) == norm_hash(b) else "不同題")